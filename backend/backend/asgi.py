@@ -2,4 +2,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# Serve the read endpoints with the async views (equipment.async_views) under ASGI.
+os.environ.setdefault('EQUIPMENT_ASYNC_VIEWS', 'True')
 application = get_asgi_application()
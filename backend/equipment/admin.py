@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import EquipmentDataset, AuthToken
+from .models import EquipmentDataset, AuthToken, IngestJob, UploadSession
 
 @admin.register(AuthToken)
 class AuthTokenAdmin(admin.ModelAdmin):
@@ -7,5 +7,15 @@ class AuthTokenAdmin(admin.ModelAdmin):
 
 @admin.register(EquipmentDataset)
 class EquipmentDatasetAdmin(admin.ModelAdmin):
-    list_display = ['id', 'name', 'uploaded_at', 'total_count']
-    list_filter = ['uploaded_at']
+    list_display = ['id', 'name', 'uploaded_by', 'uploaded_at', 'status', 'total_count', 'revision', 'size_bytes', 'last_accessed_at', 'archived_at']
+    list_filter = ['uploaded_at', 'status']
+
+@admin.register(IngestJob)
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'dataset', 'status', 'rows_parsed', 'created_at', 'finished_at']
+    list_filter = ['status']
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['key', 'user', 'filename', 'size', 'status', 'updated_at']
+    list_filter = ['status']
@@ -0,0 +1,37 @@
+"""Combined statistics over several datasets, merged from their stored sketches."""
+from __future__ import annotations
+
+from .models import EquipmentDataset
+from .retention import dataset_table
+from .services import table_sketches
+from .sketches import merge_sketches
+
+DEFAULT_PERCENTILES = (25, 50, 75, 95, 99)
+
+
+def dataset_sketches(dataset: EquipmentDataset) -> dict:
+    """Stored sketches of ``dataset``; datasets ingested before sketches existed are backfilled once."""
+    if dataset.sketches or not dataset.file:
+        return dataset.sketches
+    dataset.sketches = table_sketches(dataset_table(dataset))
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(sketches=dataset.sketches)
+    return dataset.sketches
+
+
+def combined_statistics(datasets, percentiles=DEFAULT_PERCENTILES) -> dict:
+    """
+    Pooled count/mean/min/max/variance/percentiles per numeric column and merged type
+    counts for ``datasets``. Cost is proportional to the number of datasets, not rows.
+    """
+    datasets = list(datasets)
+    merged = merge_sketches(dataset_sketches(d) for d in datasets)
+    type_counts: dict[str, int] = {}
+    for d in datasets:
+        for k, v in (d.summary_json or {}).get('type_distribution', {}).items():
+            type_counts[k] = type_counts.get(k, 0) + v
+    return {
+        'datasets': [d.pk for d in datasets],
+        'total_count': sum(d.total_count for d in datasets),
+        'columns': {col: sketch.statistics(percentiles) for col, sketch in merged.items()},
+        'type_distribution': dict(sorted(type_counts.items(), key=lambda kv: -kv[1])),
+    }
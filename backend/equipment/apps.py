@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class EquipmentConfig(AppConfig):
+    name = 'equipment'
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401  (metrics hooks query counting into new connections)
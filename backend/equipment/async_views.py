@@ -0,0 +1,227 @@
+"""
+Async versions of the public read endpoints, routed instead of the DRF views in
+``views`` when EQUIPMENT_ASYNC_VIEWS is on (the default under ASGI; see backend/asgi.py).
+
+URLs, bodies, ETags and the response cache are the same. Database access goes through
+the async ORM or ``sync_to_async``, CPU-bound work (parsing, row selection, encoding,
+PDF rendering) runs in the ``offload`` process pool and files are read in a thread, so
+one event loop keeps hundreds of slow clients streaming without holding a thread each.
+Large tables are encoded a few batches ahead of the client, never further.
+"""
+from __future__ import annotations
+import asyncio
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+from django.views import View
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .auth import resolve_token
+from .httpcache import AsyncCachedGetMixin
+from .metrics import rows_processed, timed
+from .models import EquipmentDataset
+from .columnar import columnar_path, open_table
+from .offload import get_pool, prepare_table, render_batch, render_head, run_cpu, select_table
+from .query import QueryError, parse_query
+from .renderers import TABLE_RENDERERS, check_format, iter_batches
+from .jobs import queue_report
+from .reports import cached_report, cached_report_path, report_etag
+from .retention import dataset_table, mark_accessed
+from .serializers import EquipmentDatasetSerializer
+from .views import (
+    CACHED_PAGE_ROWS, _not_modified, _with_etag, data_etag, report_pending_headers, report_pending_payload,
+    summary_payload,
+)
+
+STREAM_PREFETCH = 2  # table batches encoded ahead of the client
+FILE_CHUNK_BYTES = 64 * 1024
+
+
+def _json_response(data, status=200):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+    response['Vary'] = 'Accept'
+    return response
+
+
+def _not_found():
+    return _json_response({'detail': 'Not found.'}, status=404)
+
+
+def _not_ready_response(dataset):
+    return _json_response({'error': f'Dataset is {dataset.status}', 'status': dataset.status}, status=409)
+
+
+async def _get_dataset(pk):
+    try:
+        return await EquipmentDataset.objects.aget(pk=pk)
+    except EquipmentDataset.DoesNotExist:
+        return None
+
+
+def _build_in_pool(file_path):
+    get_pool().submit(prepare_table, file_path).result()
+
+
+async def _prepare_table(dataset):
+    """``retention.dataset_table`` if the columnar copy must be built first, building it in the worker pool."""
+    if dataset.archived_at is not None or open_table(columnar_path(dataset.file.path)) is None:
+        await sync_to_async(dataset_table)(dataset, _build_in_pool)
+
+
+async def stream_table(file_path, renderer, rows, meta):
+    """Encode ``rows`` in the worker pool, at most STREAM_PREFETCH batches ahead of what was sent."""
+    yield await run_cpu(render_head, file_path, renderer.format, meta)
+    batches = enumerate(iter_batches(rows))  # batches are never empty, so only the first is first
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < STREAM_PREFETCH:
+                item = next(batches, None)
+                if item is None:
+                    break
+                i, batch = item
+                pending.append(asyncio.ensure_future(run_cpu(render_batch, file_path, renderer.format, batch, i == 0)))
+            if not pending:
+                break
+            chunk = await pending.popleft()
+            if chunk:
+                yield chunk
+    finally:
+        for future in pending:  # client went away
+            future.cancel()
+    tail = renderer.tail()
+    if tail:
+        yield tail
+
+
+async def stream_file(f, chunk_size=FILE_CHUNK_BYTES):
+    """Yield the rest of the open binary file ``f``, reading from a thread; closes it."""
+    try:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+    finally:
+        f.close()
+
+
+class AsyncHistoryListView(AsyncCachedGetMixin, View):
+    """Async ``HistoryListView``."""
+    cache_scope = 'history'
+
+    async def get(self, request):
+        datasets = [d async for d in EquipmentDataset.objects.order_by('-uploaded_at')[:5]]
+        return _json_response(EquipmentDatasetSerializer(datasets, many=True).data)
+
+
+class AsyncSummaryView(AsyncCachedGetMixin, View):
+    """Async ``SummaryView``."""
+    cache_scope = 'summary'
+
+    async def get(self, request, pk):
+        dataset = await _get_dataset(pk)
+        if dataset is None:
+            return _not_found()
+        payload, etag = summary_payload(dataset)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        return _with_etag(_json_response(payload), etag)
+
+
+class AsyncDataTableView(AsyncCachedGetMixin, View):
+    """
+    Async ``DataTableView``: rows are selected and encoded in the worker pool, a page in
+    one call, larger selections batch by batch as the client reads.
+    """
+    cache_scope = 'data'
+    records_access = True
+
+    async def get(self, request, pk):
+        try:
+            check_format(request.GET.get('format'))
+            renderer, _ = DefaultContentNegotiation().select_renderer(Request(request), [r() for r in TABLE_RENDERERS])
+        except NotAcceptable as e:
+            return _json_response({'detail': str(e.detail)}, status=406)
+        dataset = await _get_dataset(pk)
+        if dataset is None:
+            return _not_found()
+        if not dataset.is_ready:
+            return _not_ready_response(dataset)
+        if not dataset.file:
+            return _json_response({'data': [], 'total_count': 0, 'filtered_count': 0})
+        query_string = request.META.get('QUERY_STRING', '')
+        etag = data_etag(dataset, query_string, renderer.media_type)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            await sync_to_async(mark_accessed)(dataset)  # a revalidated read is still a read
+            return not_modified
+        try:
+            parse_query(query_string)  # reject bad queries before touching anything
+        except QueryError as e:
+            return _json_response({'error': str(e)}, status=400)
+        await sync_to_async(mark_accessed)(dataset)
+        file_path = dataset.file.path
+        max_rows = getattr(settings, 'EQUIPMENT_RESPONSE_CACHE_MAX_ROWS', CACHED_PAGE_ROWS)
+        try:
+            await _prepare_table(dataset)
+            with timed('data.select'):
+                meta, rows, body = await run_cpu(select_table, file_path, query_string, renderer.format, max_rows)
+        except QueryError as e:
+            return _json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            return _json_response({'error': str(e), 'data': []}, status=500)
+        selected = len(range(meta['total_count'])[rows]) if isinstance(rows, slice) else len(rows)
+        rows_processed.inc(selected, stage='data')
+        content_type = renderer.media_type + (f'; charset={renderer.charset}' if renderer.charset else '')
+        if body is not None:
+            response = HttpResponse(body, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(stream_table(file_path, renderer, rows, meta), content_type=content_type)
+        return _with_etag(response, etag, vary='Accept')
+
+
+class AsyncReportPDFView(View):
+    """Async ``ReportPDFView``: served from the report cache, sent from a thread-read file."""
+
+    async def get(self, request, pk):
+        token_key = request.GET.get('token') or request.headers.get('Authorization', '').replace('Token ', '')
+        user = await sync_to_async(resolve_token)(token_key.strip())
+        if user is None:
+            return _json_response({'error': 'Authentication required'}, status=401)
+        request.user = user
+        dataset = await _get_dataset(pk)
+        if dataset is None:
+            return _not_found()
+        if not dataset.is_ready:
+            return _not_ready_response(dataset)
+        await sync_to_async(mark_accessed)(dataset)
+        etag = report_etag(dataset)
+        path = cached_report_path(dataset)
+        if path.exists():
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=int(path.stat().st_mtime),
+            )
+            if not_modified is not None:
+                return not_modified
+        path = await asyncio.to_thread(cached_report, dataset)
+        if path is None:
+            queue_report(dataset.pk)  # rendered in parts in the worker pool; a job thread merges them
+            response = _json_response(report_pending_payload(dataset), status=202)
+            for header, value in report_pending_headers().items():
+                response[header] = value
+            return response
+        f = await asyncio.to_thread(open, path, 'rb')
+        st = path.stat()
+        response = StreamingHttpResponse(stream_file(f), content_type='application/pdf')
+        response['Content-Length'] = str(st.st_size)
+        response['Content-Disposition'] = content_disposition_header(True, f'report_{dataset.id}.pdf')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(st.st_mtime)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -1,7 +1,104 @@
 """Custom token authentication using equipment.AuthToken (no djangorestframework-authtoken)."""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework import authentication
 from .models import AuthToken
 
+DEFAULT_TTL = 300
+DEFAULT_SIZE = 1024
+
+
+class TokenCache:
+    """
+    Token key -> user resolution cache: an in-process LRU with TTL, or, when
+    EQUIPMENT_TOKEN_CACHE_ALIAS names a Django cache, that shared cache so every
+    worker sees the same entries and invalidations.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, alias=None):
+        self.maxsize = maxsize if maxsize is not None else getattr(settings, 'EQUIPMENT_TOKEN_CACHE_SIZE', DEFAULT_SIZE)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'EQUIPMENT_TOKEN_CACHE_TTL', DEFAULT_TTL)
+        self.alias = alias if alias is not None else getattr(settings, 'EQUIPMENT_TOKEN_CACHE_ALIAS', None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _shared_key(key):
+        return 'equipment:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        if self.alias:
+            user = caches[self.alias].get(self._shared_key(key))
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                user = entry[0] if entry is not None else None
+        with self._lock:
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return copy.copy(user) if user is not None else None
+
+    def set(self, key, user):
+        if self.alias:
+            caches[self.alias].set(self._shared_key(key), user, self.ttl)
+            return
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        if self.alias:
+            caches[self.alias].delete(self._shared_key(key))
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+token_cache = TokenCache()
+
+
+def resolve_token(key):
+    """Return the active user for a token key, or None. Cached; see TokenCache."""
+    if not key:
+        return None
+    user = token_cache.get(key)
+    if user is not None:
+        return user
+    try:
+        user = AuthToken.objects.select_related('user').get(key=key).user
+    except AuthToken.DoesNotExist:
+        return None
+    if not user.is_active:
+        return None
+    token_cache.set(key, user)
+    return user
+
 
 class TokenAuthentication(authentication.BaseAuthentication):
     keyword = 'Token'
@@ -16,8 +113,8 @@ class TokenAuthentication(authentication.BaseAuthentication):
             return None
         if not key:
             return None
-        try:
-            token = AuthToken.objects.select_related('user').get(key=key)
-            return (token.user, token)
-        except AuthToken.DoesNotExist:
+        user = resolve_token(key)
+        if user is None:
             return None
+        # request.auth stays an AuthToken; an unsaved one built from the cached user costs no query.
+        return (user, AuthToken(key=key, user=user))
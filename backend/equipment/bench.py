@@ -0,0 +1,175 @@
+"""Synthetic equipment CSVs and stage timing for ``manage.py bench``."""
+from __future__ import annotations
+import os
+import re
+import resource
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Header spellings real uploads use; normalize_column_name maps each back to EXPECTED_COLUMNS.
+MESSY_HEADERS = [' equipment name ', 'TYPE', 'Flow Rate (m3/h)', 'pressure (bar)', 'Temp (C)']
+CLEAN_HEADERS = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
+EQUIPMENT_TYPES = ['Reactor', 'Centrifugal Pump', 'Heat Exchanger', 'Compressor', 'Valve',
+                   'Distillation Column', 'Storage Tank', 'Separator', 'Mixer', 'Boiler', 'Condenser', 'Filter']
+JUNK_VALUES = np.array(['', 'n/a', 'NaN', '-', 'ERR', '#VALUE!', '?', 'null'], dtype=object)
+# (mean, std) per numeric column, roughly matching sample_equipment_data.csv
+NUMERIC_PROFILES = [(160.0, 60.0), (2.1, 1.3), (65.0, 35.0)]
+GENERATE_CHUNK_ROWS = 500_000
+
+_SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kKmM]?)\s*$')
+
+
+def parse_size(value: str) -> int:
+    """'1000', '10K', '2.5M' -> row count."""
+    m = _SIZE_RE.match(value)
+    if not m:
+        raise ValueError(f'Invalid row count: {value!r}')
+    scale = {'': 1, 'k': 1_000, 'm': 1_000_000}[m.group(2).lower()]
+    return int(float(m.group(1)) * scale)
+
+
+def generate_csv(path, rows: int, seed: int = 0, messy: bool = True, junk_rate: float = 0.01):
+    """
+    Write a deterministic equipment CSV of ``rows`` rows to ``path``. With ``messy``,
+    headers use non-canonical spellings and about ``junk_rate`` of the numeric cells
+    (and Type cells) are blanks or junk strings, as in hand-exported spreadsheets.
+    The same arguments always produce the same file.
+    """
+    rng = np.random.default_rng(seed)
+    types = np.array(EQUIPMENT_TYPES, dtype=object)
+    headers = MESSY_HEADERS if messy else CLEAN_HEADERS
+    tmp = Path(f'{path}.tmp')
+    with open(tmp, 'w', newline='') as f:
+        for start in range(0, max(rows, 1), GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - start)
+            if n <= 0:
+                pd.DataFrame(columns=headers).to_csv(f, index=False)
+                break
+            type_idx = rng.integers(0, len(types), n)
+            cols = {
+                headers[0]: 'EQ-' + pd.Series(np.arange(start, start + n)).astype(str),
+                headers[1]: pd.Series(types[type_idx]),
+            }
+            for header, (mean, std) in zip(headers[2:], NUMERIC_PROFILES):
+                # Each type gets its own offset so per-type statistics differ.
+                values = np.round(np.abs(rng.normal(mean, std, n) + (type_idx - len(types) / 2) * std / 10), 2)
+                col = pd.Series(values)
+                if messy:
+                    junk = rng.random(n) < junk_rate
+                    col = col.astype(object)
+                    col[junk] = JUNK_VALUES[rng.integers(0, len(JUNK_VALUES), int(junk.sum()))]
+                cols[header] = col
+            if messy:
+                cols[headers[1]][rng.random(n) < junk_rate / 2] = ''
+            pd.DataFrame(cols).to_csv(f, index=False, header=start == 0)
+    os.replace(tmp, path)
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (Linux /proc; peak RSS elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+
+class Stage:
+    """Measurements for one timed stage; see ``measure``."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.peak_rss = 0
+        self.start_rss = 0
+        self.rows = 0
+        self.bytes = 0
+        self.wire_bytes = 0  # body bytes after Content-Encoding, for the compressed fetch stages
+        self.first_byte_s = None
+        self.requests = 0
+        self.errors = 0
+        self.latencies: list[float] = []  # per-request seconds, for the concurrent db stages
+        self.extra: dict = {}
+
+    def to_dict(self) -> dict:
+        d = {
+            'seconds': round(self.seconds, 4),
+            'peak_rss_mb': round(self.peak_rss / 2**20, 1),
+            'rss_growth_mb': round(max(self.peak_rss - self.start_rss, 0) / 2**20, 1),
+            'rows': self.rows,
+        }
+        if self.seconds > 0:
+            d['rows_per_s'] = round(self.rows / self.seconds)
+            if self.bytes:
+                d['bytes'] = self.bytes
+                d['mb_per_s'] = round(self.bytes / 2**20 / self.seconds, 2)
+            if self.requests:
+                d['ms_per_request'] = round(self.seconds / self.requests * 1000, 2)
+        if self.wire_bytes:
+            d['wire_bytes'] = self.wire_bytes
+            if self.bytes:
+                d['compression_ratio'] = round(self.bytes / self.wire_bytes, 2)
+        if self.first_byte_s is not None:
+            d['first_byte_s'] = round(self.first_byte_s, 4)
+        if self.latencies or self.errors:
+            d.update(latency_stats(self.latencies, self.seconds))
+            d['errors'] = self.errors
+        d.update(self.extra)
+        return d
+
+
+def latency_stats(latencies: list[float], wall: float) -> dict:
+    """Throughput and p50/p95 latency of requests that ran concurrently for ``wall`` seconds."""
+    ok = sorted(latencies)
+    return {
+        'requests': len(ok),
+        'per_s': round(len(ok) / wall, 1) if wall > 0 else None,
+        'p50_ms': round(statistics.median(ok) * 1000, 1) if ok else None,
+        'p95_ms': round(ok[max(int(len(ok) * 0.95) - 1, 0)] * 1000, 1) if ok else None,
+    }
+
+
+@contextmanager
+def measure(name: str, interval: float = 0.01):
+    """
+    Time the enclosed block and sample RSS every ``interval`` seconds from a helper
+    thread. The caller fills in ``rows`` (and ``bytes`` where relevant) on the yielded Stage.
+    """
+    stage = Stage(name)
+    stage.start_rss = stage.peak_rss = current_rss()
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            stage.peak_rss = max(stage.peak_rss, current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage.seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        stage.peak_rss = max(stage.peak_rss, current_rss())
+
+
+def compare(results: dict, baseline: dict) -> list[tuple[str, str, float, float, float]]:
+    """``(size, stage, baseline_s, current_s, change_pct)`` for every stage present in both runs."""
+    rows = []
+    for size, stages in results.get('runs', {}).items():
+        base_stages = baseline.get('runs', {}).get(size, {})
+        for stage, m in stages.items():
+            if stage in base_stages and base_stages[stage]['seconds'] > 0:
+                before, after = base_stages[stage]['seconds'], m['seconds']
+                rows.append((size, stage, before, after, (after - before) / before * 100))
+    return rows
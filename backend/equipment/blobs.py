@@ -0,0 +1,137 @@
+"""
+Content-addressed upload storage.
+
+Every upload is hashed (SHA-256 of the bytes as sent) while it streams in, and the
+digest is kept as ``EquipmentDataset.content_sha256``. Uploading bytes that a ready
+dataset already holds skips parsing and storing altogether: the new dataset points at
+the same stored file (and so the same columnar copy) and copies its summary and chart data.
+
+A stored file is shared by every dataset whose ``file`` names it; that count is its
+reference count. Deleting a dataset only removes the file once nothing else names it
+(``unreferenced``), and anything that changes a file in place (appends) first gives
+its dataset a private copy (``unshare``). A shared file's size is charged to its oldest
+dataset only (``settle_blob_sizes``) so retention's byte budget counts it once.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .columnar import columnar_path
+from .models import EquipmentDataset
+from .services import remove_columnar, stored_bytes
+
+READ_BYTES = 1024 * 1024
+
+
+class HashingReader:
+    """File-like wrapper computing the SHA-256 of everything read through it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while piece := f.read(READ_BYTES):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def find_duplicate(sha256: str) -> EquipmentDataset | None:
+    """A ready dataset holding exactly these bytes, row-locked so retention cannot drop it meanwhile."""
+    return (
+        EquipmentDataset.objects.select_for_update()
+        .filter(content_sha256=sha256, status=EquipmentDataset.STATUS_READY)
+        .exclude(file='').exclude(file=None)
+        .order_by('pk').first()
+    )
+
+
+def clone_duplicate(sha256: str, name: str, user) -> EquipmentDataset | None:
+    """
+    Create a dataset sharing the stored file and summary of an existing one with the same
+    content, or return None if there is none. Costs a few queries, whatever the size.
+    """
+    if not sha256:
+        return None
+    with transaction.atomic():
+        source = find_duplicate(sha256)
+        if source is None:
+            return None
+        return EquipmentDataset.objects.create(
+            name=name,
+            uploaded_by=user,
+            file=source.file.name,
+            total_count=source.total_count,
+            summary_json=source.summary_json,
+            sketches=source.sketches,
+            charts=source.charts,
+            size_bytes=0,  # charged to the oldest dataset sharing the file
+            archived_at=source.archived_at,
+            content_sha256=sha256,
+        )
+
+
+def is_shared(dataset: EquipmentDataset) -> bool:
+    return EquipmentDataset.objects.filter(file=dataset.file.name).exclude(pk=dataset.pk).exists()
+
+
+def unreferenced(names) -> set[str]:
+    """The stored file names among ``names`` that no dataset refers to any more."""
+    names = {n for n in names if n}
+    return names - set(EquipmentDataset.objects.filter(file__in=names).values_list('file', flat=True))
+
+
+def settle_blob_sizes(names):
+    """Charge each stored file's size to the oldest dataset using it, and 0 to the others."""
+    for name in {n for n in names if n}:
+        pks = list(EquipmentDataset.objects.filter(file=name).order_by('pk').values_list('pk', flat=True))
+        if not pks:
+            continue
+        EquipmentDataset.objects.filter(pk=pks[0]).update(size_bytes=stored_bytes(default_storage.path(name)))
+        EquipmentDataset.objects.filter(pk__in=pks[1:]).exclude(size_bytes=0).update(size_bytes=0)
+
+
+def unshare(dataset: EquipmentDataset) -> bool:
+    """
+    Copy-on-write: before ``dataset``'s stored file is changed in place, give it a private
+    copy (file and columnar copy) if other datasets share it. Returns whether it copied.
+    """
+    if not dataset.file or not is_shared(dataset):
+        return False
+    old = dataset.file.name
+    src = dataset.file.path
+    name = default_storage.get_available_name(old)
+    dst = default_storage.path(name)
+    shutil.copyfile(src, dst)
+    if columnar_path(src).is_dir():
+        shutil.copytree(columnar_path(src), columnar_path(dst))
+    dataset.file.name = name
+    dataset.size_bytes = stored_bytes(dst)
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(file=name, size_bytes=dataset.size_bytes)
+    settle_blob_sizes([old])
+    return True
+
+
+def remove_blob(name: str):
+    """Delete a stored file and its columnar copy (callers check ``unreferenced`` first)."""
+    path = default_storage.path(name)
+    remove_columnar(path)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
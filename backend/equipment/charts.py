@@ -0,0 +1,268 @@
+"""
+Chart-ready data for a dataset, computed at ingest so clients can draw distributions
+without downloading the table.
+
+``build_charts`` makes one chunked pass over the columnar copy and returns:
+
+- ``histograms``: per numeric column, HISTOGRAM_BINS equal-width bins between the
+  column's min and max at ingest. The edges stay fixed afterwards, so appended rows
+  outside them are counted as ``underflow``/``overflow`` instead of moving the bins.
+- ``box``: per numeric column and equipment type, quartiles, whiskers (1.5 IQR, within
+  min/max) and extrema, read from the running summary sketches.
+- ``scatter``: SCATTER_X against SCATTER_Y, downsampled on a grid of at most
+  MAX_SCATTER_POINTS cells. Each occupied cell keeps its first row and the number of rows
+  in it, so outliers survive and dense regions can be shaded by count.
+
+The histogram counts and scatter grid are kept with the columnar copy (CHARTS_STATE_NAME),
+so ``extend_charts`` only reads the rows an append added. ``downsample`` coarsens the stored
+grid to fewer points for the endpoint's ``?points=``.
+"""
+from __future__ import annotations
+import json
+import math
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from .columnar import columnar_path
+from .services import NUMERIC_COLUMNS, ingest_chunk_rows, load_summary_state, load_table
+
+HISTOGRAM_BINS = 20
+MAX_SCATTER_POINTS = 2000
+DEFAULT_SCATTER_POINTS = 500
+SCATTER_X = 'Pressure'
+SCATTER_Y = 'Temperature'
+CHARTS_STATE_NAME = 'charts_state.json'
+
+
+def _bounds(sketch) -> tuple[float, float] | None:
+    """Histogram/grid range for a column's sketch, widened when every value is the same."""
+    if not sketch.count:
+        return None
+    low, high = float(sketch.min), float(sketch.max)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return low, high
+
+
+def _cells(values: np.ndarray, low: float, high: float, n: int) -> np.ndarray:
+    """Cell index (0..n-1) of each value on ``n`` equal cells over [low, high], clamped."""
+    cells = np.floor((values - low) / (high - low) * n).astype(np.int64)
+    return np.clip(cells, 0, n - 1)
+
+
+def _short(value: float) -> float:
+    return float(f'{value:.6g}')
+
+
+class ChartAccumulator:
+    """Histogram counts and scatter grid, fed chunk by chunk of the columnar copy."""
+
+    def __init__(self, edges: dict[str, list[float]], scatter_bounds: list[float] | None,
+                 grid_size: int = math.isqrt(MAX_SCATTER_POINTS)):
+        self.rows = 0
+        self.edges = edges
+        self.counts = {col: np.zeros(len(e) - 1, dtype=np.int64) for col, e in edges.items()}
+        self.underflow = dict.fromkeys(edges, 0)
+        self.overflow = dict.fromkeys(edges, 0)
+        self.missing = dict.fromkeys(edges, 0)
+        self.scatter_bounds = scatter_bounds  # [x_low, x_high, y_low, y_high]
+        self.grid_size = grid_size
+        self.grid: dict[int, list] = {}  # cell -> [x, y, count]; x, y of the cell's first row
+        self.scatter_total = 0
+
+    @classmethod
+    def for_table(cls, file_path, table) -> 'ChartAccumulator':
+        """Bins and grid over each column's range, from the table's running summary."""
+        accumulator = load_summary_state(file_path, table)
+        totals = {col: sketch.total() for col, sketch in accumulator.sketches.items()}
+        edges = {}
+        for col in NUMERIC_COLUMNS:
+            bounds = _bounds(totals[col]) if col in totals else None
+            if bounds is not None:
+                edges[col] = np.linspace(*bounds, HISTOGRAM_BINS + 1).tolist()
+        scatter_bounds = None
+        if SCATTER_X in edges and SCATTER_Y in edges:
+            scatter_bounds = [*_bounds(totals[SCATTER_X]), *_bounds(totals[SCATTER_Y])]
+        return cls(edges, scatter_bounds)
+
+    def update(self, columns: dict[str, np.ndarray]):
+        for col, edges in self.edges.items():
+            values = np.asarray(columns[col])
+            missing = np.isnan(values)
+            values = values[~missing]
+            self.missing[col] += int(missing.sum())
+            self.underflow[col] += int((values < edges[0]).sum())
+            self.overflow[col] += int((values > edges[-1]).sum())
+            inside = values[(values >= edges[0]) & (values <= edges[-1])]
+            # The last bin is closed on the right, as numpy.histogram's.
+            bins = np.searchsorted(edges, inside, side='right') - 1
+            bins[bins == len(edges) - 1] = len(edges) - 2
+            self.counts[col] += np.bincount(bins, minlength=len(edges) - 1)
+        if self.scatter_bounds is not None:
+            x, y = np.asarray(columns[SCATTER_X]), np.asarray(columns[SCATTER_Y])
+            present = ~(np.isnan(x) | np.isnan(y))
+            x, y = x[present], y[present]
+            self.scatter_total += len(x)
+            x_low, x_high, y_low, y_high = self.scatter_bounds
+            n = self.grid_size
+            cells = _cells(y, y_low, y_high, n) * n + _cells(x, x_low, x_high, n)
+            unique, first, counts = np.unique(cells, return_index=True, return_counts=True)
+            for cell, i, count in zip(unique.tolist(), first.tolist(), counts.tolist()):
+                point = self.grid.get(cell)
+                if point is None:
+                    self.grid[cell] = [_short(x[i]), _short(y[i]), count]
+                else:
+                    point[2] += count
+
+    def histograms(self) -> dict:
+        return {
+            col: {
+                'edges': [_short(e) for e in edges],
+                'counts': self.counts[col].tolist(),
+                'underflow': self.underflow[col],
+                'overflow': self.overflow[col],
+                'missing': self.missing[col],
+            }
+            for col, edges in self.edges.items()
+        }
+
+    def scatter(self) -> dict | None:
+        if self.scatter_bounds is None:
+            return None
+        return {
+            'x': SCATTER_X,
+            'y': SCATTER_Y,
+            'bounds': [_short(b) for b in self.scatter_bounds],
+            'grid_size': self.grid_size,
+            'total': self.scatter_total,
+            'points': [self.grid[cell] for cell in sorted(self.grid)],
+        }
+
+    def to_state(self) -> dict:
+        return {
+            'rows': self.rows,
+            'edges': self.edges,
+            'counts': {col: c.tolist() for col, c in self.counts.items()},
+            'underflow': self.underflow,
+            'overflow': self.overflow,
+            'missing': self.missing,
+            'scatter_bounds': self.scatter_bounds,
+            'grid_size': self.grid_size,
+            'grid': [[cell, *point] for cell, point in self.grid.items()],
+            'scatter_total': self.scatter_total,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'ChartAccumulator':
+        accumulator = cls(state['edges'], state['scatter_bounds'], state['grid_size'])
+        accumulator.rows = state['rows']
+        accumulator.counts = {col: np.asarray(c, dtype=np.int64) for col, c in state['counts'].items()}
+        accumulator.underflow = dict(state['underflow'])
+        accumulator.overflow = dict(state['overflow'])
+        accumulator.missing = dict(state['missing'])
+        accumulator.grid = {cell: [x, y, count] for cell, x, y, count in state['grid']}
+        accumulator.scatter_total = state['scatter_total']
+        return accumulator
+
+
+def charts_state_path(file_path) -> Path:
+    return columnar_path(file_path) / CHARTS_STATE_NAME
+
+
+def _save_state(file_path, accumulator: ChartAccumulator):
+    path = charts_state_path(file_path)
+    tmp = path.with_name(f'{path.name}.tmp-{uuid.uuid4().hex}')
+    tmp.write_text(json.dumps(accumulator.to_state()))
+    os.replace(tmp, path)
+
+
+def box_stats(file_path, table) -> dict:
+    """Per numeric column and type: count, mean, min, q1, median, q3, max and whiskers."""
+    accumulator = load_summary_state(file_path, table)
+    ranked = sorted(accumulator.types.items(), key=lambda kv: -accumulator.type_counts[kv[1]])
+    out = {}
+    for col, grouped in accumulator.sketches.items():
+        out[col] = {}
+        for name, i in ranked:
+            sketch = grouped.sketch(i)
+            if not sketch.count:
+                continue
+            q1, median, q3 = sketch.quantile(0.25), sketch.quantile(0.5), sketch.quantile(0.75)
+            iqr = q3 - q1
+            out[col][name] = {'count': sketch.count, **{key: _short(value) for key, value in {
+                'mean': sketch.mean,
+                'min': sketch.min,
+                'q1': q1,
+                'median': median,
+                'q3': q3,
+                'max': sketch.max,
+                'whisker_low': max(sketch.min, q1 - 1.5 * iqr),
+                'whisker_high': min(sketch.max, q3 + 1.5 * iqr),
+            }.items()}}
+    return out
+
+
+def _feed(accumulator: ChartAccumulator, table, start: int):
+    columns = [c for c in NUMERIC_COLUMNS if c in table.column_names]
+    step = ingest_chunk_rows()
+    for lo in range(start, table.num_rows, step):
+        rows = slice(lo, min(lo + step, table.num_rows))
+        accumulator.update({col: table.array(col)[rows] for col in columns})
+    accumulator.rows = table.num_rows
+
+
+def _payload(accumulator: ChartAccumulator, file_path, table) -> dict:
+    return {
+        'total_count': table.num_rows,
+        'histograms': accumulator.histograms(),
+        'box': box_stats(file_path, table),
+        'scatter': accumulator.scatter(),
+    }
+
+
+def build_charts(file_path) -> dict:
+    """Chart data for the stored upload at ``file_path``: one pass over its columnar copy."""
+    table = load_table(file_path)
+    accumulator = ChartAccumulator.for_table(file_path, table)
+    _feed(accumulator, table, 0)
+    _save_state(file_path, accumulator)
+    return _payload(accumulator, file_path, table)
+
+
+def extend_charts(file_path, start_row: int) -> dict:
+    """
+    Chart data after rows from ``start_row`` on were appended, reading only those rows.
+    Falls back to ``build_charts`` if the saved state does not cover exactly the rows before.
+    """
+    table = load_table(file_path)
+    try:
+        accumulator = ChartAccumulator.from_state(json.loads(charts_state_path(file_path).read_text()))
+    except (OSError, ValueError, KeyError):
+        accumulator = None
+    if accumulator is None or accumulator.rows != start_row:
+        return build_charts(file_path)
+    _feed(accumulator, table, start_row)
+    _save_state(file_path, accumulator)
+    return _payload(accumulator, file_path, table)
+
+
+def downsample(charts: dict, points: int) -> dict:
+    """``charts`` with its scatter coarsened to a grid of at most ``points`` cells."""
+    scatter = charts.get('scatter')
+    n = max(1, math.isqrt(points))
+    if not scatter or n >= scatter['grid_size']:
+        return charts
+    x_low, x_high, y_low, y_high = scatter['bounds']
+    coarse: dict[int, list] = {}
+    # Stored points are in cell order: each coarse cell keeps the point of its first fine cell.
+    for x, y, count in scatter['points']:
+        cell = int(_cells(np.float64(y), y_low, y_high, n)) * n + int(_cells(np.float64(x), x_low, x_high, n))
+        point = coarse.get(cell)
+        if point is None:
+            coarse[cell] = [x, y, count]
+        else:
+            point[2] += count
+    return {**charts, 'scatter': {**scatter, 'grid_size': n, 'points': list(coarse.values())}}
@@ -0,0 +1,280 @@
+"""Memory-mapped columnar copies of uploaded datasets.
+
+Each dataset keeps a typed, normalized copy of its table in a ``<raw file>.cols/``
+directory next to the uploaded CSV: one raw little-endian array per column plus a
+small ``meta.json``. Numeric columns are stored as float64; text columns are
+dictionary encoded (int32 codes, -1 for missing) with the dictionary kept as JSON
+lines. Every column can therefore be memory-mapped without parsing and appended
+to without rewriting what is already on disk.
+"""
+from __future__ import annotations
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+FORMAT_VERSION = 1
+META_NAME = 'meta.json'
+FLOAT_KIND = 'float64'
+TEXT_KIND = 'text'
+
+
+def columnar_path(file_path) -> Path:
+    """Directory holding the columnar copy of the raw file at ``file_path``."""
+    return Path(f'{file_path}.cols')
+
+
+def _column_kind(series: pd.Series) -> str:
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return FLOAT_KIND
+    return TEXT_KIND
+
+
+class ColumnarWriter:
+    """Append DataFrame chunks to a columnar directory.
+
+    A new table is written to a private temporary directory and renamed into place
+    on ``close()``, so readers never see a half-written copy. When ``append=True`` the
+    existing table is extended in place; ``meta.json`` is rewritten last and its
+    ``num_rows`` is authoritative, so an interrupted append leaves the old rows intact.
+    """
+
+    def __init__(self, root, append: bool = False):
+        self.root = Path(root)
+        self.append = append
+        self.columns: list[dict] | None = None
+        self.num_rows = 0
+        self._dictionaries: dict[int, dict[str, int]] = {}
+        if append:
+            meta = _read_meta(self.root)
+            if meta is None:
+                raise FileNotFoundError(f'No columnar table at {self.root}')
+            self.columns = meta['columns']
+            self.num_rows = meta['num_rows']
+            self.dir = self.root
+            for i, col in enumerate(self.columns):
+                if col['kind'] == TEXT_KIND:
+                    values = _read_dictionary(self.root / f'c{i}.dict')
+                    self._dictionaries[i] = {v: code for code, v in enumerate(values)}
+                    # Drop anything past num_rows left behind by an interrupted append.
+                    _truncate(self.root / f'c{i}.codes', self.num_rows * 4)
+                    _truncate_lines(self.root / f'c{i}.dict', len(values))
+                else:
+                    _truncate(self.root / f'c{i}.f8', self.num_rows * 8)
+        else:
+            self.dir = self.root.with_name(f'{self.root.name}.tmp-{uuid.uuid4().hex}')
+            self.dir.mkdir(parents=True)
+
+    def _init_schema(self, df: pd.DataFrame):
+        self.columns = [{'name': str(name), 'kind': _column_kind(df.iloc[:, i])} for i, name in enumerate(df.columns)]
+        for i, col in enumerate(self.columns):
+            if col['kind'] == TEXT_KIND:
+                self._dictionaries[i] = {}
+                (self.dir / f'c{i}.codes').touch()
+                (self.dir / f'c{i}.dict').touch()
+            else:
+                (self.dir / f'c{i}.f8').touch()
+
+    def write(self, df: pd.DataFrame) -> dict[str, np.ndarray]:
+        """
+        Append the rows of ``df`` (same column order as the first chunk). Returns the
+        dictionary codes written for each text column (see ``dictionary``).
+        """
+        if self.columns is None:
+            self._init_schema(df)
+        if df.shape[1] != len(self.columns):
+            raise ValueError(f'Expected {len(self.columns)} columns, got {df.shape[1]}')
+        written = {}
+        for i, col in enumerate(self.columns):
+            series = df.iloc[:, i]
+            if col['kind'] == FLOAT_KIND:
+                values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='<f8', na_value=np.nan)
+                with open(self.dir / f'c{i}.f8', 'ab') as f:
+                    f.write(values.tobytes())
+            else:
+                codes = written[col['name']] = self._encode(i, series)
+                with open(self.dir / f'c{i}.codes', 'ab') as f:
+                    f.write(codes.astype('<i4', copy=False).tobytes())
+        self.num_rows += len(df)
+        return written
+
+    def dictionary(self, name: str) -> list[str]:
+        """Values of a text column written so far, in code order."""
+        i = [c['name'] for c in self.columns or []].index(name)
+        return list(self._dictionaries[i])
+
+    def _encode(self, i: int, series: pd.Series) -> np.ndarray:
+        local_codes, uniques = pd.factorize(series)
+        mapping = self._dictionaries[i]
+        new_values = []
+        lookup = np.empty(len(uniques), dtype=np.int32)
+        for j, value in enumerate(uniques):
+            value = str(value)
+            code = mapping.get(value)
+            if code is None:
+                code = mapping[value] = len(mapping)
+                new_values.append(value)
+            lookup[j] = code
+        if new_values:
+            with open(self.dir / f'c{i}.dict', 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(v) + '\n' for v in new_values)
+        if not len(uniques):
+            return np.full(len(series), -1, dtype=np.int32)
+        return np.where(local_codes >= 0, lookup[local_codes], -1).astype(np.int32, copy=False)
+
+    def close(self):
+        if self.columns is None:
+            self.columns = []
+        meta = {'version': FORMAT_VERSION, 'num_rows': self.num_rows, 'columns': self.columns}
+        tmp_meta = self.dir / f'{META_NAME}.tmp'
+        tmp_meta.write_text(json.dumps(meta))
+        os.replace(tmp_meta, self.dir / META_NAME)
+        if self.append:
+            return
+        try:
+            os.rename(self.dir, self.root)
+        except OSError:
+            # Another writer converted the same file first; theirs is equivalent.
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def abort(self):
+        if not self.append:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def _truncate(path: Path, size: int):
+    if path.stat().st_size > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def _truncate_lines(path: Path, count: int):
+    with open(path, 'r+b') as f:
+        for _ in range(count):
+            f.readline()
+        f.truncate(f.tell())
+
+
+def _read_meta(root: Path) -> dict | None:
+    try:
+        meta = json.loads((root / META_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != FORMAT_VERSION:
+        return None
+    return meta
+
+
+def _read_dictionary(path: Path) -> list[str]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _map(path: Path, dtype: str, num_rows: int) -> np.ndarray:
+    if num_rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(num_rows,))
+
+
+class ColumnarTable:
+    """Read-only, memory-mapped view of a columnar directory."""
+
+    def __init__(self, root, meta: dict):
+        self.root = Path(root)
+        self.num_rows: int = meta['num_rows']
+        self.columns: list[dict] = meta['columns']
+        self.column_names = [c['name'] for c in self.columns]
+        self._arrays: dict[int, np.ndarray] = {}
+        self._dictionaries: dict[int, np.ndarray] = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    def index_of(self, name: str) -> int:
+        return self.column_names.index(name)
+
+    def kind(self, name: str) -> str:
+        return self.columns[self.index_of(name)]['kind']
+
+    def array(self, name: str) -> np.ndarray:
+        """Zero-copy stored array: float64 values, or int32 dictionary codes for text."""
+        i = self.index_of(name)
+        if i not in self._arrays:
+            if self.columns[i]['kind'] == FLOAT_KIND:
+                self._arrays[i] = _map(self.root / f'c{i}.f8', '<f8', self.num_rows)
+            else:
+                self._arrays[i] = _map(self.root / f'c{i}.codes', '<i4', self.num_rows)
+        return self._arrays[i]
+
+    def dictionary(self, name: str) -> np.ndarray:
+        """Dictionary of a text column as an object array, with ``None`` appended for code -1."""
+        i = self.index_of(name)
+        if i not in self._dictionaries:
+            values = _read_dictionary(self.root / f'c{i}.dict')
+            self._dictionaries[i] = np.array(values + [None], dtype=object)
+        return self._dictionaries[i]
+
+    def sort_order(self, name: str) -> np.ndarray:
+        """
+        Row positions ordered by the column's values (missing values last), memory-mapped.
+        Built on first use and persisted next to the column as ``c<i>.order``.
+        """
+        i = self.index_of(name)
+        path = self.root / f'c{i}.order'
+        if not path.exists() or path.stat().st_size != self.num_rows * 8:
+            data = np.asarray(self.array(name))
+            if self.columns[i]['kind'] == TEXT_KIND:
+                dictionary = self.dictionary(name)[:-1]
+                rank = np.empty(len(dictionary) + 1, dtype=np.int64)
+                rank[np.argsort(dictionary.astype(str), kind='stable')] = np.arange(len(dictionary))
+                rank[-1] = len(dictionary)  # missing (-1) sorts last
+                data = rank[data]
+            order = np.argsort(data, kind='stable').astype('<i8')
+            tmp = path.with_name(f'{path.name}.tmp-{uuid.uuid4().hex}')
+            order.tofile(tmp)
+            os.replace(tmp, path)
+        return _map(path, '<i8', self.num_rows)
+
+    def values(self, name: str, rows=None) -> np.ndarray:
+        """Decoded values of one column, optionally only at ``rows`` (slice or index array)."""
+        data = self.array(name)
+        if rows is not None:
+            data = data[rows]
+        if self.kind(name) == FLOAT_KIND:
+            return data
+        # Code -1 indexes the trailing ``None`` of the dictionary.
+        return self.dictionary(name)[data]
+
+    def to_dataframe(self, rows=None) -> pd.DataFrame:
+        df = pd.DataFrame({i: self.values(name, rows) for i, name in enumerate(self.column_names)}, copy=False)
+        df.columns = self.column_names
+        return df
+
+
+def open_table(root) -> ColumnarTable | None:
+    """Open the columnar table at ``root``, or ``None`` if it is missing or outdated."""
+    root = Path(root)
+    meta = _read_meta(root)
+    if meta is None:
+        return None
+    return ColumnarTable(root, meta)
+
+
+def write_table(df: pd.DataFrame, root) -> ColumnarTable:
+    writer = ColumnarWriter(root)
+    try:
+        writer.write(df)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    return open_table(root)
+
+
+def remove_table(root):
+    shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,189 @@
+"""
+gzip / Brotli compression of API responses.
+
+Table JSON repeats every column name on every row, so it compresses 5-10x. Streamed
+bodies are compressed batch by batch with a sync flush after each one, so clients
+still get rows as they are produced. Bodies below EQUIPMENT_COMPRESS_MIN_BYTES and
+content that is already compressed (PDFs, images) are left alone. Responses served from
+the response cache arrive already encoded (see httpcache) and pass straight through.
+"""
+from __future__ import annotations
+import asyncio
+import gzip
+import re
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = re.compile(r'^(application/(json|x-ndjson|[\w.+-]+\+json)|text/(plain|csv))\b')
+
+
+def available_encodings() -> list[str]:
+    """Supported codings, preferred first."""
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """The preferred coding the client accepts (q > 0), or None."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        m = re.search(r'q\s*=\s*([\d.]+)', params)
+        if m:
+            try:
+                q = float(m.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, level: int | None = None) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=level if level is not None else _brotli_quality())
+    return gzip.compress(data, compresslevel=level if level is not None else _gzip_level(), mtime=0)
+
+
+def _stream_encoder(encoding: str):
+    """``(encode, finish)`` for one streamed body: ``encode(chunk)`` compresses and flushes."""
+    if encoding == 'br':
+        encoder = brotli.Compressor(quality=_brotli_quality())
+        return (lambda data: encoder.process(data) + encoder.flush()), encoder.finish
+    encoder = zlib.compressobj(_gzip_level(), zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return (lambda data: encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH)), encoder.flush
+
+
+def compress_stream(chunks, encoding: str):
+    """Compress an iterable of str/bytes chunks, flushing after each so batches are not held back."""
+    encode, finish = _stream_encoder(encoding)
+    for chunk in chunks:
+        data = encode(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+async def acompress_stream(chunks, encoding: str):
+    """``compress_stream`` for an async iterable, compressing in a thread (zlib and brotli release the GIL)."""
+    encode, finish = _stream_encoder(encoding)
+    async for chunk in chunks:
+        data = await asyncio.to_thread(encode, chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def _gzip_level() -> int:
+    return getattr(settings, 'EQUIPMENT_GZIP_LEVEL', DEFAULT_GZIP_LEVEL)
+
+
+def _brotli_quality() -> int:
+    return getattr(settings, 'EQUIPMENT_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)
+
+
+def is_compressible(response) -> bool:
+    return (
+        response.status_code == 200
+        and not response.has_header('Content-Encoding')
+        and COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')) is not None
+    )
+
+
+def precompress(content: bytes, content_type: str) -> dict[str, bytes]:
+    """Every available encoding of a body that the middleware would compress, for caching."""
+    if (not getattr(settings, 'EQUIPMENT_COMPRESSION', True)
+            or COMPRESSIBLE_TYPES.match(content_type) is None
+            or len(content) < getattr(settings, 'EQUIPMENT_COMPRESS_MIN_BYTES', DEFAULT_MIN_BYTES)):
+        return {}
+    encoded = {}
+    for encoding in available_encodings():
+        data = compress(content, encoding)
+        if len(data) < len(content):
+            encoded[encoding] = data
+    return encoded
+
+
+def _weaken_etag(response):
+    # The encoded body is a different representation; a weak ETag still matches If-None-Match.
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+class CompressionMiddleware:
+    """
+    Encodes API responses with the best coding the client accepts; see module docstring.
+    Under ASGI async streams are compressed as they are consumed and whole bodies in a
+    thread, off the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        encoding = self._negotiate(request, response)
+        if encoding is not None:
+            if response.streaming:
+                self._encode_stream(response, compress_stream(response.streaming_content, encoding), encoding)
+            else:
+                self._encode_body(response, encoding)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        encoding = self._negotiate(request, response)
+        if encoding is not None:
+            if response.streaming:
+                chunks = response.streaming_content
+                stream = acompress_stream(chunks, encoding) if response.is_async else compress_stream(chunks, encoding)
+                self._encode_stream(response, stream, encoding)
+            else:
+                await asyncio.to_thread(self._encode_body, response, encoding)
+        return response
+
+    @staticmethod
+    def _negotiate(request, response) -> str | None:
+        if not getattr(settings, 'EQUIPMENT_COMPRESSION', True) or not is_compressible(response):
+            return None
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    @staticmethod
+    def _encode_stream(response, stream, encoding):
+        response.streaming_content = stream
+        del response['Content-Length']
+        _weaken_etag(response)
+        response['Content-Encoding'] = encoding
+
+    @staticmethod
+    def _encode_body(response, encoding):
+        if len(response.content) < getattr(settings, 'EQUIPMENT_COMPRESS_MIN_BYTES', DEFAULT_MIN_BYTES):
+            return
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        _weaken_etag(response)
+        response['Content-Encoding'] = encoding
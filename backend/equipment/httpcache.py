@@ -0,0 +1,268 @@
+"""
+Response cache for the public read endpoints (history, summary, table pages).
+
+Rendered responses are stored under ``scope:dataset:generation:variant``, where the
+variant is the query string plus Accept header, either in an in-process LRU bounded by
+bytes or, when EQUIPMENT_RESPONSE_CACHE_ALIAS names a Django cache, in that shared cache.
+Nothing is ever deleted on invalidation: saving or deleting a dataset moves its
+generation (and the history generation) to a fresh random token, so old entries are
+simply never looked up again and age out. Generations live in the shared cache, or,
+without one, in the database (ResponseGeneration), so an upload handled by one server
+process invalidates every process's entries. In-process, each process rereads a scope's
+generation at most every EQUIPMENT_RESPONSE_CACHE_GENERATION_TTL seconds; in between, a
+hit is answered without touching the database or DRF, and If-None-Match against the
+stored ETag gives a 304 the same way.
+Entries also hold their gzip/Brotli encodings, compressed once when stored, so cached
+reads never pay for compression again.
+"""
+from __future__ import annotations
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+
+from .compression import choose_encoding, precompress
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 3600
+DEFAULT_GENERATION_TTL = 1.0
+INITIAL_GENERATION = '0'  # scopes never invalidated; the in-process entries go with the process
+HISTORY = 'history'
+CACHE_CONTROL = 'public, no-cache'  # shareable, but revalidated since uploads change it
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    content_type: str
+    content: bytes
+    vary: str
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.content) + sum(len(v) for v in self.encoded.values())
+
+    def respond(self, request) -> HttpResponse:
+        etag = self.etag
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', '')) if self.encoded else None
+            if encoding in self.encoded:
+                response = HttpResponse(self.encoded[encoding], content_type=self.content_type)
+                response['Content-Encoding'] = encoding
+                etag = 'W/' + etag if etag.startswith('"') else etag
+            else:
+                response = HttpResponse(self.content, content_type=self.content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = CACHE_CONTROL
+        response['Vary'] = self.vary
+        return response
+
+
+class ResponseCache:
+    """See module docstring. ``enabled`` follows EQUIPMENT_RESPONSE_CACHE."""
+
+    def __init__(self, max_bytes=None, alias=None, ttl=None):
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(settings, 'EQUIPMENT_RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.alias = alias if alias is not None else getattr(settings, 'EQUIPMENT_RESPONSE_CACHE_ALIAS', None)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'EQUIPMENT_RESPONSE_CACHE_TTL', DEFAULT_TTL)
+        self.generation_ttl = getattr(settings, 'EQUIPMENT_RESPONSE_CACHE_GENERATION_TTL', DEFAULT_GENERATION_TTL)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, 'EQUIPMENT_RESPONSE_CACHE', True)
+
+    # -- generations ------------------------------------------------------
+
+    def generation(self, scope_id) -> str:
+        if self.alias:
+            key = f'equipment:resp:gen:{scope_id}'
+            cache = caches[self.alias]
+            gen = cache.get(key)
+            if gen is None:
+                cache.add(key, uuid.uuid4().hex[:12], None)
+                gen = cache.get(key)
+            return gen
+        gen = self._fresh_generation(scope_id)
+        if gen is None:
+            from .models import ResponseGeneration
+            gen = ResponseGeneration.objects.filter(scope=scope_id).values_list('token', flat=True).first()
+            gen = self._remember(scope_id, gen or INITIAL_GENERATION)
+        return gen
+
+    def _fresh_generation(self, scope_id) -> str | None:
+        """The in-process copy of a generation, if it was read from the database recently enough."""
+        with self._lock:
+            entry = self._generations.get(scope_id)
+        return entry[0] if entry is not None and entry[1] > time.monotonic() else None
+
+    def _remember(self, scope_id, gen) -> str:
+        with self._lock:
+            self._generations[scope_id] = (gen, time.monotonic() + self.generation_ttl)
+        return gen
+
+    def invalidate(self, dataset_id=None):
+        """Forget responses for ``dataset_id`` and the history list (which lists every dataset)."""
+        for scope_id in ([HISTORY] if dataset_id is None else [HISTORY, f'dataset-{dataset_id}']):
+            new = uuid.uuid4().hex[:12]
+            if self.alias:
+                caches[self.alias].set(f'equipment:resp:gen:{scope_id}', new, None)
+            else:
+                from .models import ResponseGeneration
+                ResponseGeneration.objects.update_or_create(scope=scope_id, defaults={'token': new})
+                self._remember(scope_id, new)
+
+    # -- entries ----------------------------------------------------------
+
+    def key(self, scope: str, dataset_id, request, blocking: bool = True) -> str | None:
+        """
+        The entry key for ``request``. With ``blocking=False``, None instead if finding the
+        generation means a database or shared-cache round trip.
+        """
+        scope_id = HISTORY if dataset_id is None else f'dataset-{dataset_id}'
+        gen = None if self.alias else self._fresh_generation(scope_id)
+        if gen is None:
+            if not blocking:
+                return None
+            gen = self.generation(scope_id)
+        variant = f"{request.META.get('QUERY_STRING', '')}|{request.META.get('HTTP_ACCEPT', '')}"
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        return f'equipment:resp:{scope}:{scope_id}:{gen}:{digest}'
+
+    def get(self, key: str) -> CachedResponse | None:
+        if self.alias:
+            entry = caches[self.alias].get(key)
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def store(self, key: str, response) -> CachedResponse | None:
+        """
+        Keep a copy of a successful, fully rendered ``response`` (adding an ETag from its
+        body if the view did not set one) and return it; None if it cannot be cached.
+        """
+        if response.status_code != 200 or isinstance(response, StreamingHttpResponse):
+            return None
+        if hasattr(response, 'render'):
+            response.render()
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith('text/html'):
+            return None  # the browsable API page shows the signed-in user
+        etag = response.get('ETag') or f'"{hashlib.sha1(response.content).hexdigest()[:20]}"'
+        content = bytes(response.content)
+        encoded = precompress(content, content_type)
+        vary_on = 'Accept,' + response.get('Vary', '') + (',Accept-Encoding' if encoded else '')
+        vary = ', '.join(dict.fromkeys(v.strip() for v in vary_on.split(',') if v.strip()))
+        entry = CachedResponse(etag, content_type, content, vary, encoded)
+        if entry.size > self.max_bytes // 8:
+            return entry  # too large to be worth a slot; still answered conditionally
+        if self.alias:
+            caches[self.alias].set(key, entry, self.ttl)
+            return entry
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'bytes': self._size}
+
+
+response_cache = ResponseCache()
+
+
+class CachedGetMixin:
+    """
+    For AllowAny GET views whose output depends only on the URL, Accept header and stored
+    datasets. ``cache_scope`` names the endpoint; the dataset comes from the ``pk`` kwarg
+    (none means the response covers all datasets, like the history list). Views with
+    ``records_access`` count cache hits as reads for retention's hot-dataset rule.
+    """
+    cache_scope: str = None
+    records_access = False
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or not response_cache.enabled:
+            return super().dispatch(request, *args, **kwargs)
+        key = response_cache.key(self.cache_scope, kwargs.get('pk'), request)
+        entry = response_cache.get(key)
+        if entry is not None:
+            if self.records_access:
+                from .retention import access_due, record_access
+                if access_due(kwargs['pk']):
+                    record_access(kwargs['pk'])
+            return entry.respond(request)
+        response = super().dispatch(request, *args, **kwargs)
+        entry = response_cache.store(key, response)
+        return entry.respond(request) if entry is not None else response
+
+
+class AsyncCachedGetMixin:
+    """
+    ``CachedGetMixin`` for async views. Lookups in the in-process cache run inline; a
+    shared cache alias, and the database when a generation is due to be reread, are
+    reached from a thread, and storing (which precompresses the body) always is, so none
+    of them blocks the event loop.
+    """
+    cache_scope: str = None
+    records_access = False
+
+    @staticmethod
+    async def _lookup(fn, *args):
+        if response_cache.alias:
+            return await sync_to_async(fn, thread_sensitive=False)(*args)
+        return fn(*args)
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or not response_cache.enabled:
+            return await super().dispatch(request, *args, **kwargs)
+        key = response_cache.key(self.cache_scope, kwargs.get('pk'), request, blocking=False)
+        if key is None:
+            key = await sync_to_async(response_cache.key)(self.cache_scope, kwargs.get('pk'), request)
+        entry = await self._lookup(response_cache.get, key)
+        if entry is not None:
+            if self.records_access:
+                from .retention import access_due, record_access
+                if access_due(kwargs['pk']):
+                    await sync_to_async(record_access)(kwargs['pk'])
+            return entry.respond(request)
+        response = await super().dispatch(request, *args, **kwargs)
+        entry = await sync_to_async(response_cache.store, thread_sensitive=False)(key, response)
+        return entry.respond(request) if entry is not None else response
@@ -0,0 +1,198 @@
+"""Background work for uploads: a local thread pool, no external broker required."""
+from __future__ import annotations
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .charts import build_charts
+from .httpcache import response_cache
+from .metrics import timed
+from .models import EquipmentDataset, IngestJob
+from .reports import get_report
+from .retention import dataset_table, run_retention
+from .services import ingest_csv, remove_columnar, stored_bytes
+
+DEFAULT_WORKERS = 2
+DEFAULT_STALE_SECONDS = 900
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EQUIPMENT_INGEST_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='equipment-worker',
+            )
+        return _executor
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """Run ``fn`` on the worker pool; the worker's DB connections are closed afterwards."""
+    def run():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return get_executor().submit(run)
+
+
+_retention_queued = False
+_retention_lock = threading.Lock()
+
+
+def enqueue_retention():
+    """
+    Run the retention policies in the background after the current transaction commits.
+    Uploads finishing while a run is still queued share it instead of queueing another.
+    """
+    transaction.on_commit(_queue_retention)
+
+
+def _queue_retention():
+    global _retention_queued
+    with _retention_lock:
+        if _retention_queued:
+            return
+        _retention_queued = True
+    submit(_run_queued_retention)
+
+
+def _run_queued_retention():
+    global _retention_queued
+    with _retention_lock:
+        _retention_queued = False  # uploads committed from here on need a run of their own
+    run_retention()
+    recover_stale_jobs()
+
+
+def enqueue_ingest(job: IngestJob):
+    """Queue ``job`` once the transaction that created it has committed."""
+    transaction.on_commit(lambda: submit(run_ingest_job, job.pk))
+
+
+_reports_queued: set[int] = set()
+_reports_lock = threading.Lock()
+
+
+def enqueue_report(dataset: EquipmentDataset):
+    """Pre-render the PDF report in the background so the first download is a cache hit."""
+    transaction.on_commit(lambda: queue_report(dataset.pk))
+
+
+def queue_report(dataset_id: int):
+    """
+    Render the report of ``dataset_id`` in the background now, unless a render of it is
+    already queued (downloads polling for it share that one).
+    """
+    with _reports_lock:
+        if dataset_id in _reports_queued:
+            return
+        _reports_queued.add(dataset_id)
+    submit(_run_queued_report, dataset_id)
+
+
+def _run_queued_report(dataset_id: int):
+    try:
+        prerender_report(dataset_id)
+    finally:
+        with _reports_lock:
+            _reports_queued.discard(dataset_id)
+
+
+def prerender_report(dataset_id: int):
+    try:
+        dataset = EquipmentDataset.objects.get(pk=dataset_id)
+    except EquipmentDataset.DoesNotExist:
+        return
+    if not dataset.is_ready:
+        return
+    if dataset.file:
+        dataset_table(dataset)
+    get_report(dataset)
+
+
+def run_ingest_job(job_id: int):
+    try:
+        job = IngestJob.objects.select_related('dataset').get(pk=job_id)
+    except IngestJob.DoesNotExist:
+        return  # dataset was deleted before the job started
+    dataset = job.dataset
+    now = timezone.now()
+    # Claimed with a conditional update, so a job queued twice (see recover_stale_jobs) runs once.
+    if not IngestJob.objects.filter(pk=job.pk, status=EquipmentDataset.STATUS_PENDING).update(
+            status=EquipmentDataset.STATUS_PROCESSING, started_at=now, updated_at=now):
+        return
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(status=EquipmentDataset.STATUS_PROCESSING)
+    response_cache.invalidate(dataset.pk)  # .update() sends no signals
+
+    def progress(bytes_processed, rows_parsed):
+        IngestJob.objects.filter(pk=job.pk).update(
+            bytes_processed=bytes_processed, rows_parsed=rows_parsed, updated_at=timezone.now(),
+        )
+
+    try:
+        summary, sketches = ingest_csv(dataset.file.path, progress=progress)
+        with timed('ingest.charts'):
+            charts = build_charts(dataset.file.path)
+    except Exception as e:
+        _fail_job(job, dataset, str(e))
+        return
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(
+        total_count=summary['total_count'], summary_json=summary, sketches=sketches, charts=charts,
+        size_bytes=stored_bytes(dataset.file.path), status=EquipmentDataset.STATUS_READY,
+    )
+    response_cache.invalidate(dataset.pk)
+    IngestJob.objects.filter(pk=job.pk).update(
+        status=EquipmentDataset.STATUS_READY, bytes_processed=job.bytes_total,
+        rows_parsed=summary['total_count'], finished_at=timezone.now(),
+    )
+    enqueue_retention()
+    prerender_report(dataset.pk)
+
+
+def _fail_job(job: IngestJob, dataset: EquipmentDataset, error: str):
+    """Mark ``job`` and its dataset failed and drop what was stored of the upload."""
+    if dataset.file:
+        remove_columnar(dataset.file.path)
+        dataset.file.delete(save=False)
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(file=None, status=EquipmentDataset.STATUS_FAILED)
+    IngestJob.objects.filter(pk=job.pk).update(
+        status=EquipmentDataset.STATUS_FAILED, error=error, finished_at=timezone.now(),
+    )
+    response_cache.invalidate(dataset.pk)
+
+
+def stale_before(now=None):
+    """Unfinished jobs with no claim or progress written since this time are stale."""
+    seconds = getattr(settings, 'EQUIPMENT_INGEST_STALE_SECONDS', DEFAULT_STALE_SECONDS)
+    return (now or timezone.now()) - timedelta(seconds=seconds)
+
+
+def recover_stale_jobs(now=None) -> tuple[int, int]:
+    """
+    Jobs whose server process stopped (restart, crash) stay pending or processing forever.
+    Pending ones never started and are queued again. Processing ones are failed like a
+    parse error: the upload may be what took the process down, so it is not retried.
+    Each job is claimed with a conditional update, so with several server processes only
+    one acts on it. Returns ``(requeued, failed)``.
+    """
+    now = now or timezone.now()
+    stale = IngestJob.objects.filter(updated_at__lt=stale_before(now))
+    requeued = failed = 0
+    for job in stale.filter(status=EquipmentDataset.STATUS_PENDING):
+        if IngestJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(updated_at=now):
+            submit(run_ingest_job, job.pk)
+            requeued += 1
+    for job in stale.filter(status=EquipmentDataset.STATUS_PROCESSING).select_related('dataset'):
+        if IngestJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(updated_at=now):
+            _fail_job(job, job.dataset, 'Processing stopped when the server restarted; upload the file again')
+            failed += 1
+    return requeued, failed
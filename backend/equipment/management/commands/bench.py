@@ -0,0 +1,430 @@
+"""
+Benchmark the ingest/serve pipeline on generated equipment CSVs.
+
+    python manage.py bench --rows 1K 1M 10M --output bench.json
+    python manage.py bench --rows 1M --baseline bench.json --max-regression 10
+    python manage.py bench --rows 2K --stages db_upload,db_read,db_mixed --output sqlite.json
+
+Stages run through the same code the views use, without HTTP or the database:
+ingest (CSV -> summary + columnar copy), summary (the per-type moments ingest counts
+while parsing, fed the same chunks and Type codes), percentiles (the digest pass ingest
+makes over the columnar copy afterwards), full_fetch (whole table as the default JSON
+body), paged_fetch (sorted 100-row pages at spread offsets) and pdf (report rendering).
+
+summary_plain and summary_sketch time the earlier summary engines on the same chunks:
+averages plus type counts only (the original summary), and that plus one ungrouped
+ColumnSketch per column. The summary stages time the engines only, not slicing the
+chunks out of the columnar copy. When summary and summary_plain both run, the command
+compares them and fails if the grouped summary is slower than the original.
+
+The fetch stages also run with gzip and Brotli encoding (full_fetch_gzip,
+paged_fetch_br, ...) the way CompressionMiddleware applies them: the full table as a
+flushed stream, pages as whole bodies. They record bytes on the wire, the compression
+ratio, time to first byte (full fetch) and milliseconds per request (pages).
+Brotli stages are skipped when the brotli package is not installed.
+
+The db stages (not run by default) measure concurrent throughput on the configured
+database: requests go through the full Django stack (Client, no HTTP server) from
+--db-threads threads, each with its own connection. db_upload uploads the generated CSV
+--db-uploads times, db_read makes --db-reads reads (history, summary and a data page,
+response cache off so every read hits the database) and db_mixed does both at once.
+A throwaway user owns everything they create; it and its datasets are removed afterwards.
+Run them once per database backend and compare the JSON files with --baseline.
+"""
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from equipment.bench import compare, generate_csv, latency_stats, measure, parse_size
+from equipment.compression import available_encodings, compress, compress_stream
+from equipment.models import AuthToken, EquipmentDataset
+from equipment.query import parse_query, select_rows
+from equipment.renderers import TableJSONRenderer, iter_batches
+from equipment.reports import render_report
+from equipment.retention import delete_datasets
+from equipment.services import (
+    NUMERIC_COLUMNS, SummaryAccumulator, ingest_chunk_rows, ingest_csv, load_table, remove_columnar,
+)
+from equipment.sketches import ColumnSketch
+
+FETCH_STAGES = ['full_fetch', 'paged_fetch']
+ENCODINGS = ['gzip', 'br']
+SUMMARY_STAGES = ['summary', 'percentiles', 'summary_plain', 'summary_sketch']
+DB_STAGES = ['db_upload', 'db_read', 'db_mixed']
+DEFAULT_STAGES = ['ingest'] + SUMMARY_STAGES[:2] + [f + s for f in FETCH_STAGES for s in [''] + ['_' + e for e in ENCODINGS]] + ['pdf']
+STAGES = DEFAULT_STAGES[:3] + SUMMARY_STAGES[2:] + DEFAULT_STAGES[3:] + DB_STAGES
+PAGE_ROWS = 100
+
+
+class Command(BaseCommand):
+    help = 'Time ingest, summary, table fetches and PDF rendering on synthetic CSVs and save the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', nargs='+', default=['1K', '100K', '1M'],
+                            help='Dataset sizes, e.g. 1K 1M 50M (default: 1K 100K 1M)')
+        parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                            help='Comma-separated subset of: ' + ', '.join(STAGES) + ' (default: all but the summary_* and db_* stages)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clean', action='store_true', help='Canonical headers and no junk values')
+        parser.add_argument('--junk-rate', type=float, default=0.01)
+        parser.add_argument('--pages', type=int, default=50, help='Pages fetched in paged_fetch')
+        parser.add_argument('--workdir', help='Where generated CSVs are kept and reused (default: a temp dir, removed afterwards)')
+        parser.add_argument('--output', help='Write results JSON here')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+        parser.add_argument('--max-regression', type=float, default=None,
+                            help='Fail if any stage is more than this many percent slower than the baseline')
+        parser.add_argument('--db-threads', type=int, default=8, help='Concurrent clients in the db stages')
+        parser.add_argument('--db-uploads', type=int, default=40, help='Uploads in db_upload (and in db_mixed)')
+        parser.add_argument('--db-reads', type=int, default=1000, help='Reads in db_read (and in db_mixed)')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(s) for s in options['rows']]
+        except ValueError as e:
+            raise CommandError(str(e))
+        stages = [s.strip() for s in options['stages'].split(',') if s.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f'Unknown stages: {", ".join(sorted(unknown))}')
+
+        workdir = Path(options['workdir']) if options['workdir'] else Path(tempfile.mkdtemp(prefix='equipment-bench-'))
+        workdir.mkdir(parents=True, exist_ok=True)
+        results = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'seed': options['seed'],
+                'messy': not options['clean'],
+                'junk_rate': options['junk_rate'],
+                'chunk_rows': ingest_chunk_rows(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+            },
+            'runs': {},
+        }
+        if set(stages) & set(DB_STAGES):
+            db = settings.DATABASES['default']
+            results['meta'].update({
+                'db_vendor': connection.vendor,
+                'db_conn_max_age': db.get('CONN_MAX_AGE', 0),
+                'db_pool': bool(db.get('OPTIONS', {}).get('pool')),
+                'db_threads': options['db_threads'],
+            })
+        try:
+            for rows in sizes:
+                results['runs'][str(rows)] = self.run_size(workdir, rows, stages, options)
+        finally:
+            if not options['workdir']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['baseline']:
+            self.report_baseline(results, options)
+
+    def run_size(self, workdir: Path, rows: int, stages: list, options) -> dict:
+        kind = 'clean' if options['clean'] else f"messy{options['junk_rate']:g}"
+        path = workdir / f"equipment_{rows}_s{options['seed']}_{kind}.csv"
+        if not path.exists():
+            self.stdout.write(f'Generating {rows:,} rows -> {path}')
+            generate_csv(path, rows, seed=options['seed'], messy=not options['clean'], junk_rate=options['junk_rate'])
+        remove_columnar(path)
+        file_bytes = path.stat().st_size
+        measured = {}
+        summary = None
+
+        # Later stages read the columnar copy, so it is always built (timed only when asked for).
+        with measure('ingest') as stage:
+            summary, _ = ingest_csv(path)
+            stage.rows, stage.bytes = summary['total_count'], file_bytes
+        if 'ingest' in stages:
+            measured['ingest'] = stage
+        table = load_table(path)
+
+        for name, engine in [('summary', GroupedSummary), ('summary_plain', PlainSummary),
+                             ('summary_sketch', SketchSummary)]:
+            if name in stages:
+                measured[name] = self.time_summary(name, engine(), table)
+
+        if 'percentiles' in stages:
+            accumulator = SummaryAccumulator()
+            for batch in iter_batches(slice(0, table.num_rows), ingest_chunk_rows()):
+                df, codes, names = summary_chunk(table, batch)
+                accumulator.update(df, codes, names)
+            with measure('percentiles') as stage:
+                accumulator.add_percentiles(table)
+                stage.rows = table.num_rows
+            measured['percentiles'] = stage
+
+        for fetch in FETCH_STAGES:
+            for encoding in [None] + ENCODINGS:
+                name = fetch if encoding is None else f'{fetch}_{encoding}'
+                if name not in stages:
+                    continue
+                if encoding is not None and encoding not in available_encodings():
+                    self.stdout.write(f'  {name}: skipped ({encoding} is not available)')
+                    continue
+                with measure(name) as stage:
+                    if fetch == 'full_fetch':
+                        self.full_fetch(table, stage, encoding)
+                    else:
+                        self.paged_fetch(table, stage, encoding, max(options['pages'], 1))
+                measured[name] = stage
+
+        if 'pdf' in stages:
+            dataset = SimpleNamespace(name=path.name, summary_json=summary, file=SimpleNamespace(path=str(path)))
+            with measure('pdf') as stage:
+                render_report(dataset, workdir / 'bench_report.pdf')
+                stage.rows = table.num_rows
+                stage.bytes = (workdir / 'bench_report.pdf').stat().st_size
+            measured['pdf'] = stage
+
+        db_stages = [name for name in DB_STAGES if name in stages]
+        if db_stages:
+            measured.update(DatabaseLoad(path, rows, options).run(db_stages))
+
+        remove_columnar(path)
+        self.stdout.write(f'{rows:,} rows ({file_bytes / 2**20:.1f} MiB CSV)')
+        for name in STAGES:
+            if name in measured:
+                m = measured[name].to_dict()
+                self.stdout.write(
+                    f"  {name:17s} {m['seconds']:9.3f} s  {m.get('rows_per_s', 0):>13,} rows/s  "
+                    f"peak RSS {m['peak_rss_mb']:8.1f} MiB (+{m['rss_growth_mb']:.1f})"
+                    + (f"  {m['wire_bytes'] / 2**20:.2f} MiB on the wire (x{m['compression_ratio']:g})"
+                       if 'compression_ratio' in m else '')
+                    + (f"  {m['per_s']:8.1f} req/s p50 {m['p50_ms']} ms p95 {m['p95_ms']} ms"
+                       + (f" ({m['errors']} errors)" if m['errors'] else '') if 'per_s' in m else '')
+                )
+        if 'summary' in measured and 'summary_plain' in measured and measured['summary_plain'].seconds > 0:
+            ratio = measured['summary'].seconds / measured['summary_plain'].seconds
+            self.stdout.write(f'  summary / summary_plain: x{ratio:.2f}')
+            if ratio > 1:
+                raise CommandError(
+                    f'The grouped summary is {ratio:.2f}x slower than the original averages + type counts '
+                    f'at {rows:,} rows'
+                )
+        return {name: measured[name].to_dict() for name in STAGES if name in measured}
+
+    @staticmethod
+    def time_summary(name, engine, table):
+        """Feed ``engine`` the table chunk by chunk, timing only its own work."""
+        seconds = 0.0
+        with measure(name) as stage:
+            for batch in iter_batches(slice(0, table.num_rows), ingest_chunk_rows()):
+                chunk = summary_chunk(table, batch)
+                start = time.perf_counter()
+                engine.update(*chunk)
+                seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            engine.result()
+            seconds += time.perf_counter() - start
+            stage.rows = table.num_rows
+        stage.seconds = seconds
+        return stage
+
+    @staticmethod
+    def full_fetch(table, stage, encoding):
+        """The whole table as the default JSON body, streamed (and encoded) like DataTableView."""
+        q = parse_query('')
+        selected, filtered = select_rows(table, q)
+        meta = {'total_count': table.num_rows, 'filtered_count': filtered, 'offset': 0, 'limit': None}
+
+        def body():
+            for part in TableJSONRenderer().stream(table, selected, meta):
+                part = part.encode()
+                stage.bytes += len(part)
+                yield part
+
+        start = time.perf_counter()
+        for part in (body() if encoding is None else compress_stream(body(), encoding)):
+            if stage.first_byte_s is None:
+                stage.first_byte_s = time.perf_counter() - start
+            if encoding is not None:
+                stage.wire_bytes += len(part)
+        stage.rows = table.num_rows
+        stage.requests = 1
+
+    @staticmethod
+    def paged_fetch(table, stage, encoding, pages):
+        """Sorted ``PAGE_ROWS``-row pages at spread offsets, each encoded as one body."""
+        step = max(table.num_rows // pages, 1)
+        for i in range(pages):
+            q = parse_query(f'offset={i * step}&limit={PAGE_ROWS}&sort=-Flowrate')
+            selected, filtered = select_rows(table, q)
+            meta = {'total_count': table.num_rows, 'filtered_count': filtered, 'offset': q.offset, 'limit': q.limit}
+            body = ''.join(TableJSONRenderer().stream(table, selected, meta)).encode()
+            stage.bytes += len(body)
+            if encoding is not None:
+                stage.wire_bytes += len(compress(body, encoding))
+            stage.rows += len(range(table.num_rows)[selected]) if isinstance(selected, slice) else len(selected)
+        stage.requests = pages
+
+    def report_baseline(self, results: dict, options):
+        try:
+            baseline = json.loads(Path(options['baseline']).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read baseline: {e}')
+        rows = compare(results, baseline)
+        if not rows:
+            self.stdout.write('No stages in common with the baseline.')
+            return
+        self.stdout.write('Compared with baseline:')
+        worst = None
+        for size, stage, before, after, change in rows:
+            self.stdout.write(f'  {int(size):>12,} {stage:17s} {before:9.3f} s -> {after:9.3f} s  {change:+7.1f}%')
+            worst = change if worst is None else max(worst, change)
+        limit = options['max_regression']
+        if limit is not None and worst > limit:
+            raise CommandError(f'Slowest stage regressed by {worst:.1f}% (limit {limit:g}%)')
+
+
+def summary_chunk(table, rows):
+    """
+    One parse-loop chunk as ingest has it: Type strings and the numeric columns, plus the
+    Type dictionary codes and dictionary the columnar writer produced for it.
+    """
+    df = pd.DataFrame({col: table.array(col)[rows] for col in NUMERIC_COLUMNS}, copy=False)
+    df['Type'] = table.values('Type', rows)
+    return df, table.array('Type')[rows], table.dictionary('Type')[:-1]
+
+
+class GroupedSummary:
+    """The ingest summary: per-type moments (SummaryAccumulator.update), percentiles excluded."""
+
+    def __init__(self):
+        self.accumulator = SummaryAccumulator()
+
+    def update(self, df, codes, names):
+        self.accumulator.update(df, codes, names)
+
+    def result(self):
+        return self.accumulator.result()
+
+
+class PlainSummary:
+    """Averages and type counts only (the summary before sketches existed)."""
+
+    def __init__(self):
+        self.sums, self.counts, self.types = {}, {}, {}
+
+    def update(self, df, codes=None, names=None):
+        for col in NUMERIC_COLUMNS:
+            self.sums[col] = self.sums.get(col, 0.0) + float(df[col].sum())
+            self.counts[col] = self.counts.get(col, 0) + int(df[col].count())
+        for k, v in df['Type'].value_counts().items():
+            self.types[k] = self.types.get(k, 0) + int(v)
+
+    def result(self):
+        return self.sums, self.counts, self.types
+
+
+class SketchSummary(PlainSummary):
+    """Plain summary plus an ungrouped ColumnSketch per column (the engine before grouping)."""
+
+    def __init__(self):
+        super().__init__()
+        self.sketches = {}
+
+    def update(self, df, codes=None, names=None):
+        super().update(df)
+        for col in NUMERIC_COLUMNS:
+            sketch = ColumnSketch.from_values(df[col].to_numpy(dtype='float64', na_value=np.nan))
+            self.sketches[col] = self.sketches[col].merge(sketch) if col in self.sketches else sketch
+
+    def result(self):
+        return super().result(), self.sketches
+
+
+class DatabaseLoad:
+    """The db_* stages: concurrent uploads of ``csv_path`` and reads through the Django stack."""
+
+    def __init__(self, csv_path: Path, rows: int, options):
+        self.csv = Path(csv_path).read_bytes()
+        self.rows = rows
+        self.threads = options['db_threads']
+        self.uploads = options['db_uploads']
+        self.reads = options['db_reads']
+
+    def run(self, stages: list) -> dict:
+        user = User.objects.create_user(f'bench-db-{uuid.uuid4().hex[:8]}', password=uuid.uuid4().hex)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + AuthToken.objects.create(user=user).key}
+        measured = {}
+        try:
+            with override_settings(EQUIPMENT_RESPONSE_CACHE=False, EQUIPMENT_RETENTION_PER_USER=0,
+                                   EQUIPMENT_ASYNC_INGEST=False):
+                self.read_ids = [pk for _, _, pk in (self.upload(0) for _ in range(3)) if pk]
+                if not self.read_ids:
+                    raise CommandError('Seed uploads failed; check the database configuration')
+                for name in stages:
+                    measured[name] = self.run_stage(name)
+        finally:
+            delete_datasets(list(EquipmentDataset.objects.filter(uploaded_by=user).values_list('pk', flat=True)))
+            user.delete()
+        return measured
+
+    def upload(self, i):
+        start = time.perf_counter()
+        r = Client().post('/api/upload/', {'file': SimpleUploadedFile(f'bench_{i}.csv', self.csv)}, **self.headers)
+        return 'upload', time.perf_counter() - start, r.json().get('id') if r.status_code == 201 else None
+
+    def read(self, i):
+        pk = self.read_ids[i % len(self.read_ids)]
+        url = ['/api/history/', f'/api/summary/{pk}/', f'/api/data/{pk}/?limit=100'][i % 3]
+        start = time.perf_counter()
+        r = Client().get(url)
+        if r.streaming:
+            b''.join(r.streaming_content)
+        return 'read', time.perf_counter() - start, r.status_code == 200 or None
+
+    def run_stage(self, name):
+        calls = []
+        if name in ('db_upload', 'db_mixed'):
+            calls += [(self.upload, i) for i in range(self.uploads)]
+        if name in ('db_read', 'db_mixed'):
+            calls += [(self.read, i) for i in range(self.reads)]
+        if name == 'db_mixed':  # interleaved evenly
+            calls.sort(key=lambda c: c[1] / (self.uploads if c[0] == self.upload else self.reads))
+
+        def call(fn, i):
+            try:
+                return fn(i)
+            except Exception:
+                return fn.__name__, 0.0, None
+            finally:
+                close_old_connections()  # what request_finished does in a server (Client skips it)
+
+        with measure(name) as stage:
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                done = list(pool.map(lambda c: call(*c), calls))
+        stage.latencies = [t for _, t, result in done if result]
+        stage.errors = sum(1 for _, _, result in done if not result)
+        if name == 'db_mixed':
+            for kind in ('upload', 'read'):
+                stage.extra[kind] = {
+                    **latency_stats([t for k, t, result in done if k == kind and result], stage.seconds),
+                    'errors': sum(1 for k, _, result in done if k == kind and not result),
+                }
+        if name != 'db_read':
+            stage.rows = sum(1 for k, _, result in done if k == 'upload' and result) * self.rows
+        return stage
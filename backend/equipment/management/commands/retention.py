@@ -0,0 +1,36 @@
+"""
+Apply the dataset retention policies now (they also run in the background after uploads),
+and recover ingest jobs left unfinished by a stopped server process.
+
+    python manage.py retention
+    python manage.py retention --dry-run
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from equipment.jobs import recover_stale_jobs
+from equipment.retention import expired_by_age, expired_by_bytes, expired_by_count, run_retention
+
+
+class Command(BaseCommand):
+    help = 'Delete (or archive, for hot datasets) datasets expired by the EQUIPMENT_RETENTION_* policies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List what each policy selects now; byte budget results assume nothing else is removed')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            now = timezone.now()
+            for name, expired in [('count', expired_by_count()), ('age', expired_by_age(now)), ('bytes', expired_by_bytes())]:
+                ids = [] if expired is None else list(expired.order_by('uploaded_at', 'pk').values_list('pk', flat=True))
+                self.stdout.write(f'{name:6s} {len(ids):6d} expired' + (f': {ids[:50]}' if ids else ''))
+            return
+        result = run_retention()
+        self.stdout.write(
+            f'Deleted {len(result.deleted)}, archived {len(result.archived)}, '
+            f'freed {result.freed_bytes / 2**20:.1f} MiB'
+        )
+        requeued, failed = recover_stale_jobs()
+        if requeued or failed:
+            self.stdout.write(f'Stale ingest jobs: requeued {requeued}, failed {failed}')
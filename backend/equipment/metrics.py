@@ -0,0 +1,313 @@
+"""
+In-process request and stage metrics, exposed in Prometheus text format at /api/metrics/.
+
+Metrics live in this process only: with several workers, each one reports its own
+numbers (scrape every worker, or aggregate in Prometheus). ``timed`` works as both a
+context manager and a decorator; ``StageTimings`` sums stages that are interleaved in
+a loop (such as chunked ingest) and records each total once.
+"""
+from __future__ import annotations
+import cProfile
+import io
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+PROFILE_LINES = 40
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_str(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, v) for key, v in self._values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[i] += 1
+            entry[-1] += value
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(key, list(entry)) for key, entry in self._values.items()]
+        for key, entry in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), entry[:-1]):
+                cumulative += n
+                out.append((f'{self.name}_bucket', key + (('le', str(bound)),), cumulative))
+            out.append((f'{self.name}_sum', key, entry[-1]))
+            out.append((f'{self.name}_count', key, cumulative))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, fn):
+        """``fn()`` returns ``[(name, kind, help, value)]`` gauges/counters read at scrape time."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{_label_str(labels)} {value:g}' for name, labels, value in metric.samples())
+        for collect in self._collectors:
+            for name, kind, help, value in collect():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {value:g}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+request_seconds = registry.register(Histogram('equipment_request_seconds', 'Request latency until the response is returned (streamed bodies excluded).'))
+requests_total = registry.register(Counter('equipment_requests_total', 'Requests by endpoint, method and status.'))
+request_sql_queries = registry.register(Histogram('equipment_request_sql_queries', 'SQL queries executed per request.', COUNT_BUCKETS))
+stage_seconds = registry.register(Histogram('equipment_stage_seconds', 'Time spent in instrumented service stages.'))
+rows_processed = registry.register(Counter('equipment_rows_processed_total', 'Rows processed by stage.'))
+bytes_read = registry.register(Counter('equipment_bytes_read_total', 'Bytes read by stage.'))
+
+
+class timed(ContextDecorator):
+    """Record the duration of a block (or every call of a decorated function) under ``stage``."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._starts = threading.local()
+
+    def __enter__(self):
+        self._starts.__dict__.setdefault('stack', []).append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        stage_seconds.observe(time.perf_counter() - self._starts.stack.pop(), stage=self.stage)
+        return False
+
+
+class StageTimings:
+    """Accumulates time per stage across a loop; ``record()`` observes each total once."""
+
+    def __init__(self):
+        self.totals: dict[str, float] = {}
+
+    def __call__(self, stage: str):
+        return _Segment(self, stage)
+
+    def record(self):
+        for stage, seconds in self.totals.items():
+            stage_seconds.observe(seconds, stage=stage)
+
+
+class _Segment:
+    def __init__(self, timings: StageTimings, stage: str):
+        self.timings, self.stage = timings, stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        totals = self.timings.totals
+        totals[self.stage] = totals.get(self.stage, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def _endpoint(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+def _session_user(request):
+    """The session's user; this middleware runs before SessionMiddleware and AuthenticationMiddleware."""
+    key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not key:
+        return None
+    from django.contrib.auth import get_user
+    engine = import_module(settings.SESSION_ENGINE)
+    return get_user(SimpleNamespace(session=engine.SessionStore(key)))
+
+
+def _profile_allowed(request) -> bool:
+    if request.GET.get('profile') != '1':
+        return False
+    user = _session_user(request)
+    if user is None or not user.is_authenticated:
+        from .auth import resolve_token
+        auth = request.META.get('HTTP_AUTHORIZATION') or ''
+        key = auth[len('Token '):] if auth.startswith('Token ') else request.GET.get('token', '')
+        user = resolve_token(key.strip())
+    return bool(user is not None and user.is_staff)
+
+
+# Queries are counted per request through a context variable, which follows the request
+# into the threads async views run their ORM calls in.
+_request_queries: ContextVar[list | None] = ContextVar('equipment_request_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter)
+
+
+class MetricsMiddleware:
+    """
+    Times every request and counts its SQL queries. Staff may add ``?profile=1`` to get a
+    cProfile breakdown (including a streamed body) as text/plain instead of the response;
+    under ASGI that covers everything the event loop ran meanwhile, not only the request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler = cProfile.Profile() if _profile_allowed(request) else None
+        queries = [0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            response = self.get_response(request)
+            if profiler is not None and response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _request_queries.reset(token)
+        return self._finish(request, response, time.perf_counter() - start, queries[0], profiler)
+
+    async def __acall__(self, request):
+        allowed = request.GET.get('profile') == '1' and await sync_to_async(_profile_allowed)(request)
+        profiler = cProfile.Profile() if allowed else None
+        queries = [0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            response = await self.get_response(request)
+            if profiler is not None and response.streaming:
+                if response.is_async:
+                    async for _ in response.streaming_content:
+                        pass
+                else:
+                    for _ in response.streaming_content:
+                        pass
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _request_queries.reset(token)
+        return self._finish(request, response, time.perf_counter() - start, queries[0], profiler)
+
+    @staticmethod
+    def _finish(request, response, elapsed, queries, profiler):
+        endpoint = _endpoint(request)
+        request_seconds.observe(elapsed, endpoint=endpoint, method=request.method)
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        request_sql_queries.observe(queries, endpoint=endpoint)
+        if profiler is None:
+            return response
+        out = io.StringIO()
+        out.write(f'{request.method} {request.get_full_path()} -> {response.status_code} '
+                  f'in {elapsed:.3f} s, {queries} SQL queries\n\n')
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(
+            getattr(settings, 'EQUIPMENT_PROFILE_LINES', PROFILE_LINES))
+        return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+
+
+def _token_cache_stats():
+    from .auth import token_cache
+    stats = token_cache.stats()
+    return [
+        ('equipment_token_cache_hits_total', 'counter', 'Token lookups answered from the cache.', stats['hits']),
+        ('equipment_token_cache_misses_total', 'counter', 'Token lookups that went to the database.', stats['misses']),
+        ('equipment_token_cache_entries', 'gauge', 'Entries in the in-process token cache.', stats['size']),
+    ]
+
+
+registry.add_collector(_token_cache_stats)
+
+
+def _response_cache_stats():
+    from .httpcache import response_cache
+    stats = response_cache.stats()
+    return [
+        ('equipment_response_cache_hits_total', 'counter', 'Read requests answered from the response cache.', stats['hits']),
+        ('equipment_response_cache_misses_total', 'counter', 'Cacheable read requests that ran the view.', stats['misses']),
+        ('equipment_response_cache_entries', 'gauge', 'Entries in the in-process response cache.', stats['size']),
+        ('equipment_response_cache_bytes', 'gauge', 'Body bytes held by the in-process response cache.', stats['bytes']),
+    ]
+
+
+registry.add_collector(_response_cache_stats)
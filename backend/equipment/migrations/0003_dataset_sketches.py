@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0002_ingest_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='sketches',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
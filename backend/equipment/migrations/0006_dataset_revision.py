@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0005_dataset_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipment', '0008_dataset_charts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseGeneration',
+            fields=[
+                ('scope', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=12)),
+            ],
+        ),
+    ]
@@ -1,6 +1,7 @@
 import secrets
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class AuthToken(models.Model):
@@ -19,7 +20,18 @@ class AuthToken(models.Model):
 
 
 class EquipmentDataset(models.Model):
-    """Stores metadata for each uploaded CSV. We keep only last 5 in history."""
+    """Stores metadata for each uploaded CSV. Old ones are removed by the retention policies (retention.py)."""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     name = models.CharField(max_length=255, default='Untitled')
     file = models.FileField(upload_to='uploads/', null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
@@ -31,9 +43,106 @@ class EquipmentDataset(models.Model):
     )
     total_count = models.IntegerField(default=0)
     summary_json = models.JSONField(default=dict, blank=True)  # averages, type_distribution
+    sketches = models.JSONField(default=dict, blank=True)  # per-column ColumnSketch dicts for analytics
+    charts = models.JSONField(default=dict, blank=True)  # histograms, box plots, scatter; see charts.py
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_READY)
+    size_bytes = models.BigIntegerField(default=0)  # stored file + columnar copy, for retention
+    last_accessed_at = models.DateTimeField(null=True, blank=True)  # last table/report read (hourly resolution)
+    archived_at = models.DateTimeField(null=True, blank=True)  # compacted by retention; see retention.archive
+    revision = models.PositiveIntegerField(default=0)  # bumped by every append; part of table/report ETags
+    content_sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)  # of the upload as sent; see blobs.py
 
     class Meta:
         ordering = ['-uploaded_at']
 
     def __str__(self):
         return f"{self.name} ({self.uploaded_at})"
+
+    @property
+    def is_ready(self):
+        return self.status == self.STATUS_READY
+
+
+class IngestJob(models.Model):
+    """Background parse/summarize job for an upload accepted with 202."""
+    dataset = models.ForeignKey(EquipmentDataset, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=EquipmentDataset.STATUS_CHOICES, default=EquipmentDataset.STATUS_PENDING)
+    bytes_total = models.BigIntegerField(default=0)
+    bytes_processed = models.BigIntegerField(default=0)
+    rows_parsed = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Last claim or progress write; unfinished jobs silent for long are stale (see jobs.recover_stale_jobs).
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Ingest job {self.pk} ({self.status})"
+
+    @property
+    def eta_seconds(self):
+        """Remaining time extrapolated from throughput so far (None until measurable)."""
+        if self.status != EquipmentDataset.STATUS_PROCESSING or not self.started_at or not self.bytes_processed:
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        remaining = max(self.bytes_total - self.bytes_processed, 0)
+        return round(elapsed / self.bytes_processed * remaining, 1)
+
+
+class UploadSession(models.Model):
+    """A chunked upload in progress: chunks are written at their offsets into one partial file."""
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Open'),
+        (STATUS_COMPLETE, 'Complete'),
+    ]
+
+    key = models.CharField(max_length=32, unique=True, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    name = models.CharField(max_length=255, default='Untitled')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    dataset = models.ForeignKey(EquipmentDataset, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = secrets.token_hex(16)
+        return super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Upload {self.key} ({self.filename})"
+
+    @property
+    def chunk_count(self):
+        return max((self.size + self.chunk_size - 1) // self.chunk_size, 1)
+
+    def expected_chunk_size(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+class UploadChunk(models.Model):
+    """One received, checksum-verified chunk of an UploadSession."""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    sha256 = models.CharField(max_length=64)
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk')]
+        ordering = ['index']
+
+
+class ResponseGeneration(models.Model):
+    """Current response-cache generation of a scope, shared by every server process; see httpcache.py."""
+    scope = models.CharField(max_length=64, primary_key=True)
+    token = models.CharField(max_length=12)
+
+    def __str__(self):
+        return f"{self.scope}: {self.token}"
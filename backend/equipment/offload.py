@@ -0,0 +1,132 @@
+"""
+CPU-bound work for the async read views, run in a pool of worker processes.
+
+Parsing a CSV into its columnar copy, selecting rows, encoding table batches and
+rendering PDF reports hold the GIL, so under ASGI they would stall every connection
+served by the event loop. ``run_cpu`` sends them to a ``ProcessPoolExecutor`` of
+EQUIPMENT_PROCESS_WORKERS processes (0: a thread pool instead, for hosts where extra
+processes are not wanted). Every server process starts its own pool, so the setting's
+default shares the CPUs between the WEB_CONCURRENCY server processes. The functions
+below are the tasks: they take and return only picklable values (paths, query strings,
+row selections, bytes) and never touch the database. Stage timings recorded inside
+worker processes stay there; /api/metrics/ reports the views' own timings.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+
+MAX_OPEN_TABLES = 32
+
+_pool: Executor | None = None
+_pool_lock = threading.Lock()
+_tables: dict = {}
+
+
+def _init_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+def get_pool() -> Executor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = settings.EQUIPMENT_PROCESS_WORKERS
+            if workers:
+                # spawn, not fork: the parent runs an event loop and threads.
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=_init_worker)
+            else:
+                _pool = ThreadPoolExecutor(thread_name_prefix='equipment-cpu')
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def run_cpu(fn, *args):
+    """Await ``fn(*args)`` run in the worker pool."""
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), fn, *args)
+
+
+# -- tasks (run in the workers) ---------------------------------------------------
+# Imports are local: workers import this module before ``_init_worker`` sets Django up.
+
+def _table(file_path):
+    """The columnar table for ``file_path``, opened once per worker while it is unchanged."""
+    from .columnar import META_NAME, columnar_path
+    from .services import load_table
+    meta = columnar_path(file_path) / META_NAME
+    cached = _tables.get(file_path)
+    try:
+        if cached is not None and cached[0] == meta.stat().st_mtime_ns:
+            return cached[1]
+    except FileNotFoundError:
+        pass
+    table = load_table(file_path)
+    if len(_tables) >= MAX_OPEN_TABLES:
+        _tables.clear()
+    _tables[file_path] = (meta.stat().st_mtime_ns, table)
+    return table
+
+
+def prepare_table(file_path) -> int:
+    """Make sure ``file_path`` has its columnar copy (parsing the CSV if not); returns the row count."""
+    return _table(file_path).num_rows
+
+
+def _renderer(fmt: str):
+    from .renderers import TABLE_RENDERERS
+    return next(r for r in TABLE_RENDERERS if r.format == fmt)()
+
+
+def select_table(file_path, query_string: str, fmt: str, render_max_rows: int):
+    """
+    Resolve a table query. Returns ``(meta, rows, body)``: ``body`` is the whole encoded
+    response when at most ``render_max_rows`` rows are selected (saving a round trip per
+    page), else None and the caller streams ``rows`` with ``render_batch``.
+    Raises QueryError for an invalid query.
+    """
+    from .query import parse_query, select_rows
+    query = parse_query(query_string)
+    table = _table(file_path)
+    rows, filtered_count = select_rows(table, query)
+    meta = {
+        'total_count': table.num_rows,
+        'filtered_count': filtered_count,
+        'offset': query.offset,
+        'limit': query.limit,
+    }
+    selected = len(range(table.num_rows)[rows]) if isinstance(rows, slice) else len(rows)
+    if selected > render_max_rows:
+        return meta, rows, None
+    renderer = _renderer(fmt)
+    body = b''.join(c.encode() if isinstance(c, str) else c for c in renderer.stream(table, rows, meta))
+    return meta, rows, body
+
+
+def render_head(file_path, fmt: str, meta: dict):
+    return _renderer(fmt).head(_table(file_path), meta)
+
+
+def render_batch(file_path, fmt: str, rows, first: bool):
+    return _renderer(fmt).batch(_table(file_path), rows, first)
+
+
+def render_report_part(file_path, context: dict, segment, out_path):
+    """One part of a report (see ``reports.render_report``): the summary pages when ``segment`` is None."""
+    from .reports import render_segment_part, render_summary_part
+    if segment is None:
+        render_summary_part(context, out_path)
+    else:
+        render_segment_part(_table(file_path), context, segment, out_path)
@@ -0,0 +1,142 @@
+"""
+Concatenate PDF files into one, streaming.
+
+pypdf's ``PdfWriter`` keeps every page it is given in memory until the result is
+written. ``PdfConcatenator`` instead copies each input's pages (and everything they
+reference) to the output as soon as the input is appended, keeping only byte offsets
+for the cross-reference table, so documents of any length are merged holding one input
+at a time. Inputs can add a bookmark pointing at their first page.
+"""
+from __future__ import annotations
+from array import array
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, TextStringObject,
+)
+
+HEADER = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+
+
+class PdfConcatenator:
+    """Writes the pages of ``append``ed PDF files, in order, to the binary file ``out``."""
+
+    def __init__(self, out):
+        self.out = out
+        self.offsets = array('q', [0])  # by object number; 0 heads the free list
+        self.page_refs = array('q')
+        self.bookmarks: list[tuple[str, int]] = []  # (title, page object number)
+        self.out.write(HEADER)
+        self.pages_num = self._reserve()
+
+    def _reserve(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets) - 1
+
+    def _write(self, num: int, obj):
+        self.offsets[num] = self.out.tell()
+        self.out.write(b'%d 0 obj\n' % num)
+        obj.write_to_stream(self.out)
+        self.out.write(b'\nendobj\n')
+
+    def append(self, path, bookmark: str | None = None):
+        with open(path, 'rb') as f:
+            reader = PdfReader(f)
+            numbers: dict[tuple[int, int], int] = {}
+            pending: list[tuple[int, IndirectObject]] = []
+
+            def ref(indirect: IndirectObject) -> IndirectObject:
+                key = (indirect.idnum, indirect.generation)
+                if key not in numbers:
+                    numbers[key] = self._reserve()
+                    pending.append((numbers[key], indirect))
+                return IndirectObject(numbers[key], 0, None)
+
+            def relink(obj):
+                """Renumber the references inside ``obj`` (in place) to output object numbers."""
+                if isinstance(obj, IndirectObject):
+                    return ref(obj)
+                if isinstance(obj, DictionaryObject):  # streams too
+                    for key, value in list(dict.items(obj)):
+                        dict.__setitem__(obj, key, relink(value))
+                elif isinstance(obj, ArrayObject):
+                    for i, value in enumerate(list.__iter__(obj)):
+                        list.__setitem__(obj, i, relink(value))
+                return obj
+
+            pages = list(reader.pages)
+            # Numbered up front so references to a page from elsewhere resolve to it.
+            page_numbers = []
+            for page in pages:
+                key = (page.indirect_reference.idnum, page.indirect_reference.generation)
+                numbers[key] = self._reserve()
+                page_numbers.append(numbers[key])
+            for page, num in zip(pages, page_numbers):
+                dict.pop(page, NameObject('/Parent'), None)  # the input's page tree is not copied
+                relink(page)
+                dict.__setitem__(page, NameObject('/Parent'), IndirectObject(self.pages_num, 0, None))
+                self._write(num, page)
+                while pending:
+                    obj_num, indirect = pending.pop()
+                    self._write(obj_num, relink(indirect.get_object()))
+            if bookmark and page_numbers:
+                self.bookmarks.append((bookmark, page_numbers[0]))
+            self.page_refs.extend(page_numbers)
+
+    def close(self, title: str | None = None):
+        """Write the page tree, bookmarks, catalog and cross-reference table."""
+        # One flat page tree, written reference by reference rather than built as objects.
+        self.offsets[self.pages_num] = self.out.tell()
+        self.out.write(b'%d 0 obj\n<< /Type /Pages /Count %d /Kids [' % (self.pages_num, len(self.page_refs)))
+        for i in range(0, len(self.page_refs), 1024):
+            self.out.write(b''.join(b'%d 0 R ' % n for n in self.page_refs[i:i + 1024]))
+        self.out.write(b'] >>\nendobj\n')
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(self.pages_num, 0, None),
+        })
+        if self.bookmarks:
+            catalog[NameObject('/Outlines')] = IndirectObject(self._write_bookmarks(), 0, None)
+            catalog[NameObject('/PageMode')] = NameObject('/UseOutlines')
+        catalog_num = self._reserve()
+        self._write(catalog_num, catalog)
+        info = DictionaryObject({NameObject('/Producer'): TextStringObject('equipment reports')})
+        if title:
+            info[NameObject('/Title')] = TextStringObject(title)
+        info_num = self._reserve()
+        self._write(info_num, info)
+
+        xref = self.out.tell()
+        self.out.write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self.offsets))
+        for offset in self.offsets[1:]:
+            self.out.write(b'%010d 00000 n \n' % offset)
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(len(self.offsets)),
+            NameObject('/Root'): IndirectObject(catalog_num, 0, None),
+            NameObject('/Info'): IndirectObject(info_num, 0, None),
+        })
+        self.out.write(b'trailer\n')
+        trailer.write_to_stream(self.out)
+        self.out.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+    def _write_bookmarks(self) -> int:
+        root = self._reserve()
+        items = [self._reserve() for _ in self.bookmarks]
+        for i, ((title, page), num) in enumerate(zip(self.bookmarks, items)):
+            item = DictionaryObject({
+                NameObject('/Title'): TextStringObject(title),
+                NameObject('/Parent'): IndirectObject(root, 0, None),
+                NameObject('/Dest'): ArrayObject([IndirectObject(page, 0, None), NameObject('/Fit')]),
+            })
+            if i:
+                item[NameObject('/Prev')] = IndirectObject(items[i - 1], 0, None)
+            if i + 1 < len(items):
+                item[NameObject('/Next')] = IndirectObject(items[i + 1], 0, None)
+            self._write(num, item)
+        self._write(root, DictionaryObject({
+            NameObject('/Type'): NameObject('/Outlines'),
+            NameObject('/First'): IndirectObject(items[0], 0, None),
+            NameObject('/Last'): IndirectObject(items[-1], 0, None),
+            NameObject('/Count'): NumberObject(len(items)),
+        }))
+        return root
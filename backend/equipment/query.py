@@ -0,0 +1,137 @@
+"""Pagination, sorting and filtering over a dataset's columnar table."""
+from __future__ import annotations
+import bisect
+import re
+from dataclasses import dataclass, field
+from urllib.parse import unquote_plus
+
+import numpy as np
+
+from .columnar import FLOAT_KIND, ColumnarTable
+
+
+RESERVED_PARAMS = {'offset', 'limit', 'sort', 'format', 'token', 'profile'}
+MAX_LIMIT = 10000
+FILTER_RE = re.compile(r'^(?P<column>[^<>=!]+?)(?P<op>>=|<=|!=|>|<|=)(?P<value>.*)$')
+
+
+class QueryError(ValueError):
+    """Invalid pagination, sort or filter parameter."""
+
+
+@dataclass
+class TableQuery:
+    offset: int = 0
+    limit: int | None = None
+    sort: str | None = None
+    descending: bool = False
+    filters: list[tuple[str, str, str]] = field(default_factory=list)
+
+    @property
+    def is_plain(self) -> bool:
+        return self.sort is None and not self.filters
+
+
+def _int_param(value: str, name: str) -> int:
+    try:
+        n = int(value)
+    except ValueError:
+        raise QueryError(f'{name} must be an integer')
+    if n < 0:
+        raise QueryError(f'{name} must not be negative')
+    return n
+
+
+def parse_query(query_string: str) -> TableQuery:
+    """
+    Parse ``offset``, ``limit``, ``sort=<column>`` / ``sort=-<column>`` and per-column
+    filters such as ``Type=Reactor`` or ``Pressure>2.0`` from a raw query string.
+    The raw string is used because ``Pressure>2.0`` is not a key=value pair.
+    """
+    query = TableQuery()
+    for part in query_string.split('&'):
+        if not part:
+            continue
+        match = FILTER_RE.match(unquote_plus(part))
+        if not match:
+            raise QueryError(f'Invalid filter: {unquote_plus(part)}')
+        column, op, value = match.group('column').strip(), match.group('op'), match.group('value').strip()
+        if column in RESERVED_PARAMS:
+            if op != '=':
+                raise QueryError(f'Invalid parameter: {column}{op}{value}')
+            if column == 'offset':
+                query.offset = _int_param(value, 'offset')
+            elif column == 'limit':
+                query.limit = min(_int_param(value, 'limit'), MAX_LIMIT)
+            elif column == 'sort' and value:
+                query.descending = value.startswith('-')
+                query.sort = value.lstrip('-')
+            continue
+        query.filters.append((column, op, value))
+    return query
+
+
+def _filter_mask(table: ColumnarTable, column: str, op: str, value: str) -> np.ndarray:
+    data = table.array(column)
+    if table.kind(column) == FLOAT_KIND:
+        try:
+            target = float(value)
+        except ValueError:
+            raise QueryError(f'{column} filter needs a number, got {value!r}')
+        if op in ('=', '!='):
+            mask = data == target
+            return ~mask if op == '!=' else mask
+        # Range filters binary-search the sorted index instead of comparing every row.
+        order = table.sort_order(column)
+        valid = _valid_count(table, column, order)
+        search = bisect.bisect_left if op in ('>=', '<') else bisect.bisect_right
+        cut = search(order, target, 0, valid, key=lambda row: data[row])
+        selected = order[cut:valid] if op in ('>', '>=') else order[:min(cut, valid)]
+        mask = np.zeros(len(data), dtype=bool)
+        mask[selected] = True
+        return mask
+    if op not in ('=', '!='):
+        raise QueryError(f'{column} only supports = and != filters')
+    matches = np.flatnonzero(table.dictionary(column)[:-1] == value)
+    code = int(matches[0]) if len(matches) else -2
+    mask = data == code
+    return ~mask if op == '!=' else mask
+
+
+def _valid_count(table: ColumnarTable, column: str, order) -> int:
+    """Number of non-missing values; missing values sit at the end of the sort order."""
+    data = table.array(column)
+    if table.kind(column) == FLOAT_KIND:
+        return bisect.bisect_left(order, True, key=lambda row: bool(np.isnan(data[row])))
+    return bisect.bisect_left(order, True, key=lambda row: bool(data[row] == -1))
+
+
+def select_rows(table: ColumnarTable, query: TableQuery) -> tuple[object, int]:
+    """
+    Resolve ``query`` against ``table``. Returns ``(rows, filtered_count)`` where ``rows``
+    selects the requested page (a slice when no sort/filter applies, else an index array).
+    """
+    for column in [query.sort] + [f[0] for f in query.filters]:
+        if column is not None and column not in table.column_names:
+            raise QueryError(f'Unknown column: {column}')
+    end = None if query.limit is None else query.offset + query.limit
+    if query.is_plain:
+        start = min(query.offset, table.num_rows)
+        stop = table.num_rows if end is None else min(end, table.num_rows)
+        return slice(start, stop), table.num_rows
+
+    mask = None
+    for column, op, value in query.filters:
+        m = _filter_mask(table, column, op, value)
+        mask = m if mask is None else mask & m
+
+    if query.sort is not None:
+        order = np.asarray(table.sort_order(query.sort))
+        if query.descending:
+            valid = _valid_count(table, query.sort, order)
+            order = np.concatenate([order[:valid][::-1], order[valid:]])
+        if mask is not None:
+            order = order[mask[order]]
+        return order[query.offset:end], len(order)
+    rows = np.flatnonzero(mask)
+    return rows[query.offset:end], len(rows)
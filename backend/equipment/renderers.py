@@ -0,0 +1,177 @@
+"""
+Streaming table formats for DataTableView.
+
+The renderers take part in normal DRF content negotiation (``Accept`` header or
+``?format=``), but table rows are written by ``stream()`` in row batches so time to
+first byte and memory use do not grow with the dataset. ``render()`` is only used
+for error payloads, which are always sent as JSON.
+"""
+from __future__ import annotations
+import json
+
+import numpy as np
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .columnar import FLOAT_KIND, ColumnarTable
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is optional
+    pa = None
+
+STREAM_BATCH_ROWS = 10_000
+ARROW_EOS = b'\xff\xff\xff\xff\x00\x00\x00\x00'  # continuation marker + zero length
+
+
+def iter_batches(rows, batch_rows: int = STREAM_BATCH_ROWS):
+    """Split a row selection (slice or index array) into batches of at most ``batch_rows``."""
+    if isinstance(rows, slice):
+        for start in range(rows.start, rows.stop, batch_rows):
+            yield slice(start, min(start + batch_rows, rows.stop))
+    else:
+        for start in range(0, len(rows), batch_rows):
+            yield rows[start:start + batch_rows]
+
+
+def _json(value) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+
+class StreamingTableRenderer(BaseRenderer):
+    """
+    A body is ``head()``, then ``batch()`` for each row batch, then ``tail()``. The pieces
+    are separate so batches can also be rendered elsewhere (see ``offload``) and joined.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = 'application/json'
+        return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+    def stream(self, table: ColumnarTable, rows, meta: dict):
+        """Yield the encoded body for ``rows`` of ``table``; ``meta`` holds counts and paging."""
+        yield self.head(table, meta)
+        first = True
+        for batch in iter_batches(rows):
+            chunk = self.batch(table, batch, first)
+            if chunk:
+                yield chunk
+                first = False
+        tail = self.tail()
+        if tail:
+            yield tail
+
+    def head(self, table: ColumnarTable, meta: dict):
+        raise NotImplementedError
+
+    def batch(self, table: ColumnarTable, rows, first: bool):
+        """Encoded rows of one batch (empty if there are none); ``first`` if nothing was written before."""
+        raise NotImplementedError
+
+    def tail(self):
+        return ''
+
+
+class TableJSONRenderer(StreamingTableRenderer):
+    """The default ``{"data": [{...}, ...], "total_count": ...}`` shape, streamed."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def head(self, table, meta):
+        return _json(meta)[:-1] + ',"data":['
+
+    def batch(self, table, rows, first):
+        df = table.to_dataframe(rows=rows)
+        if not len(df):
+            return ''
+        chunk = df.to_json(orient='records', double_precision=15)[1:-1]
+        return chunk if first else ',' + chunk
+
+    def tail(self):
+        return ']}'
+
+
+class NDJSONRenderer(StreamingTableRenderer):
+    """One JSON object per line: a header line with counts, then one line per row."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def head(self, table, meta):
+        return _json(meta) + '\n'
+
+    def batch(self, table, rows, first):
+        df = table.to_dataframe(rows=rows)
+        if not len(df):
+            return ''
+        return df.to_json(orient='records', lines=True, double_precision=15).rstrip('\n') + '\n'
+
+
+class ColumnsJSONRenderer(StreamingTableRenderer):
+    """Column-oriented JSON: keys are written once per batch, not once per row."""
+    media_type = 'application/vnd.equipment.columns+json'
+    format = 'columns'
+
+    def head(self, table, meta):
+        return _json({**meta, 'columns': table.column_names})[:-1] + ',"batches":['
+
+    def batch(self, table, rows, first):
+        df = table.to_dataframe(rows=rows)
+        if not len(df):
+            return ''
+        parts = [_json(name) + ':' + df.iloc[:, i].to_json(orient='values', double_precision=15)
+                 for i, name in enumerate(table.column_names)]
+        body = '{' + ','.join(parts) + '}'
+        return body if first else ',' + body
+
+    def tail(self):
+        return ']}'
+
+
+class ArrowStreamRenderer(StreamingTableRenderer):
+    """
+    Apache Arrow IPC stream, one record batch per row batch (requires pyarrow): the schema
+    message, one encapsulated message per batch, then the end-of-stream marker.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+
+    @staticmethod
+    def _schema(table, meta=None):
+        return pa.schema(
+            [pa.field(c['name'], pa.float64() if c['kind'] == FLOAT_KIND else pa.string()) for c in table.columns],
+            metadata=meta and {'total_count': str(meta['total_count']), 'filtered_count': str(meta['filtered_count'])},
+        )
+
+    def head(self, table, meta):
+        return self._schema(table, meta).serialize().to_pybytes()
+
+    def batch(self, table, rows, first):
+        arrays = []
+        for c in table.columns:
+            values = table.values(c['name'], rows)
+            if c['kind'] == FLOAT_KIND:
+                arrays.append(pa.array(np.asarray(values), from_pandas=True))
+            else:
+                arrays.append(pa.array(values, type=pa.string()))
+        return pa.record_batch(arrays, schema=self._schema(table)).serialize().to_pybytes()
+
+    def tail(self):
+        return ARROW_EOS
+
+
+TABLE_RENDERERS = [TableJSONRenderer, NDJSONRenderer, ColumnsJSONRenderer]
+if pa is not None:
+    TABLE_RENDERERS.append(ArrowStreamRenderer)
+
+
+def check_format(fmt: str | None):
+    """
+    Raise NotAcceptable (406) for ``?format=arrow`` when pyarrow is not installed; content
+    negotiation alone would answer 404 for a format with no renderer.
+    """
+    if fmt == ArrowStreamRenderer.format and pa is None:
+        raise NotAcceptable('Arrow output needs the pyarrow package on the server')
@@ -0,0 +1,376 @@
+"""
+PDF report rendering with an on-disk cache of rendered reports.
+
+A report is a summary part (totals, per-column statistics and charts) followed by every
+row of the dataset in one section per equipment Type. Sections are cut into segments of
+SEGMENT_ROWS rows; the summary part and the segments are rendered to separate PDFs in
+the ``offload`` worker pool, a few ahead of the merge, and concatenated in order into the
+cached report by ``pdfmerge.PdfConcatenator``. Each worker lays out one segment at a time
+(ROWS_PER_PAGE rows per table), so peak memory does not grow with the row count.
+
+The download views never render: on a cache miss they queue a background render and
+answer 202 with Retry-After (RETRY_AFTER_SECONDS) until ``cached_report`` finds the file.
+"""
+from __future__ import annotations
+import os
+import tempfile
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .columnar import TEXT_KIND
+from .metrics import Counter, registry, timed
+from .offload import get_pool, render_report_part
+from .pdfmerge import PdfConcatenator
+from .services import load_table
+
+# Bump whenever the report layout changes so cached PDFs are re-rendered.
+REPORT_TEMPLATE_VERSION = 2
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+SEGMENT_ROWS = 2000  # rows per worker task
+ROWS_PER_PAGE = 45
+SCAN_ROWS = 1_000_000  # Type codes read at a time while planning sections
+MAX_SECTIONS = 50  # with more distinct types, rows are listed in one section in stored order
+CHART_TYPES = 12
+PARTS_IN_FLIGHT_PER_WORKER = 2
+RETRY_AFTER_SECONDS = 5
+NO_TYPE = '(no type)'
+
+report_cache_requests = registry.register(Counter('equipment_report_cache_total', 'Report requests by cache result (hit or miss).'))
+
+TYPE_TABLE_STYLE = TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey), ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'), ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12), ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black)])
+STATS_TABLE_STYLE = TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey), ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'), ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8), ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black)])
+DATA_TABLE_STYLE = TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey), ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'), ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 7), ('TOPPADDING', (0, 0), (-1, -1), 1.5), ('BOTTOMPADDING', (0, 0), (-1, -1), 1.5),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white), ('GRID', (0, 0), (-1, -1), 0.25, colors.black)])
+CHART_COLOR = colors.HexColor('#4e79a7')
+STAT_COLUMNS = ['count', 'mean', 'std', 'min', 'p50', 'p95', 'p99', 'max']
+MAX_CELL_CHARS = 32
+
+
+@dataclass(frozen=True)
+class Segment:
+    """
+    Rows ``first`` onwards (0-based, within the section) of one report section: the rows
+    in ``start:stop`` whose Type code is ``code``, or all of them when ``code`` is None.
+    """
+    section: str
+    code: int | None
+    start: int
+    stop: int
+    first: int
+    section_rows: int
+
+
+def plan_segments(table) -> list[Segment]:
+    """
+    Cut ``table`` into segments of SEGMENT_ROWS rows, section by section (most common Type
+    first, rows without one last). Two passes over the Type codes, SCAN_ROWS at a time:
+    counts, then the row where each segment ends; only the segment bounds are kept.
+    """
+    n = table.num_rows
+    if 'Type' in table.column_names and table.kind('Type') == TEXT_KIND and n:
+        codes = table.array('Type')
+        dictionary = table.dictionary('Type')  # code -1 (missing) maps to its last slot
+        missing = len(dictionary) - 1
+
+        def blocks():
+            for block_start in range(0, n, SCAN_ROWS):
+                block = np.asarray(codes[block_start:block_start + SCAN_ROWS]).astype(np.int64)
+                yield block_start, np.where(block < 0, missing, block)
+
+        counts = np.zeros(len(dictionary), dtype=np.int64)
+        for _, block in blocks():
+            counts += np.bincount(block, minlength=len(dictionary))
+        present = [int(c) for c in np.flatnonzero(counts)]
+        if len(present) <= MAX_SECTIONS:
+            present.sort(key=lambda c: (c == missing, -counts[c], str(dictionary[c])))
+            bounds = {c: [] for c in present}  # per code: rows where its segments end
+            seen = dict.fromkeys(present, 0)
+            for block_start, block in blocks():
+                order = np.argsort(block, kind='stable')
+                edges = np.searchsorted(block[order], np.arange(len(dictionary) + 1))
+                for c in present:
+                    positions = order[edges[c]:edges[c + 1]]
+                    ends = np.arange(SEGMENT_ROWS - 1 - seen[c] % SEGMENT_ROWS, len(positions), SEGMENT_ROWS)
+                    bounds[c].extend(int(p) + block_start + 1 for p in positions[ends])
+                    seen[c] += len(positions)
+            segments = []
+            for c in present:
+                section = NO_TYPE if c == missing else str(dictionary[c])
+                start = 0
+                ends = bounds[c] if counts[c] % SEGMENT_ROWS == 0 else bounds[c] + [n]
+                for i, stop in enumerate(ends):
+                    segments.append(Segment(section, -1 if c == missing else c, start, stop, i * SEGMENT_ROWS, int(counts[c])))
+                    start = stop
+            return segments
+    return [
+        Segment('All equipment', None, start, min(start + SEGMENT_ROWS, n), start, n)
+        for start in range(0, n, SEGMENT_ROWS)
+    ]
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:,.2f}'
+    return f'{value:,}' if isinstance(value, int) else str(value)
+
+
+def _stats_table(stats: dict) -> Table:
+    rows = [['Column'] + STAT_COLUMNS]
+    for col, s in stats.items():
+        values = {**s, **(s.get('percentiles') or {})}
+        rows.append([col] + [_fmt(values.get(k)) for k in STAT_COLUMNS])
+    t = Table(rows, repeatRows=1)
+    t.setStyle(STATS_TABLE_STYLE)
+    return t
+
+
+def _bar_chart(title: str, labels: list[str], values: list[float], width=6.5 * inch, height=2.1 * inch) -> Drawing:
+    drawing = Drawing(width, height)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 45, 45
+    chart.width, chart.height = width - 60, height - 75
+    chart.data = [values]
+    chart.valueAxis.valueMin = min(0, *values)
+    chart.valueAxis.labels.fontSize = 7
+    chart.categoryAxis.categoryNames = [label[:16] for label in labels]
+    chart.categoryAxis.labels.fontSize = 7
+    chart.categoryAxis.labels.angle = 30
+    chart.categoryAxis.labels.boxAnchor = 'ne'
+    chart.bars[0].fillColor = CHART_COLOR
+    drawing.add(chart)
+    drawing.add(String(width / 2, height - 12, title, textAnchor='middle', fontName='Helvetica-Bold', fontSize=10))
+    return drawing
+
+
+def _charts(summary: dict) -> list:
+    type_dist = list((summary.get('type_distribution') or {}).items())[:CHART_TYPES]
+    if not type_dist:
+        return []
+    labels = [t for t, _ in type_dist]
+    charts = [_bar_chart('Equipment count by type', labels, [count for _, count in type_dist])]
+    type_stats = summary.get('type_stats') or {}
+    for col in (summary.get('averages') or {}):
+        means = [((type_stats.get(t) or {}).get(col) or {}).get('mean') for t in labels]
+        if any(m is not None for m in means):
+            charts.append(_bar_chart(f'Mean {col} by type', labels, [m or 0 for m in means]))
+    return charts
+
+
+def _doc(path) -> SimpleDocTemplate:
+    return SimpleDocTemplate(str(path), pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
+
+
+def _build(doc: SimpleDocTemplate, story: list, footer: str):
+    def draw_footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 7)
+        canvas.drawString(doc.leftMargin, 0.3 * inch, footer)
+        canvas.restoreState()
+    doc.build(story, onFirstPage=draw_footer, onLaterPages=draw_footer)
+
+
+def render_summary_part(context: dict, path):
+    """The first pages: totals, averages, type distribution, column statistics and charts."""
+    summary = context['summary']
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(name='Title', parent=styles['Heading1'], fontSize=16)
+    story = []
+    story.append(Paragraph('Chemical Equipment Parameter Report', title_style))
+    story.append(Spacer(1, 0.2*inch))
+    story.append(Paragraph(f"Dataset: {context['name']}", styles['Normal']))
+    story.append(Paragraph(f"Generated: {context['generated']}", styles['Normal']))
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph('Summary', styles['Heading2']))
+    story.append(Paragraph(f"Total equipment count: {summary.get('total_count', 0)}", styles['Normal']))
+    av = summary.get('averages', {})
+    for k, v in (av or {}).items():
+        if v is not None:
+            story.append(Paragraph(f"Average {k}: {v}", styles['Normal']))
+    type_dist = summary.get('type_distribution', {})
+    if type_dist:
+        story.append(Spacer(1, 0.2*inch))
+        story.append(Paragraph('Equipment type distribution:', styles['Normal']))
+        type_data = [['Type', 'Count']] + [[k, str(v)] for k, v in type_dist.items()]
+        t = Table(type_data)
+        t.setStyle(TYPE_TABLE_STYLE)
+        story.append(t)
+    if summary.get('column_stats'):
+        story.append(Spacer(1, 0.3*inch))
+        story.append(Paragraph('Column statistics', styles['Heading2']))
+        story.append(_stats_table(summary['column_stats']))
+    charts = _charts(summary)
+    if charts:
+        story.append(PageBreak())
+        story.append(Paragraph('Charts', styles['Heading2']))
+        for chart in charts:
+            story.append(chart)
+            story.append(Spacer(1, 0.15*inch))
+    _build(_doc(path), story, f"{context['name']} - summary")
+
+
+def render_segment_part(table, context: dict, segment: Segment, path):
+    """The rows of one segment, ROWS_PER_PAGE to a page, under the section heading if it is the first."""
+    if segment.code is None:
+        rows = np.arange(segment.start, segment.stop)
+    else:
+        codes = np.asarray(table.array('Type')[segment.start:segment.stop])
+        rows = np.flatnonzero(codes == segment.code) + segment.start
+    df = table.to_dataframe(rows=rows).fillna('').astype(str)
+    cells = df.map(lambda v: v if len(v) <= MAX_CELL_CHARS else v[:MAX_CELL_CHARS - 1] + '\u2026').values.tolist()
+    header = ['#'] + list(df.columns)
+    styles = getSampleStyleSheet()
+    story = []
+    if segment.first == 0:
+        story.append(Paragraph(f'{segment.section} ({segment.section_rows:,} rows)', styles['Heading2']))
+        if context.get('stats'):
+            story.append(_stats_table(context['stats']))
+            story.append(Spacer(1, 0.2*inch))
+    doc = _doc(path)
+    widths = [0.6*inch] + [(doc.width - 0.6*inch) / len(df.columns)] * len(df.columns)
+    for offset in range(0, len(cells), ROWS_PER_PAGE):
+        if offset:
+            story.append(PageBreak())
+        numbers = [[f'{r + 1:,}'] for r in rows[offset:offset + ROWS_PER_PAGE]]
+        page = [n + c for n, c in zip(numbers, cells[offset:offset + ROWS_PER_PAGE])]
+        t = Table([header] + page, colWidths=widths, repeatRows=1)
+        t.setStyle(DATA_TABLE_STYLE)
+        story.append(t)
+    _build(doc, story, f"{context['name']} - {segment.section}")
+
+
+def render_report(dataset, path):
+    """
+    Build the PDF report for ``dataset`` into ``path``: the summary part and every row
+    segment are rendered in the worker pool, at most a few per worker ahead of the merge,
+    and appended to ``path`` in order as they complete.
+    """
+    try:
+        table = load_table(dataset.file.path) if dataset.file else None
+    except Exception:
+        table = None
+    summary = dataset.summary_json or {}
+    base = {'name': dataset.name, 'generated': timezone.now().strftime('%Y-%m-%d %H:%M')}
+    parts = [(None, {**base, 'summary': summary}, 'Summary')]
+    if table is not None:
+        type_stats = summary.get('type_stats') or {}
+        for segment in plan_segments(table):
+            if segment.first == 0:
+                parts.append((segment, {**base, 'stats': type_stats.get(segment.section)}, segment.section))
+            else:
+                parts.append((segment, base, None))
+    file_path = dataset.file.path if table is not None else None
+    pool = get_pool()
+    in_flight = PARTS_IN_FLIGHT_PER_WORKER * (settings.EQUIPMENT_PROCESS_WORKERS or 4)
+    with timed('report.build'), tempfile.TemporaryDirectory(dir=Path(path).parent) as tmp, open(path, 'wb') as out:
+        merger = PdfConcatenator(out)
+        pending = deque()
+        try:
+            for i, (segment, context, bookmark) in enumerate(parts):
+                part_path = os.path.join(tmp, f'part_{i}.pdf')
+                pending.append((pool.submit(render_report_part, file_path, context, segment, part_path), part_path, bookmark))
+                while len(pending) >= in_flight or (pending and i == len(parts) - 1):
+                    future, part_path, bookmark = pending.popleft()
+                    future.result()
+                    merger.append(part_path, bookmark)
+                    os.unlink(part_path)
+        finally:
+            for future, _, _ in pending:
+                future.cancel()
+        merger.close(title=f'Chemical Equipment Parameter Report: {dataset.name}')
+
+
+def cache_dir() -> Path:
+    return Path(settings.MEDIA_ROOT) / 'reports'
+
+
+def cached_report_path(dataset) -> Path:
+    return cache_dir() / f'report_{dataset.pk}_v{REPORT_TEMPLATE_VERSION}_r{dataset.revision}.pdf'
+
+
+def report_etag(dataset) -> str:
+    return f'"report-{dataset.pk}-v{REPORT_TEMPLATE_VERSION}-{int(dataset.uploaded_at.timestamp())}-{dataset.revision}"'
+
+
+def cached_report(dataset) -> Path | None:
+    """
+    Path of the rendered report for ``dataset`` if it is cached, else None.
+    Hits refresh the file's access time, which drives least-recently-used eviction.
+    """
+    path = cached_report_path(dataset)
+    try:
+        st = path.stat()
+        os.utime(path, (timezone.now().timestamp(), st.st_mtime))
+    except FileNotFoundError:
+        return None
+    report_cache_requests.inc(result='hit')
+    return path
+
+
+def get_report(dataset) -> Path:
+    """Path of the rendered report for ``dataset``, rendering it on a cache miss."""
+    path = cached_report(dataset)
+    if path is not None:
+        return path
+    path = cached_report_path(dataset)
+    report_cache_requests.inc(result='miss')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.tmp-{uuid.uuid4().hex}')
+    try:
+        with timed('report.render'):
+            render_report(dataset, tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    evict_reports(keep=path)
+    return path
+
+
+def evict_reports(keep: Path | None = None):
+    """Delete least recently used reports until the cache fits EQUIPMENT_REPORT_CACHE_MAX_BYTES."""
+    max_bytes = getattr(settings, 'EQUIPMENT_REPORT_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+    entries = []
+    for p in cache_dir().glob('report_*.pdf'):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_atime, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        if p == keep:
+            continue
+        p.unlink(missing_ok=True)
+        total -= size
+
+
+def remove_reports(*dataset_ids: int):
+    """Delete every cached report of the given datasets (one directory scan for any number of them)."""
+    prefixes = tuple(f'report_{pk}_v' for pk in dataset_ids)
+    for p in cache_dir().glob('report_*.pdf'):
+        if p.name.startswith(prefixes):
+            p.unlink(missing_ok=True)
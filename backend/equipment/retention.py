@@ -0,0 +1,300 @@
+"""
+Dataset retention: which stored datasets to drop, applied in bulk in the background.
+
+Policies (each off when 0):
+    EQUIPMENT_RETENTION_PER_USER        keep each user's newest N datasets
+    EQUIPMENT_RETENTION_MAX_AGE_DAYS    drop datasets uploaded longer ago than this
+    EQUIPMENT_RETENTION_MAX_BYTES       keep the newest datasets whose stored size fits
+
+Expired datasets are selected with window queries and removed EQUIPMENT_RETENTION_BATCH
+at a time: one bulk delete, then one pass over their files. With
+EQUIPMENT_RETENTION_HOT_DAYS set, an expired dataset whose table or report was read
+within that many days is archived instead: its columnar copy and reports are dropped
+and the CSV is kept gzip-compressed, so summaries still work and the table is rebuilt on
+the next read (see ``dataset_table``). An archived dataset is deleted once it is no longer
+hot. In-progress uploads (pending/processing) are never touched. Stored files shared by
+deduplicated uploads (see blobs.py) are only removed with the last dataset using them.
+"""
+from __future__ import annotations
+import gzip
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum, Window
+from django.db.models.functions import RowNumber
+from django.db.models.expressions import RowRange
+from django.utils import timezone
+
+from .blobs import is_shared, remove_blob, settle_blob_sizes, unreferenced
+from .columnar import ColumnarTable, columnar_path, open_table
+from .httpcache import response_cache
+from .metrics import timed
+from .models import EquipmentDataset
+from .reports import remove_reports
+from .services import load_table, remove_columnar, stored_bytes
+
+DEFAULT_PER_USER = 5
+DEFAULT_BATCH = 500
+ACCESS_RESOLUTION = timedelta(hours=1)
+COPY_BYTES = 1024 * 1024
+
+_run_lock = threading.Lock()
+
+
+@dataclass
+class RetentionResult:
+    deleted: list[int] = field(default_factory=list)
+    archived: list[int] = field(default_factory=list)
+    freed_bytes: int = 0
+
+
+def _setting(name: str, default=0):
+    return getattr(settings, f'EQUIPMENT_RETENTION_{name}', default)
+
+
+def _candidates():
+    return EquipmentDataset.objects.exclude(
+        status__in=[EquipmentDataset.STATUS_PENDING, EquipmentDataset.STATUS_PROCESSING],
+    )
+
+
+def expired_by_count():
+    per_user = _setting('PER_USER', DEFAULT_PER_USER)
+    if not per_user:
+        return None
+    ranked = _candidates().annotate(rank=Window(
+        RowNumber(), partition_by=[F('uploaded_by')], order_by=[F('uploaded_at').desc(), F('pk').desc()],
+    ))
+    return ranked.filter(rank__gt=per_user)
+
+
+def expired_by_age(now):
+    days = _setting('MAX_AGE_DAYS')
+    if not days:
+        return None
+    return _candidates().filter(uploaded_at__lt=now - timedelta(days=days))
+
+
+def expired_by_bytes():
+    max_bytes = _setting('MAX_BYTES')
+    if not max_bytes:
+        return None
+    # Running total of stored bytes, newest first; everything past the budget goes.
+    ranked = _candidates().annotate(newer_bytes=Window(
+        Sum('size_bytes'), order_by=[F('uploaded_at').desc(), F('pk').desc()], frame=RowRange(start=None, end=0),
+    ))
+    return ranked.filter(newer_bytes__gt=max_bytes)
+
+
+def _next_batch(expired, now, done: set, limit: int) -> list[int]:
+    """
+    Up to ``limit`` expired ids, oldest first, skipping ones handled already and archived
+    datasets that are still hot (they are as small as they get). Filtered here rather
+    than in SQL so the skipped rows still count towards the window ranks above.
+    """
+    hot_days = _setting('HOT_DAYS')
+    hot_since = now - timedelta(days=hot_days) if hot_days else None
+    ids = []
+    rows = expired.order_by('uploaded_at', 'pk').values_list('pk', 'archived_at', 'last_accessed_at')
+    for pk, archived_at, accessed in rows.iterator():
+        if pk in done or (hot_since and archived_at and accessed and accessed >= hot_since):
+            continue
+        ids.append(pk)
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+def backfill_sizes(limit: int):
+    """Record ``size_bytes`` for datasets stored before it was tracked (not deduplicated ones, charged 0)."""
+    for pk, name in _candidates().filter(size_bytes=0, content_sha256='').exclude(file='').exclude(file=None).values_list('pk', 'file')[:limit]:
+        size = stored_bytes(os.path.join(settings.MEDIA_ROOT, name))
+        if size:
+            EquipmentDataset.objects.filter(pk=pk).update(size_bytes=size)
+
+
+def mark_accessed(dataset: EquipmentDataset):
+    """Note a read of ``dataset`` for the hot-dataset rule (at most one write per hour)."""
+    now = timezone.now()
+    if dataset.last_accessed_at is None or now - dataset.last_accessed_at > ACCESS_RESOLUTION:
+        EquipmentDataset.objects.filter(pk=dataset.pk).update(last_accessed_at=now)
+        dataset.last_accessed_at = now
+
+
+_accessed: dict[int, float] = {}  # dataset pk -> monotonic time this process last recorded a read
+_accessed_lock = threading.Lock()
+MAX_ACCESS_ENTRIES = 10_000
+
+
+def access_due(dataset_id) -> bool:
+    """
+    Whether a read of ``dataset_id`` that never loaded the row (a cached page or a 304)
+    should be recorded: once per ACCESS_RESOLUTION per process. Claims the slot if so.
+    """
+    now = time.monotonic()
+    with _accessed_lock:
+        last = _accessed.get(dataset_id)
+        if last is not None and now - last < ACCESS_RESOLUTION.total_seconds():
+            return False
+        if len(_accessed) >= MAX_ACCESS_ENTRIES:
+            _accessed.clear()
+        _accessed[dataset_id] = now
+        return True
+
+
+def record_access(dataset_id):
+    """``mark_accessed`` by pk, in one conditional ``.update()`` (a no-op if already recent)."""
+    now = timezone.now()
+    EquipmentDataset.objects.filter(pk=dataset_id).filter(
+        Q(last_accessed_at__isnull=True) | Q(last_accessed_at__lte=now - ACCESS_RESOLUTION)
+    ).update(last_accessed_at=now)
+
+
+def archive(dataset: EquipmentDataset) -> int:
+    """
+    Shrink ``dataset`` to its summary plus a gzip-compressed CSV. Returns the bytes freed.
+    A stored file other datasets still use is left as it is (there is nothing to free).
+
+    Runs under the row lock ``find_duplicate`` takes, so an upload of the same bytes either
+    finishes sharing the file before the ``is_shared`` check or starts after the swap.
+    """
+    with transaction.atomic():
+        file_name = (EquipmentDataset.objects.select_for_update().filter(pk=dataset.pk)
+                     .values_list('file', flat=True).first())
+        if not file_name:
+            raise FileNotFoundError(f'Dataset {dataset.pk} has no stored file')
+        dataset.file.name = file_name
+        freed = _archive_locked(dataset)
+    response_cache.invalidate(dataset.pk)  # the history list shows archived_at
+    return freed
+
+
+def _archive_locked(dataset: EquipmentDataset) -> int:
+    if is_shared(dataset):
+        dataset.archived_at = timezone.now()
+        EquipmentDataset.objects.filter(pk=dataset.pk).update(archived_at=dataset.archived_at)
+        return 0
+    before = dataset.size_bytes
+    path = dataset.file.path
+    remove_columnar(path)
+    remove_reports(dataset.pk)
+    if not path.lower().endswith(('.gz', '.zst', '.zip')):
+        tmp = f'{path}.gz.tmp'
+        with open(path, 'rb') as src, open(tmp, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+            shutil.copyfileobj(src, gz, COPY_BYTES)
+        os.replace(tmp, path + '.gz')
+        os.unlink(path)
+        dataset.file.name += '.gz'
+        path += '.gz'
+    dataset.size_bytes = stored_bytes(path)
+    dataset.archived_at = timezone.now()
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(
+        file=dataset.file.name, size_bytes=dataset.size_bytes, archived_at=dataset.archived_at,
+    )
+    return max(before - dataset.size_bytes, 0)
+
+
+def restore(dataset: EquipmentDataset, build=load_table):
+    """
+    Rebuild the columnar copy of an archived dataset (it stays compressed on disk) with
+    ``build(file_path)``. Callers hold the dataset's row lock; reads go through ``dataset_table``.
+    """
+    build(dataset.file.path)
+    dataset.archived_at = None
+    if dataset.size_bytes:  # not a deduplicated dataset, whose file is charged to another
+        dataset.size_bytes = stored_bytes(dataset.file.path)
+    EquipmentDataset.objects.filter(pk=dataset.pk).update(archived_at=None, size_bytes=dataset.size_bytes)
+    response_cache.invalidate(dataset.pk)
+
+
+def dataset_table(dataset: EquipmentDataset, build=load_table) -> ColumnarTable:
+    """
+    The columnar table of ``dataset`` for a read. If it has to be built first (the dataset
+    is archived, or its file was stored before the columnar copy existed), that happens
+    under the row locks of the dataset and of every dataset sharing its file, as for
+    ``archive`` and appends: concurrent first reads build it once, and none of them removes
+    a copy another has just moved into place. ``build(file_path)`` makes the copy; the
+    async views pass one that runs in the worker pool.
+    """
+    if dataset.archived_at is None:
+        table = open_table(columnar_path(dataset.file.path))
+        if table is not None:
+            return table
+    with transaction.atomic():
+        rows = {pk: rest for pk, *rest in EquipmentDataset.objects.select_for_update()
+                .filter(Q(pk=dataset.pk) | Q(file=dataset.file.name)).order_by('pk')
+                .values_list('pk', 'file', 'archived_at', 'size_bytes')}
+        if not rows.get(dataset.pk, [''])[0]:
+            raise FileNotFoundError(f'Dataset {dataset.pk} has no stored file')
+        dataset.file.name, dataset.archived_at, dataset.size_bytes = rows[dataset.pk]
+        if dataset.archived_at is not None:
+            restore(dataset, build)
+        elif open_table(columnar_path(dataset.file.path)) is None:
+            build(dataset.file.path)
+    return load_table(dataset.file.path)
+
+
+def delete_datasets(ids: list[int]) -> int:
+    """
+    Delete ``ids`` in one statement, then, in one pass, the stored files no remaining dataset
+    uses. Shared files left behind are charged to their oldest remaining dataset.
+    Returns the bytes freed.
+    """
+    with transaction.atomic():
+        rows = list(EquipmentDataset.objects.filter(pk__in=ids).values_list('pk', 'file', 'size_bytes'))
+        EquipmentDataset.objects.filter(pk__in=ids).delete()
+        names = {name for _, name, _ in rows if name}
+        orphaned = unreferenced(names)
+        settle_blob_sizes(names - orphaned)
+    for name in orphaned:
+        remove_blob(name)
+    remove_reports(*(pk for pk, _, _ in rows))
+    return sum(size for _, name, size in rows if name in orphaned)
+
+
+def _apply(ids: list[int], now, result: RetentionResult):
+    hot_days = _setting('HOT_DAYS')
+    to_delete = ids
+    if hot_days:
+        hot_since = now - timedelta(days=hot_days)
+        hot = list(EquipmentDataset.objects.filter(
+            pk__in=ids, archived_at__isnull=True, last_accessed_at__gte=hot_since,
+        ).exclude(file='').exclude(file=None))
+        for dataset in hot:
+            try:
+                result.freed_bytes += archive(dataset)
+            except OSError:
+                continue  # file already gone; delete the row below instead
+            result.archived.append(dataset.pk)
+        archived = set(result.archived)
+        to_delete = [pk for pk in ids if pk not in archived]
+    if to_delete:
+        result.freed_bytes += delete_datasets(to_delete)
+        result.deleted.extend(to_delete)
+
+
+@timed('retention.run')
+def run_retention(now=None) -> RetentionResult:
+    """
+    Apply every policy until nothing more is expired, a batch at a time. Count and age
+    go first, so the byte budget is measured over what they leave.
+    """
+    result = RetentionResult()
+    batch = _setting('BATCH', DEFAULT_BATCH)
+    with _run_lock:
+        now = now or timezone.now()
+        backfill_sizes(batch)
+        for select in (expired_by_count, lambda: expired_by_age(now), expired_by_bytes):
+            while True:
+                expired = select()
+                ids = [] if expired is None else _next_batch(expired, now, set(result.deleted + result.archived), batch)
+                if not ids:
+                    break
+                _apply(ids, now, result)
+    return result
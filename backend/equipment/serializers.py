@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import EquipmentDataset
+from .models import EquipmentDataset, IngestJob
 from django.contrib.auth.models import User
 
 
@@ -12,10 +12,19 @@ class UserSerializer(serializers.ModelSerializer):
 class EquipmentDatasetSerializer(serializers.ModelSerializer):
     class Meta:
         model = EquipmentDataset
-        fields = ['id', 'name', 'uploaded_at', 'total_count', 'summary_json']
+        fields = ['id', 'name', 'uploaded_at', 'status', 'total_count', 'revision', 'summary_json', 'archived_at']
 
 
 class EquipmentDatasetDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = EquipmentDataset
         fields = ['id', 'name', 'uploaded_at', 'total_count', 'summary_json']
+
+
+class IngestJobSerializer(serializers.ModelSerializer):
+    eta_seconds = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = IngestJob
+        fields = ['id', 'dataset', 'status', 'bytes_total', 'bytes_processed', 'rows_parsed',
+                  'eta_seconds', 'error', 'created_at', 'started_at', 'finished_at']
@@ -1,33 +1,96 @@
 """CSV parsing and analytics using Pandas."""
 from __future__ import annotations
+import gzip
+import io
+import json
+import os
+import zipfile
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from django.conf import settings
+
+from .columnar import TEXT_KIND, ColumnarTable, ColumnarWriter, columnar_path, open_table, remove_table
+from .metrics import StageTimings, bytes_read, rows_processed
+from .sketches import ColumnSketch, GroupedSketch
+
+try:
+    import zstandard
+except ImportError:  # .csv.zst uploads are optional
+    zstandard = None
 
 
 EXPECTED_COLUMNS = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
 NUMERIC_COLUMNS = ['Flowrate', 'Pressure', 'Temperature']
+TEXT_COLUMNS = ['Equipment Name', 'Type']
+DEFAULT_CHUNK_ROWS = 100_000
+SUMMARY_PERCENTILES = (50, 95, 99)
+# Accepted upload names; compressed files are stored as uploaded and decompressed while parsing.
+UPLOAD_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst', '.zip')
+SUMMARY_STATE_NAME = 'summary_state.json'
+
+
+class UnsupportedUpload(ValueError):
+    """Upload name or compression that cannot be parsed."""
+
+
+def check_upload_name(name: str):
+    """Raise UnsupportedUpload unless ``name`` is a CSV or a supported compressed CSV."""
+    lower = name.lower()
+    if not lower.endswith(UPLOAD_SUFFIXES):
+        raise UnsupportedUpload('CSV file required (.csv, .csv.gz, .csv.zst or .zip)')
+    if lower.endswith('.zst') and zstandard is None:
+        raise UnsupportedUpload('.csv.zst uploads need the zstandard package on the server')
+
+
+@contextmanager
+def open_raw(file_path):
+    """
+    Yield ``(stream, raw)`` for a stored upload: ``stream`` reads the CSV bytes, decompressing
+    .gz/.zst/.zip on the fly, and ``raw`` is the underlying file, whose ``tell()`` counts
+    stored (compressed) bytes consumed, for progress reporting.
+    """
+    lower = str(file_path).lower()
+    with open(file_path, 'rb') as raw:
+        if lower.endswith('.gz'):
+            with gzip.GzipFile(fileobj=raw) as stream:
+                yield stream, raw
+        elif lower.endswith('.zst'):
+            if zstandard is None:
+                raise UnsupportedUpload('.csv.zst uploads need the zstandard package on the server')
+            with zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True) as stream:
+                yield io.BufferedReader(stream), raw
+        elif lower.endswith('.zip'):
+            with zipfile.ZipFile(raw) as archive:
+                csvs = [m for m in archive.infolist() if not m.is_dir() and m.filename.lower().endswith('.csv')]
+                if len(csvs) != 1:
+                    raise UnsupportedUpload('ZIP upload must contain exactly one CSV file')
+                with archive.open(csvs[0]) as stream:
+                    yield stream, raw
+        else:
+            yield raw, raw
 
 
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    """Normalize column names (strip, handle common variants)."""
-    df = df.copy()
-    df.columns = df.columns.str.strip()
-    renames = {}
-    for c in df.columns:
-        lower = c.lower()
-        if 'equipment' in lower and 'name' in lower:
-            renames[c] = 'Equipment Name'
-        elif c.lower() == 'type':
-            renames[c] = 'Type'
-        elif 'flow' in lower or c == 'Flowrate':
-            renames[c] = 'Flowrate'
-        elif 'pressure' in lower:
-            renames[c] = 'Pressure'
-        elif 'temp' in lower or 'temperature' in lower:
-            renames[c] = 'Temperature'
-    if renames:
-        df = df.rename(columns=renames)
-    return df
+    """Normalize column names (strip, handle common variants). Column data is not copied."""
+    return df.set_axis([normalize_column_name(str(c)) for c in df.columns], axis=1)
+
+
+def normalize_column_name(c: str) -> str:
+    c = c.strip()
+    lower = c.lower()
+    if 'equipment' in lower and 'name' in lower:
+        return 'Equipment Name'
+    elif lower == 'type':
+        return 'Type'
+    elif 'flow' in lower or c == 'Flowrate':
+        return 'Flowrate'
+    elif 'pressure' in lower:
+        return 'Pressure'
+    elif 'temp' in lower or 'temperature' in lower:
+        return 'Temperature'
+    return c
 
 
 def parse_csv(file_path) -> tuple[pd.DataFrame, dict]:
@@ -59,6 +122,345 @@ def parse_csv(file_path) -> tuple[pd.DataFrame, dict]:
     return df, summary
 
 
-def dataframe_to_records(df: pd.DataFrame) -> list[dict]:
-    """Convert DataFrame to list of dicts for API (NaN -> null)."""
-    return df.fillna('').to_dict('records')
+class SummaryAccumulator:
+    """
+    Builds the dataset summary from a stream of normalized chunks: the original
+    total/averages/type_distribution plus per-column and per-type count, nulls,
+    mean, std, min/max and percentiles.
+
+    ``update`` is the part in the parse loop and only counts moments: a few bincounts
+    per numeric column over the chunk's Type codes (see GroupedSketch.from_moments).
+    The percentiles come from ``add_percentiles``, one pass over the columnar copy once
+    the rows are stored. The merged sketches also feed analytics.
+    """
+
+    def __init__(self):
+        self.total_count = 0
+        self.types: dict[str, int] = {}
+        self.type_counts = np.zeros(1, dtype=np.int64)  # index 0 = rows without a Type
+        self.sketches: dict[str, GroupedSketch] = {}
+        self._code_groups = np.zeros(1, dtype=np.int64)  # columnar Type code + 1 -> group
+
+    def _type_groups(self, df: pd.DataFrame) -> np.ndarray:
+        if 'Type' not in df.columns:
+            return np.zeros(len(df), dtype=np.int64)
+        local_codes, uniques = pd.factorize(df['Type'])
+        lookup = np.empty(len(uniques) + 1, dtype=np.int64)
+        lookup[-1] = 0  # code -1 (missing) lands in group 0
+        for j, value in enumerate(uniques):
+            lookup[j] = self.types.setdefault(str(value), len(self.types) + 1)
+        return lookup[local_codes]
+
+    def _groups_for_codes(self, codes: np.ndarray, names) -> np.ndarray:
+        """Groups for columnar dictionary ``codes`` of Type, ``names`` being that dictionary."""
+        known = len(self._code_groups) - 1
+        if len(names) > known:
+            added = [self.types.setdefault(str(names[j]), len(self.types) + 1) for j in range(known, len(names))]
+            self._code_groups = np.r_[self._code_groups, np.asarray(added, dtype=np.int64)]
+        return self._code_groups[np.asarray(codes, dtype=np.intp) + 1]
+
+    def update(self, df: pd.DataFrame, type_codes: np.ndarray | None = None, type_names=None):
+        """
+        Count the moments of chunk ``df``. ``type_codes``/``type_names`` are its Type column
+        as columnar dictionary codes and that dictionary (``ColumnarWriter.write``), which
+        spares hashing the Type strings a second time.
+        """
+        self.total_count += len(df)
+        groups = self._type_groups(df) if type_codes is None else self._groups_for_codes(type_codes, type_names)
+        n_groups = len(self.types) + 1
+        counts = np.bincount(groups, minlength=n_groups)
+        self.type_counts = np.r_[self.type_counts, np.zeros(n_groups - len(self.type_counts), dtype=np.int64)] + counts
+        for col in NUMERIC_COLUMNS:
+            if col in df.columns:
+                values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+                sketch = GroupedSketch.from_moments(values, groups, n_groups, group_rows=counts)
+                self.sketches[col] = self.sketches[col].merge(sketch) if col in self.sketches else sketch
+
+    def add_percentiles(self, table: ColumnarTable, start: int = 0, chunk_rows: int | None = None):
+        """Add rows ``start:`` of ``table`` (already counted by ``update``) to the percentile digests."""
+        step = chunk_rows or ingest_chunk_rows()
+        has_type = 'Type' in table.column_names and table.kind('Type') == TEXT_KIND
+        names = table.dictionary('Type')[:-1] if has_type else []
+        for lo in range(start, table.num_rows, step):
+            rows = slice(lo, min(lo + step, table.num_rows))
+            if has_type:
+                groups = self._groups_for_codes(table.array('Type')[rows], names)
+            else:
+                groups = self._type_groups(table.to_dataframe(rows=rows))
+            for col, sketch in self.sketches.items():
+                sketch.add_digest(table.array(col)[rows], groups)
+
+    def result(self) -> dict:
+        totals = {col: sketch.total() for col, sketch in self.sketches.items()}
+        averages = {
+            col: round(totals[col].mean, 2) if totals[col].count else None
+            for col in NUMERIC_COLUMNS if col in totals
+        }
+        ranked = sorted(self.types.items(), key=lambda kv: -self.type_counts[kv[1]])
+        return {
+            'total_count': self.total_count,
+            'averages': averages,
+            'type_distribution': {t: int(self.type_counts[i]) for t, i in ranked},
+            'column_stats': {col: totals[col].statistics(SUMMARY_PERCENTILES) for col in totals},
+            'type_stats': {
+                t: {col: sketch.sketch(i).statistics(SUMMARY_PERCENTILES) for col, sketch in self.sketches.items()}
+                for t, i in ranked
+            },
+        }
+
+    def sketch_dicts(self) -> dict:
+        return {col: sketch.total().to_dict() for col, sketch in self.sketches.items()}
+
+    def to_state(self) -> dict:
+        """Counts, type codes and per-type sketches: enough to carry on with more rows later."""
+        return {
+            'total_count': self.total_count,
+            'types': self.types,
+            'type_counts': self.type_counts.tolist(),
+            'sketches': {col: sketch.to_dict() for col, sketch in self.sketches.items()},
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'SummaryAccumulator':
+        accumulator = cls()
+        accumulator.total_count = state['total_count']
+        accumulator.types = dict(state['types'])
+        accumulator.type_counts = np.asarray(state['type_counts'], dtype=np.int64)
+        accumulator.sketches = {col: GroupedSketch.from_dict(d) for col, d in state['sketches'].items()}
+        return accumulator
+
+
+def summary_state_path(file_path) -> Path:
+    """Running summary state of a stored upload, kept with (and removed with) its columnar copy."""
+    return columnar_path(file_path) / SUMMARY_STATE_NAME
+
+
+def save_summary_state(file_path, accumulator: SummaryAccumulator):
+    path = summary_state_path(file_path)
+    tmp = path.with_name(f'{path.name}.tmp')
+    tmp.write_text(json.dumps(accumulator.to_state()))
+    os.replace(tmp, path)
+
+
+def load_summary_state(file_path, table: ColumnarTable) -> SummaryAccumulator:
+    """
+    The running summary of ``table``. Tables stored before the state was kept (or whose
+    state is behind after an interrupted append) are summarized again from the columnar
+    copy, once.
+    """
+    try:
+        accumulator = SummaryAccumulator.from_state(json.loads(summary_state_path(file_path).read_text()))
+        if accumulator.total_count == table.num_rows:
+            return accumulator
+    except (OSError, ValueError, KeyError):
+        pass
+    accumulator = SummaryAccumulator()
+    step = ingest_chunk_rows()
+    numeric = [c for c in NUMERIC_COLUMNS if c in table.column_names]
+    has_type = 'Type' in table.column_names and table.kind('Type') == TEXT_KIND
+    for start in range(0, table.num_rows, step):
+        rows = slice(start, min(start + step, table.num_rows))
+        if has_type:
+            chunk = pd.DataFrame({col: table.array(col)[rows] for col in numeric}, copy=False)
+            accumulator.update(chunk, table.array('Type')[rows], table.dictionary('Type')[:-1])
+        else:
+            accumulator.update(table.to_dataframe(rows=rows))
+    accumulator.add_percentiles(table)
+    save_summary_state(file_path, accumulator)
+    return accumulator
+
+
+def _coerce_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    chunk = normalize_columns(chunk)
+    for col in NUMERIC_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+    return chunk
+
+
+def _update_summary(accumulator: SummaryAccumulator, chunk: pd.DataFrame, codes: dict, writer: ColumnarWriter):
+    """``accumulator.update`` with the Type codes the columnar writer just produced for ``chunk``."""
+    if 'Type' in codes:
+        accumulator.update(chunk, codes['Type'], writer.dictionary('Type'))
+    else:
+        accumulator.update(chunk)
+
+
+def ingest_chunk_rows() -> int:
+    return getattr(settings, 'EQUIPMENT_INGEST_CHUNK_ROWS', DEFAULT_CHUNK_ROWS)
+
+
+def ingest_csv(file_path, chunk_rows: int | None = None, progress=None) -> tuple[dict, dict]:
+    """
+    Stream the stored CSV at ``file_path`` in chunks of ``chunk_rows`` rows, writing its
+    columnar copy and accumulating the summary in the same pass. Peak memory is bounded
+    by the chunk size, not the file size. Compressed uploads are decompressed as they are
+    read (see ``open_raw``). Returns ``(summary, sketches)``.
+    ``progress(bytes_processed, rows_parsed)`` is called after every chunk if given.
+    """
+    chunk_rows = chunk_rows or ingest_chunk_rows()
+    with open_raw(file_path) as (stream, _):
+        header = pd.read_csv(stream, nrows=0).columns
+    # Text columns are pinned to str so a chunk of numeric-looking names keeps the schema.
+    dtype = {c: str for c in header if normalize_column_name(str(c)) in TEXT_COLUMNS}
+    accumulator = SummaryAccumulator()
+    timings = StageTimings()
+    root = columnar_path(file_path)
+    remove_table(root)
+    writer = ColumnarWriter(root)
+    try:
+        with open_raw(file_path) as (stream, raw), pd.read_csv(stream, chunksize=chunk_rows, dtype=dtype) as reader:
+            chunks = iter(reader)
+            while True:
+                with timings('ingest.parse'):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    chunk = _coerce_chunk(chunk)
+                with timings('ingest.columnar_write'):
+                    codes = writer.write(chunk)
+                with timings('ingest.summary'):
+                    _update_summary(accumulator, chunk, codes, writer)
+                if progress:
+                    progress(raw.tell(), accumulator.total_count)
+            size = raw.tell()
+        if writer.columns is None:
+            writer.write(_coerce_chunk(pd.DataFrame(columns=header)))
+    except Exception:
+        writer.abort()
+        raise
+    with timings('ingest.columnar_write'):
+        writer.close()
+    with timings('ingest.percentiles'):
+        accumulator.add_percentiles(open_table(root))
+    with timings('ingest.summary'):
+        save_summary_state(file_path, accumulator)
+        summary, sketches = accumulator.result(), accumulator.sketch_dicts()
+    timings.record()
+    rows_processed.inc(accumulator.total_count, stage='ingest')
+    bytes_read.inc(size, stage='ingest')
+    return summary, sketches
+
+
+def load_table(file_path) -> ColumnarTable:
+    """
+    Open the columnar copy of a stored CSV, memory-mapped.
+    Raw files stored before the columnar copy existed (or with an outdated layout)
+    are parsed once and converted on first read.
+    """
+    table = open_table(columnar_path(file_path))
+    if table is None:
+        ingest_csv(file_path)
+        table = open_table(columnar_path(file_path))
+    return table
+
+
+@contextmanager
+def _open_append(file_path):
+    """
+    Binary writer adding CSV bytes to the end of a stored upload: plain CSVs are appended
+    to, .gz files get another gzip member and .zst files another frame (both read back as
+    one stream by ``open_raw``). Nothing already stored is rewritten.
+    """
+    lower = str(file_path).lower()
+    if lower.endswith('.zip'):
+        raise UnsupportedUpload('Rows cannot be appended to a ZIP upload')
+    with open(file_path, 'ab') as raw:
+        if lower.endswith('.gz'):
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as out:
+                out.write(b'\n')  # the last row may lack a newline; a blank line is skipped when parsing
+                yield out
+        elif lower.endswith('.zst'):
+            if zstandard is None:
+                raise UnsupportedUpload('.csv.zst uploads need the zstandard package on the server')
+            with zstandard.ZstdCompressor().stream_writer(raw, closefd=False) as out:
+                out.write(b'\n')
+                yield out
+        else:
+            if raw.tell():
+                with open(file_path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        raw.write(b'\n')
+            yield raw
+
+
+def append_csv(file_path, delta_path, chunk_rows: int | None = None) -> tuple[dict, dict, int]:
+    """
+    Append the rows of the CSV at ``delta_path`` (compressed like an upload, or not) to the
+    stored upload at ``file_path``: to the stored file, to its columnar copy (extended in
+    place) and to its running summary state, so the cost follows the new rows, not the
+    dataset. Columns are matched by normalized name and must be the dataset's. If anything
+    fails the stored file is cut back and the columnar copy keeps its old row count.
+    Returns ``(summary, sketches, rows_appended)`` for the whole dataset.
+    """
+    chunk_rows = chunk_rows or ingest_chunk_rows()
+    table = load_table(file_path)
+    with open_raw(delta_path) as (stream, _):
+        header = [normalize_column_name(str(c)) for c in pd.read_csv(stream, nrows=0).columns]
+    if sorted(header) != sorted(table.column_names):
+        raise ValueError(f'Columns {header} do not match the dataset columns {table.column_names}')
+    accumulator = load_summary_state(file_path, table)
+    before = accumulator.total_count
+    timings = StageTimings()
+    writer = ColumnarWriter(columnar_path(file_path), append=True)
+    stored_size = os.path.getsize(file_path)
+    try:
+        # Everything is read as text so the stored copy keeps the values as sent; numbers
+        # are coerced afterwards exactly as at ingest.
+        with open_raw(delta_path) as (stream, raw), pd.read_csv(stream, chunksize=chunk_rows, dtype=str) as reader, \
+                _open_append(file_path) as out:
+            chunks = iter(reader)
+            while True:
+                with timings('append.parse'):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    chunk = normalize_columns(chunk)[table.column_names]
+                with timings('append.raw_write'):
+                    out.write(chunk.to_csv(header=False, index=False).encode())
+                chunk = _coerce_chunk(chunk)
+                with timings('append.columnar_write'):
+                    codes = writer.write(chunk)
+                with timings('append.summary'):
+                    _update_summary(accumulator, chunk, codes, writer)
+            size = raw.tell()
+    except Exception:
+        os.truncate(file_path, stored_size)
+        raise
+    with timings('append.columnar_write'):
+        writer.close()
+    with timings('append.percentiles'):
+        accumulator.add_percentiles(open_table(columnar_path(file_path)), start=before)
+    with timings('append.summary'):
+        save_summary_state(file_path, accumulator)
+        summary, sketches = accumulator.result(), accumulator.sketch_dicts()
+    timings.record()
+    appended = accumulator.total_count - before
+    rows_processed.inc(appended, stage='append')
+    bytes_read.inc(size, stage='append')
+    return summary, sketches, appended
+
+
+def table_sketches(table: ColumnarTable) -> dict:
+    """Sketches for a dataset stored before ingest recorded them (one pass over the columnar copy)."""
+    return {
+        col: ColumnSketch.from_values(table.array(col)).to_dict()
+        for col in NUMERIC_COLUMNS if col in table.column_names
+    }
+
+
+def remove_columnar(file_path):
+    remove_table(columnar_path(file_path))
+
+
+def stored_bytes(file_path) -> int:
+    """Disk space used by a stored upload and its columnar copy."""
+    total = 0
+    for p in [Path(file_path), *columnar_path(file_path).glob('*')]:
+        try:
+            total += p.stat().st_size
+        except OSError:
+            pass
+    return total
+
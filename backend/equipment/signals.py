@@ -0,0 +1,31 @@
+"""Keep the token and response caches consistent with model changes."""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import token_cache
+from .httpcache import response_cache
+from .models import AuthToken, EquipmentDataset
+
+
+@receiver([post_save, post_delete], sender=AuthToken)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Covers deactivation and permission changes; deleting a user also cascades to its token.
+    # Logins only save last_login, which cached users need not reflect.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    for key in AuthToken.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        token_cache.invalidate(key)
+
+
+@receiver([post_save, post_delete], sender=EquipmentDataset)
+def invalidate_dataset_responses(sender, instance, **kwargs):
+    # After commit, so a concurrent read cannot cache the old row under the new generation.
+    pk = instance.pk
+    transaction.on_commit(lambda: response_cache.invalidate(pk))
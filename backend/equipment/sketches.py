@@ -0,0 +1,367 @@
+"""
+Mergeable per-column statistics.
+
+A ColumnSketch keeps exact count/mean/M2/min/max (merged with Chan's parallel
+formula) plus a t-digest for quantiles. Sketches are built once per chunk at ingest
+and merged, so combining datasets costs O(number of datasets), never a rescan.
+GroupedSketch builds the moments and the digests separately: moments need no sort and
+are cheap enough for the parse loop, digests are added afterwards (``add_digest``).
+"""
+from __future__ import annotations
+import math
+
+import numpy as np
+
+DEFAULT_COMPRESSION = 200
+
+
+def _k_scale(q: np.ndarray, compression: float) -> np.ndarray:
+    # t-digest k1 scale: centroids are small near the tails and large around the median.
+    return compression / (2 * math.pi) * np.arcsin(2 * np.clip(q, 0.0, 1.0) - 1)
+
+
+class TDigest:
+    """Vectorized merging t-digest over (mean, weight) centroids."""
+
+    def __init__(self, means=None, weights=None, compression: float = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.asarray(means if means is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float64)
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, compression: float = DEFAULT_COMPRESSION) -> 'TDigest':
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        return cls._compress(values, np.ones(len(values)), compression)
+
+    @classmethod
+    def _compress(cls, means: np.ndarray, weights: np.ndarray, compression: float) -> 'TDigest':
+        if len(means) == 0:
+            return cls(compression=compression)
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / total
+        # Every point falls in the bucket of its k-scale position; each bucket spans
+        # at most one unit of k, which is the t-digest size bound.
+        buckets = np.floor(_k_scale(q, compression) - _k_scale(np.zeros(1), compression)[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        w = np.add.reduceat(weights, starts)
+        m = np.add.reduceat(means * weights, starts) / w
+        return cls(m, w, compression)
+
+    def merge(self, other: 'TDigest') -> 'TDigest':
+        return self._compress(
+            np.concatenate([self.means, other.means]),
+            np.concatenate([self.weights, other.weights]),
+            max(self.compression, other.compression),
+        )
+
+    def quantile(self, q: float, minimum: float, maximum: float) -> float | None:
+        if not len(self.means):
+            return None
+        total = self.weights.sum()
+        centers = (np.cumsum(self.weights) - self.weights / 2) / total
+        xs = np.r_[0.0, centers, 1.0]
+        ys = np.r_[minimum, self.means, maximum]
+        return float(np.interp(q, xs, ys))
+
+    def to_dict(self) -> dict:
+        return {'compression': self.compression, 'means': self.means.tolist(), 'weights': self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'TDigest':
+        return cls(d.get('means'), d.get('weights'), d.get('compression', DEFAULT_COMPRESSION))
+
+
+class ColumnSketch:
+    """Exact moments and extrema plus a t-digest for one numeric column."""
+
+    def __init__(self, count=0, nulls=0, mean=0.0, m2=0.0, minimum=None, maximum=None, digest=None):
+        self.count = count
+        self.nulls = nulls
+        self.mean = mean
+        self.m2 = m2
+        self.min = minimum
+        self.max = maximum
+        self.digest = digest if digest is not None else TDigest()
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> 'ColumnSketch':
+        values = np.asarray(values, dtype=np.float64)
+        present = values[~np.isnan(values)]
+        nulls = len(values) - len(present)
+        if not len(present):
+            return cls(nulls=nulls)
+        mean = float(present.mean())
+        return cls(
+            count=len(present),
+            nulls=nulls,
+            mean=mean,
+            m2=float(((present - mean) ** 2).sum()),
+            minimum=float(present.min()),
+            maximum=float(present.max()),
+            digest=TDigest.from_values(present),
+        )
+
+    def merge(self, other: 'ColumnSketch') -> 'ColumnSketch':
+        if not other.count:
+            return ColumnSketch(self.count, self.nulls + other.nulls, self.mean, self.m2, self.min, self.max, self.digest)
+        if not self.count:
+            return ColumnSketch(other.count, self.nulls + other.nulls, other.mean, other.m2, other.min, other.max, other.digest)
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        return ColumnSketch(
+            count=n,
+            nulls=self.nulls + other.nulls,
+            mean=self.mean + delta * other.count / n,
+            m2=self.m2 + other.m2 + delta * delta * self.count * other.count / n,
+            minimum=min(self.min, other.min),
+            maximum=max(self.max, other.max),
+            digest=self.digest.merge(other.digest),
+        )
+
+    @property
+    def variance(self) -> float | None:
+        """Population variance (n denominator), as /api/analytics/ has always reported it."""
+        return self.m2 / self.count if self.count else None
+
+    def quantile(self, q: float) -> float | None:
+        return self.digest.quantile(q, self.min, self.max) if self.count else None
+
+    def statistics(self, percentiles=(50, 95, 99)) -> dict:
+        variance = self.variance
+        return {
+            'count': self.count,
+            'nulls': self.nulls,
+            'mean': self.mean if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'variance': variance,
+            'std': math.sqrt(variance) if variance is not None else None,
+            'percentiles': {f'p{p:g}': self.quantile(p / 100) for p in percentiles},
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count, 'nulls': self.nulls, 'mean': self.mean, 'm2': self.m2,
+            'min': self.min, 'max': self.max, 'digest': self.digest.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'ColumnSketch':
+        return cls(
+            d.get('count', 0), d.get('nulls', 0), d.get('mean', 0.0), d.get('m2', 0.0),
+            d.get('min'), d.get('max'), TDigest.from_dict(d.get('digest') or {}),
+        )
+
+
+def _compress_grouped(groups, means, weights, n_groups, compression, presorted=False):
+    """Compress centroids of many digests at once; ``groups`` says which digest each belongs to."""
+    if not presorted:
+        order = np.lexsort((means, groups))
+        groups, means, weights = groups[order], means[order], weights[order]
+    totals = np.bincount(groups, weights=weights, minlength=n_groups)
+    before = np.r_[0.0, np.cumsum(totals)][:-1]
+    q = (np.cumsum(weights) - before[groups] - weights / 2) / totals[groups]
+    buckets = np.floor(_k_scale(q, compression) - _k_scale(np.zeros(1), compression)[0]).astype(np.int64)
+    change = np.r_[True, (buckets[1:] != buckets[:-1]) | (groups[1:] != groups[:-1])] if len(groups) else np.zeros(0, bool)
+    starts = np.flatnonzero(change)
+    if not len(starts):
+        return groups, means, weights
+    w = np.add.reduceat(weights, starts)
+    m = np.add.reduceat(means * weights, starts) / w
+    return groups[starts], m, w
+
+
+class GroupedSketch:
+    """
+    ColumnSketches for ``n_groups`` groups of one column, held as flat arrays so that
+    building from a chunk and merging chunks are vectorized across all groups.
+    """
+
+    def __init__(self, n_groups: int, compression: float = DEFAULT_COMPRESSION):
+        self.n_groups = n_groups
+        self.compression = compression
+        self.count = np.zeros(n_groups, dtype=np.int64)
+        self.nulls = np.zeros(n_groups, dtype=np.int64)
+        self.mean = np.zeros(n_groups)
+        self.m2 = np.zeros(n_groups)
+        self.min = np.full(n_groups, np.inf)
+        self.max = np.full(n_groups, -np.inf)
+        self.c_groups = np.zeros(0, dtype=np.int64)
+        self.c_means = np.zeros(0)
+        self.c_weights = np.zeros(0)
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, groups: np.ndarray, n_groups: int,
+                    compression: float = DEFAULT_COMPRESSION) -> 'GroupedSketch':
+        """Every group's moments, extrema and digest: ``from_moments`` plus ``add_digest``."""
+        out = cls.from_moments(values, groups, n_groups, compression=compression)
+        out.add_digest(values, groups)
+        return out
+
+    @classmethod
+    def from_moments(cls, values: np.ndarray, groups: np.ndarray, n_groups: int, group_rows: np.ndarray | None = None,
+                     compression: float = DEFAULT_COMPRESSION) -> 'GroupedSketch':
+        """
+        Count, nulls, mean and M2 of every group: a few ``bincount`` calls, no sort.
+        Extrema and digests need the values in order and come from ``add_digest``.
+        ``group_rows`` (rows per group, NaN or not) can be passed when several columns
+        share ``groups``.
+        """
+        out = cls(n_groups, compression)
+        values = np.asarray(values, dtype=np.float64)
+        groups = np.asarray(groups, dtype=np.intp)
+        if not len(values):
+            return out
+        rows = group_rows if group_rows is not None else np.bincount(groups, minlength=n_groups)
+        # Sums are taken about a shift near the data (the mean of the first values), which
+        # keeps the one-pass M2 below stable without a second pass over the chunk.
+        head = values[:1024]
+        shift = float(np.nanmean(head)) if not np.isnan(head).all() else 0.0
+        shifted = values - shift
+        missing = np.isnan(shifted)
+        if missing.any():
+            out.nulls = np.bincount(groups[missing], minlength=n_groups)
+            shifted[missing] = 0.0
+        out.count = rows - out.nulls
+        present = out.count > 0
+        sums = np.bincount(groups, weights=shifted, minlength=n_groups)
+        squares = np.bincount(groups, weights=shifted * shifted, minlength=n_groups)
+        offsets = np.zeros(n_groups)
+        offsets[present] = sums[present] / out.count[present]
+        out.mean[present] = shift + offsets[present]
+        out.m2 = np.maximum(squares - out.count * offsets ** 2, 0.0)
+        return out
+
+    def add_digest(self, values: np.ndarray, groups: np.ndarray):
+        """
+        Add ``values`` to the groups' extrema and digests (their moments are counted by
+        ``from_moments``): one sort by (group, value), then the centroids are compressed
+        with the existing ones.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        groups = np.asarray(groups, dtype=np.int64)
+        present = ~np.isnan(values)
+        values, groups = values[present], groups[present]
+        if not len(values):
+            return self
+        self._grow(int(groups.max()) + 1)
+        order = np.argsort(values)
+        order = order[np.argsort(groups[order], kind='stable')]
+        values, groups = values[order], groups[order]
+        counts = np.bincount(groups, minlength=self.n_groups)
+        present = counts > 0
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        self.min[present] = np.minimum(self.min[present], values[starts[present]])
+        self.max[present] = np.maximum(self.max[present], values[starts[present] + counts[present] - 1])
+        c_groups, c_means, c_weights = _compress_grouped(
+            groups, values, np.ones(len(values)), self.n_groups, self.compression, presorted=True)
+        if len(self.c_means):
+            c_groups, c_means, c_weights = _compress_grouped(
+                np.r_[self.c_groups, c_groups], np.r_[self.c_means, c_means],
+                np.r_[self.c_weights, c_weights], self.n_groups, self.compression)
+        self.c_groups, self.c_means, self.c_weights = c_groups, c_means, c_weights
+        return self
+
+    def _grow(self, n_groups: int):
+        extra = n_groups - self.n_groups
+        if extra <= 0:
+            return
+        self.count = np.r_[self.count, np.zeros(extra, dtype=np.int64)]
+        self.nulls = np.r_[self.nulls, np.zeros(extra, dtype=np.int64)]
+        self.mean = np.r_[self.mean, np.zeros(extra)]
+        self.m2 = np.r_[self.m2, np.zeros(extra)]
+        self.min = np.r_[self.min, np.full(extra, np.inf)]
+        self.max = np.r_[self.max, np.full(extra, -np.inf)]
+        self.n_groups = n_groups
+
+    def merge(self, other: 'GroupedSketch') -> 'GroupedSketch':
+        """Merge ``other`` into this sketch in place (groups are matched by index)."""
+        self._grow(other.n_groups)
+        other._grow(self.n_groups)
+        n = self.count + other.count
+        safe = np.maximum(n, 1)
+        delta = other.mean - self.mean
+        self.mean = np.where(n > 0, self.mean + delta * other.count / safe, 0.0)
+        self.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / safe
+        self.count = n
+        self.nulls = self.nulls + other.nulls
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        if len(other.c_means):  # moments-only sketches (see from_moments) have no centroids
+            self.c_groups, self.c_means, self.c_weights = _compress_grouped(
+                np.r_[self.c_groups, other.c_groups], np.r_[self.c_means, other.c_means],
+                np.r_[self.c_weights, other.c_weights], self.n_groups, self.compression)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            'compression': self.compression,
+            'count': self.count.tolist(), 'nulls': self.nulls.tolist(),
+            'mean': self.mean.tolist(), 'm2': self.m2.tolist(),
+            'min': self.min.tolist(), 'max': self.max.tolist(),
+            'c_groups': self.c_groups.tolist(), 'c_means': self.c_means.tolist(), 'c_weights': self.c_weights.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'GroupedSketch':
+        out = cls(len(d['count']), d.get('compression', DEFAULT_COMPRESSION))
+        out.count = np.asarray(d['count'], dtype=np.int64)
+        out.nulls = np.asarray(d['nulls'], dtype=np.int64)
+        out.mean = np.asarray(d['mean'], dtype=np.float64)
+        out.m2 = np.asarray(d['m2'], dtype=np.float64)
+        out.min = np.asarray(d['min'], dtype=np.float64)
+        out.max = np.asarray(d['max'], dtype=np.float64)
+        out.c_groups = np.asarray(d['c_groups'], dtype=np.int64)
+        out.c_means = np.asarray(d['c_means'], dtype=np.float64)
+        out.c_weights = np.asarray(d['c_weights'], dtype=np.float64)
+        return out
+
+    def sketch(self, group: int) -> ColumnSketch:
+        if group >= self.n_groups:
+            return ColumnSketch()
+        mask = self.c_groups == group
+        count = int(self.count[group])
+        return ColumnSketch(
+            count=count,
+            nulls=int(self.nulls[group]),
+            mean=float(self.mean[group]),
+            m2=float(self.m2[group]),
+            minimum=float(self.min[group]) if count else None,
+            maximum=float(self.max[group]) if count else None,
+            digest=TDigest(self.c_means[mask], self.c_weights[mask], self.compression),
+        )
+
+    def total(self) -> ColumnSketch:
+        """All groups pooled into one ColumnSketch."""
+        pooled = GroupedSketch(1, self.compression)
+        count = int(self.count.sum())
+        pooled.nulls[0] = self.nulls.sum()
+        if count:
+            present = self.count > 0
+            mean = float((self.mean * self.count).sum() / count)
+            pooled.count[0] = count
+            pooled.mean[0] = mean
+            pooled.m2[0] = float((self.m2 + self.count * (self.mean - mean) ** 2).sum())
+            pooled.min[0] = self.min[present].min()
+            pooled.max[0] = self.max[present].max()
+        pooled.c_groups, pooled.c_means, pooled.c_weights = _compress_grouped(
+            np.zeros(len(self.c_means), dtype=np.int64), self.c_means, self.c_weights, 1, self.compression)
+        return pooled.sketch(0)
+
+
+def merge_sketches(sketch_dicts) -> dict[str, ColumnSketch]:
+    """Merge an iterable of ``{column: sketch dict}`` mappings column by column."""
+    merged: dict[str, ColumnSketch] = {}
+    for sketches in sketch_dicts:
+        for col, d in (sketches or {}).items():
+            s = ColumnSketch.from_dict(d)
+            merged[col] = merged[col].merge(s) if col in merged else s
+    return merged
@@ -0,0 +1,678 @@
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from .auth import resolve_token, token_cache
+from .blobs import settle_blob_sizes, unreferenced, unshare
+from .httpcache import ResponseCache, response_cache
+from .jobs import prerender_report, recover_stale_jobs, run_ingest_job
+from .models import AuthToken, EquipmentDataset, IngestJob, UploadSession
+from . import retention
+from .services import ingest_csv, load_table, remove_columnar
+from .sketches import ColumnSketch, GroupedSketch, TDigest
+from .uploads import UploadError, create_session, expire_sessions, finish_session, received_chunks, write_chunk
+
+
+class MediaRootMixin:
+    """Runs each test against an empty temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        response_cache.clear()
+        retention._accessed.clear()
+        self.user = User.objects.create_user('owner', password='password123')
+
+
+SAMPLE_CSV = b'Equipment Name,Type,Flowrate,Pressure,Temperature\n' + b'Pump-1,Pump,120,5.2,110\n' * 40
+
+
+class UploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+
+    def zip_of(self, **members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+    def test_zip_with_one_csv_among_other_files(self):
+        data = self.zip_of(**{'readme.txt': b'notes', 'equipment.csv': SAMPLE_CSV})
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.zip', data)}, **self.auth)
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(r.json()['total_count'], 40)
+
+    def test_zip_without_csv_is_rejected(self):
+        data = self.zip_of(**{'equipment.txt': SAMPLE_CSV})
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.zip', data)}, **self.auth)
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('exactly one CSV', r.json()['error'])
+        self.assertFalse(EquipmentDataset.objects.exists())
+
+    def test_empty_gzip_body_is_rejected(self):
+        r = self.client.post('/api/upload/?filename=e.csv', b'', content_type='text/csv',
+                             HTTP_CONTENT_ENCODING='gzip', **self.auth)
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.json(), {'error': 'Request body required'})
+
+
+class DeduplicationTests(MediaRootMixin, TestCase):
+    """Uploads of identical bytes share one stored file, counted and removed once."""
+
+    def setUp(self):
+        super().setUp()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+
+    def upload(self, **data):
+        data['file'] = SimpleUploadedFile('e.csv', SAMPLE_CSV)
+        return self.client.post('/api/upload/', data, **self.auth)
+
+    def test_duplicate_shares_file_and_is_charged_once(self):
+        first = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        r = self.upload()
+        self.assertEqual(r.status_code, 201)
+        self.assertTrue(r.json()['deduplicated'])
+        second = EquipmentDataset.objects.get(pk=r.json()['id'])
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertGreater(first.size_bytes, 0)
+        self.assertEqual(second.size_bytes, 0)
+
+    def test_async_duplicate_returns_finished_job(self):
+        self.upload()
+        r = self.upload(**{'async': '1'})
+        self.assertEqual(r.status_code, 202)
+        self.assertTrue(r.json()['deduplicated'])
+        job = IngestJob.objects.get(pk=r.json()['job_id'])
+        self.assertEqual(job.dataset_id, r.json()['id'])
+        self.assertEqual(job.status, EquipmentDataset.STATUS_READY)
+        self.assertEqual(job.rows_parsed, 40)
+        self.assertEqual(self.client.get(f'/api/jobs/{job.pk}/', **self.auth).json()['status'], 'ready')
+
+    def test_unreferenced(self):
+        name = EquipmentDataset.objects.get(pk=self.upload().json()['id']).file.name
+        self.upload()
+        self.assertEqual(unreferenced([name, 'uploads/gone.csv', '']), {'uploads/gone.csv'})
+        EquipmentDataset.objects.all().delete()
+        self.assertEqual(unreferenced([name]), {name})
+
+    def test_settle_blob_sizes_charges_oldest_remaining(self):
+        first = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        second = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        third = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        EquipmentDataset.objects.filter(pk=third.pk).update(size_bytes=7)
+        first.delete()
+        settle_blob_sizes([first.file.name])
+        sizes = dict(EquipmentDataset.objects.values_list('pk', 'size_bytes'))
+        self.assertEqual(sizes, {second.pk: first.size_bytes, third.pk: 0})
+
+    def test_delete_keeps_file_still_shared(self):
+        first = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        second = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        self.assertEqual(retention.delete_datasets([first.pk]), 0)
+        self.assertTrue(default_storage.exists(first.file.name))
+        self.assertEqual(EquipmentDataset.objects.get(pk=second.pk).size_bytes, first.size_bytes)
+        self.assertEqual(retention.delete_datasets([second.pk]), first.size_bytes)
+        self.assertFalse(default_storage.exists(first.file.name))
+
+    def test_unshare_gives_private_copy(self):
+        first = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        second = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        self.assertTrue(unshare(second))
+        second.refresh_from_db()
+        self.assertNotEqual(second.file.name, first.file.name)
+        with default_storage.open(second.file.name) as f:
+            self.assertEqual(f.read(), SAMPLE_CSV)
+        self.assertEqual(second.size_bytes, first.size_bytes)
+        self.assertEqual(EquipmentDataset.objects.get(pk=first.pk).size_bytes, first.size_bytes)
+        self.assertFalse(unshare(second))
+
+    def test_archive_leaves_shared_file_alone(self):
+        first = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        self.upload()
+        self.assertEqual(retention.archive(first), 0)
+        first.refresh_from_db()
+        self.assertIsNotNone(first.archived_at)
+        self.assertFalse(first.file.name.endswith('.gz'))
+        self.assertTrue(default_storage.exists(first.file.name))
+
+    def test_archive_compresses_private_file(self):
+        dataset = EquipmentDataset.objects.get(pk=self.upload().json()['id'])
+        self.assertGreater(retention.archive(dataset), 0)
+        dataset.refresh_from_db()
+        self.assertTrue(dataset.file.name.endswith('.gz'))
+        r = self.upload()  # the archived dataset is still a deduplication source
+        self.assertTrue(r.json()['deduplicated'])
+        self.assertEqual(EquipmentDataset.objects.get(pk=r.json()['id']).file.name, dataset.file.name)
+
+
+class AccessTrackingTests(MediaRootMixin, TestCase):
+    """Cached and revalidated table reads count for retention's hot-dataset rule."""
+
+    def setUp(self):
+        super().setUp()
+        auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.csv', SAMPLE_CSV)}, **auth)
+        self.pk = r.json()['id']
+        self.url = f'/api/data/{self.pk}/?limit=5'
+
+    def forget_access(self):
+        EquipmentDataset.objects.filter(pk=self.pk).update(last_accessed_at=None)
+        retention._accessed.clear()
+
+    def last_accessed(self):
+        return EquipmentDataset.objects.get(pk=self.pk).last_accessed_at
+
+    def test_cache_hit_records_access(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.forget_access()
+        self.assertEqual(self.client.get(self.url).status_code, 200)  # from the response cache
+        self.assertIsNotNone(self.last_accessed())
+
+    def test_not_modified_records_access(self):
+        etag = self.client.get(self.url)['ETag']
+        response_cache.clear()
+        self.forget_access()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertIsNotNone(self.last_accessed())
+
+    def test_cache_hits_write_at_most_once_per_resolution(self):
+        self.client.get(self.url)
+        self.forget_access()
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+
+
+class DatasetTableTests(MediaRootMixin, TestCase):
+    """Reads build a missing columnar copy once, under the dataset's row lock (retention.dataset_table)."""
+
+    def setUp(self):
+        super().setUp()
+        auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.csv', SAMPLE_CSV)}, **auth)
+        self.pk = r.json()['id']
+
+    def test_file_without_columnar_copy_is_converted_once(self):
+        dataset = EquipmentDataset.objects.get(pk=self.pk)
+        remove_columnar(dataset.file.path)
+        with mock.patch('equipment.services.ingest_csv', wraps=ingest_csv) as ingest:
+            self.assertEqual(self.client.get(f'/api/data/{self.pk}/?limit=5').json()['total_count'], 40)
+            self.assertEqual(self.client.get(f'/api/data/{self.pk}/?limit=6').json()['total_count'], 40)
+        ingest.assert_called_once_with(dataset.file.path)
+
+    def test_archived_dataset_is_restored_on_read(self):
+        retention.archive(EquipmentDataset.objects.get(pk=self.pk))
+        r = self.client.get(f'/api/data/{self.pk}/?limit=5')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['total_count'], 40)
+        self.assertIsNone(EquipmentDataset.objects.get(pk=self.pk).archived_at)
+
+    def test_copy_built_by_another_reader_is_kept(self):
+        retention.archive(EquipmentDataset.objects.get(pk=self.pk))
+        first, second = EquipmentDataset.objects.get(pk=self.pk), EquipmentDataset.objects.get(pk=self.pk)
+        self.assertEqual(retention.dataset_table(first).num_rows, 40)
+        build = mock.Mock()
+        self.assertEqual(retention.dataset_table(second, build).num_rows, 40)  # archived_at is stale
+        build.assert_not_called()
+        self.assertIsNone(second.archived_at)
+
+@override_settings(EQUIPMENT_PROCESS_WORKERS=0)
+class ReportDownloadTests(MediaRootMixin, TestCase):
+    """The report endpoint only serves cached reports; misses are rendered in the background."""
+
+    def setUp(self):
+        super().setUp()
+        self.token = AuthToken.objects.create(user=self.user).key
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token}'}
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.csv', SAMPLE_CSV)}, **auth)
+        self.pk = r.json()['id']
+        self.url = f'/api/report/{self.pk}/pdf/?token={self.token}'
+
+    def test_miss_queues_render_and_returns_202(self):
+        with mock.patch('equipment.views.queue_report') as queue:
+            r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r['Retry-After'], '5')
+        self.assertEqual(r.json()['status'], 'rendering')
+        queue.assert_called_once_with(self.pk)
+
+    def test_rendered_report_is_served(self):
+        prerender_report(self.pk)
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(b''.join(r.streaming_content)[:5], b'%PDF-')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+
+
+
+class StaleJobTests(MediaRootMixin, TestCase):
+    """Ingest jobs left unfinished by a stopped server process are retried or failed."""
+
+    def setUp(self):
+        super().setUp()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+
+    def upload(self, age=timedelta(hours=1)):
+        # The job is only queued on commit, which never comes in a TestCase: it stays pending.
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.csv', SAMPLE_CSV), 'async': '1'}, **self.auth)
+        IngestJob.objects.filter(pk=r.json()['job_id']).update(updated_at=timezone.now() - age)
+        return IngestJob.objects.get(pk=r.json()['job_id'])
+
+    def test_pending_job_is_requeued_once(self):
+        job = self.upload()
+        self.upload(age=timedelta(seconds=1))
+        with mock.patch('equipment.jobs.submit') as submit:
+            self.assertEqual(recover_stale_jobs(), (1, 0))
+            self.assertEqual(recover_stale_jobs(), (0, 0))
+        submit.assert_called_once_with(run_ingest_job, job.pk)
+        run_ingest_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_parsed), (EquipmentDataset.STATUS_READY, 40))
+
+    def test_job_is_run_once(self):
+        job = self.upload()
+        run_ingest_job(job.pk)
+        with mock.patch('equipment.jobs.ingest_csv') as ingest:
+            run_ingest_job(job.pk)
+        ingest.assert_not_called()
+
+    def test_interrupted_job_fails_and_poll_sees_it(self):
+        job = self.upload()
+        IngestJob.objects.filter(pk=job.pk).update(status=EquipmentDataset.STATUS_PROCESSING)
+        name = job.dataset.file.name
+        body = self.client.get(f'/api/jobs/{job.pk}/', **self.auth).json()
+        self.assertEqual(body['status'], 'failed')
+        self.assertIn('server restarted', body['error'])
+        dataset = EquipmentDataset.objects.get(pk=job.dataset_id)
+        self.assertEqual(dataset.status, EquipmentDataset.STATUS_FAILED)
+        self.assertFalse(dataset.file)
+        self.assertFalse(default_storage.exists(name))
+
+class ChunkedUploadTests(MediaRootMixin, TestCase):
+    data = SAMPLE_CSV
+
+    def put(self, session, index, body, sha256=None):
+        return write_chunk(session, index, io.BytesIO(body), sha256 or hashlib.sha256(body).hexdigest())
+
+    def chunk(self, session, index):
+        return self.data[index * session.chunk_size:(index + 1) * session.chunk_size]
+
+    def test_chunks_in_any_order(self):
+        session = create_session(self.user, 'e.csv', len(self.data), chunk_size=100)
+        for index in reversed(range(session.chunk_count)):
+            self.put(session, index, self.chunk(session, index))
+        name = finish_session(session)
+        with default_storage.open(name, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_bad_retry_of_received_chunk_keeps_good_bytes(self):
+        session = create_session(self.user, 'e.csv', len(self.data), chunk_size=100)
+        for index in range(session.chunk_count):
+            self.put(session, index, self.chunk(session, index))
+        good = self.chunk(session, 1)
+        with self.assertRaises(UploadError):  # corrupt bytes, checksum of the good ones
+            self.put(session, 1, b'x' * len(good), sha256=hashlib.sha256(good).hexdigest())
+        with self.assertRaises(UploadError):  # truncated
+            self.put(session, 1, good[:10], sha256=hashlib.sha256(good).hexdigest())
+        self.assertIn(1, received_chunks(session))
+        name = finish_session(session)
+        with default_storage.open(name, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_put_without_body_is_rejected(self):
+        session = create_session(self.user, 'e.csv', len(self.data), chunk_size=100)
+        auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+        r = self.client.put(f'/api/uploads/{session.key}/chunks/0/', b'', content_type='application/octet-stream',
+                            HTTP_X_CHUNK_SHA256=hashlib.sha256(b'').hexdigest(), **auth)
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.json(), {'error': 'Chunk 0 must be 100 bytes, got 0'})
+        self.assertEqual(received_chunks(session), [])
+
+    def test_expire_keeps_completed_sessions(self):
+        session = create_session(self.user, 'e.csv', len(self.data), chunk_size=len(self.data))
+        self.put(session, 0, self.data)
+        finish_session(session)
+        stale = create_session(self.user, 'f.csv', 10)
+        UploadSession.objects.update(updated_at='2000-01-01T00:00:00Z')
+        expire_sessions()
+        self.assertEqual(list(UploadSession.objects.values_list('pk', flat=True)), [session.pk])
+        self.assertFalse(UploadSession.objects.filter(pk=stale.pk).exists())
+
+
+class ResponseCacheGenerationTests(TestCase):
+    """Two ResponseCache instances stand for two server processes sharing the database."""
+
+    def setUp(self):
+        self.request = RequestFactory().get('/api/summary/1/')
+        self.a, self.b = ResponseCache(alias=''), ResponseCache(alias='')
+
+    def test_invalidation_reaches_other_processes(self):
+        self.a.generation_ttl = self.b.generation_ttl = 0
+        before = self.a.key('summary', 1, self.request)
+        self.assertEqual(before, self.b.key('summary', 1, self.request))
+        self.b.invalidate(1)
+        after = self.a.key('summary', 1, self.request)
+        self.assertNotEqual(before, after)
+        self.assertEqual(after, self.b.key('summary', 1, self.request))
+
+    def test_generation_is_reread_after_ttl(self):
+        self.a.generation_ttl = 60
+        before = self.a.key('summary', 1, self.request)
+        self.b.invalidate(1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.a.key('summary', 1, self.request), before)
+        self.assertIsNone(ResponseCache(alias='').key('summary', 1, self.request, blocking=False))
+        self.a.generation_ttl = 0
+        self.a._generations.clear()
+        self.assertNotEqual(self.a.key('summary', 1, self.request), before)
+
+
+MIXED_CSV = (b'Equipment Name,Type,Flowrate,Pressure,Temperature\n'
+             b'Pump-1,Pump,120,5.2,110\n'
+             b'Valve-1,Valve,60,,90\n'
+             b'Pump-2,Pump,150,6.8,115\n'
+             b'Reactor-1,Reactor,90,2.1,300\n'
+             b'Pump-3,Pump,100,4.0,105\n')
+
+
+class DataQueryTests(MediaRootMixin, TestCase):
+    """Filters, sorting and paging on /api/data/ (query.py)."""
+
+    def setUp(self):
+        super().setUp()
+        auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.csv', MIXED_CSV)}, **auth)
+        self.url = f'/api/data/{r.json()["id"]}/'
+
+    def get(self, query):
+        return self.client.get(f'{self.url}?{query}')
+
+    def names(self, query):
+        r = self.get(query)
+        self.assertEqual(r.status_code, 200)
+        return [row['Equipment Name'] for row in r.json()['data']]
+
+    def test_text_and_range_filters(self):
+        self.assertEqual(self.names('Type=Pump'), ['Pump-1', 'Pump-2', 'Pump-3'])
+        self.assertEqual(self.names('Type!=Pump'), ['Valve-1', 'Reactor-1'])
+        self.assertEqual(self.names('Type=Pump&Pressure>5.2'), ['Pump-2'])
+        self.assertEqual(self.names('Pressure>=5.2'), ['Pump-1', 'Pump-2'])
+        self.assertEqual(self.names('Pressure<5'), ['Reactor-1', 'Pump-3'])  # the missing value never matches
+        self.assertEqual(self.names('Type=Compressor'), [])
+
+    def test_sort_keeps_missing_values_last(self):
+        self.assertEqual(self.names('sort=Pressure'), ['Reactor-1', 'Pump-3', 'Pump-1', 'Pump-2', 'Valve-1'])
+        self.assertEqual(self.names('sort=-Pressure'), ['Pump-2', 'Pump-1', 'Pump-3', 'Reactor-1', 'Valve-1'])
+
+    def test_paging_reports_counts(self):
+        body = self.get('Type=Pump&sort=-Flowrate&offset=1&limit=1').json()
+        self.assertEqual([row['Equipment Name'] for row in body['data']], ['Pump-1'])
+        self.assertEqual((body['total_count'], body['filtered_count']), (5, 3))
+        self.assertEqual((body['offset'], body['limit']), (1, 1))
+        self.assertEqual(self.names('offset=3'), ['Reactor-1', 'Pump-3'])
+        self.assertEqual(self.names('offset=10&limit=5'), [])
+
+    def test_invalid_parameters_are_rejected(self):
+        for query, error in [
+            ('Colour=red', 'Unknown column: Colour'),
+            ('sort=Colour', 'Unknown column: Colour'),
+            ('Type>Pump', 'Type only supports = and != filters'),
+            ('Pressure>high', "Pressure filter needs a number, got 'high'"),
+            ('limit=-1', 'limit must not be negative'),
+            ('offset>2', 'Invalid parameter: offset>2'),
+            ('verbose', 'Invalid filter: verbose'),
+        ]:
+            with self.subTest(query=query):
+                r = self.get(query)
+                self.assertEqual(r.status_code, 400)
+                self.assertEqual(r.json(), {'error': error})
+
+    def test_arrow_without_pyarrow_is_not_acceptable(self):
+        with mock.patch('equipment.renderers.pa', None):
+            r = self.get('format=arrow')
+        self.assertEqual(r.status_code, 406)
+        self.assertEqual(r.json(), {'detail': 'Arrow output needs the pyarrow package on the server'})
+
+    def test_missing_values_are_null_in_json_formats(self):
+        r = self.get('Type=Valve&format=ndjson')
+        self.assertEqual(r['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        head, row = [json.loads(line) for line in r.content.decode().splitlines()]
+        self.assertEqual(head['filtered_count'], 1)
+        self.assertIsNone(row['Pressure'])
+        self.assertEqual(row['Flowrate'], 60)
+        body = json.loads(self.get('Type=Valve&format=columns').content)
+        self.assertEqual(body['columns'], ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature'])
+        self.assertEqual(body['batches'], [{'Equipment Name': ['Valve-1'], 'Type': ['Valve'], 'Flowrate': [60.0],
+                                            'Pressure': [None], 'Temperature': [90.0]}])
+        self.assertIsNone(self.get('Type=Valve').json()['data'][0]['Pressure'])
+
+
+class SketchMergeTests(TestCase):
+    """Sketches built from two halves of a column and merged match numpy on the whole column."""
+
+    def setUp(self):
+        rng = np.random.default_rng(8)
+        self.values = rng.lognormal(3.0, 0.6, 20_000)
+        self.values[rng.choice(len(self.values), 500, replace=False)] = np.nan
+        self.groups = rng.integers(0, 3, len(self.values))
+        self.groups[15_000:][self.groups[15_000:] == 0] = 3  # a group that only the second half has
+
+    def assertQuantilesClose(self, sketch, present):
+        for q in (0.01, 0.5, 0.95, 0.99):
+            with self.subTest(q=q):
+                rank = (present < sketch.quantile(q)).mean()  # the estimate's rank in the exact data
+                self.assertAlmostEqual(rank, q, delta=0.005)
+
+    def assertMatchesNumpy(self, sketch, values):
+        present = values[~np.isnan(values)]
+        self.assertEqual((sketch.count, sketch.nulls), (len(present), len(values) - len(present)))
+        self.assertAlmostEqual(sketch.mean, present.mean(), places=9)
+        self.assertAlmostEqual(sketch.variance / present.var(), 1.0, places=9)
+        self.assertEqual((sketch.min, sketch.max), (present.min(), present.max()))
+        self.assertQuantilesClose(sketch, present)
+
+    def test_tdigest_merge(self):
+        present = self.values[~np.isnan(self.values)]
+        digest = TDigest.from_values(self.values[:7_000]).merge(TDigest.from_values(self.values[7_000:]))
+        self.assertEqual(digest.count, len(present))
+        for q in (0.01, 0.5, 0.95, 0.99):
+            rank = (present < digest.quantile(q, present.min(), present.max())).mean()
+            self.assertAlmostEqual(rank, q, delta=0.005)
+        self.assertMatchesNumpy(
+            ColumnSketch.from_values(self.values[:7_000]).merge(ColumnSketch.from_values(self.values[7_000:])),
+            self.values)
+
+    def test_grouped_merge(self):
+        half = 15_000
+        merged = GroupedSketch.from_values(self.values[:half], self.groups[:half], 3)
+        merged.merge(GroupedSketch.from_values(self.values[half:], self.groups[half:], 4))
+        self.assertEqual(merged.n_groups, 4)
+        for group in range(4):
+            with self.subTest(group=group):
+                self.assertMatchesNumpy(merged.sketch(group), self.values[self.groups == group])
+        self.assertMatchesNumpy(merged.total(), self.values)
+
+    def test_moments_then_digest(self):
+        half = 15_000
+        merged = GroupedSketch.from_moments(self.values[:half], self.groups[:half], 4)
+        merged.merge(GroupedSketch.from_moments(self.values[half:], self.groups[half:], 4))
+        merged.add_digest(self.values, self.groups)
+        for group in range(4):
+            with self.subTest(group=group):
+                self.assertMatchesNumpy(merged.sketch(group), self.values[self.groups == group])
+
+
+class AppendTests(MediaRootMixin, TestCase):
+    """POST /api/datasets/<pk>/append/ extends the stored file, table, summary and charts."""
+
+    # Same columns as MIXED_CSV in another order and spelling.
+    DELTA_CSV = (b'temp (C),Pressure (bar),type,Equipment Name,Flow rate\n'
+                 b'400,9.5,Compressor,Comp-1,80\n'
+                 b'100,,Pump,Pump-4,\n')
+
+    def setUp(self):
+        super().setUp()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {AuthToken.objects.create(user=self.user).key}'}
+        r = self.client.post('/api/upload/', {'file': SimpleUploadedFile('e.csv', MIXED_CSV)}, **self.auth)
+        self.pk = r.json()['id']
+
+    def append(self, data):
+        return self.client.post(f'/api/datasets/{self.pk}/append/',
+                                {'file': SimpleUploadedFile('more.csv', data)}, **self.auth)
+
+    def test_reordered_columns(self):
+        r = self.append(self.DELTA_CSV)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r.json()['appended_count'], r.json()['total_count'], r.json()['revision']), (2, 7, 1))
+        dataset = EquipmentDataset.objects.get(pk=self.pk)
+        with default_storage.open(dataset.file.name, 'rb') as f:
+            self.assertEqual(f.read(), MIXED_CSV + b'Comp-1,Compressor,80,9.5,400\nPump-4,Pump,,,100\n')
+        df = load_table(dataset.file.path).to_dataframe()
+        self.assertEqual(list(df.columns), ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature'])
+        self.assertEqual(len(df), 7)
+        self.assertEqual(df.iloc[5].tolist(), ['Comp-1', 'Compressor', 80.0, 9.5, 400.0])
+        self.assertEqual(df.iloc[6, :2].tolist(), ['Pump-4', 'Pump'])
+        self.assertTrue(df.iloc[6, 2:4].isna().all())
+        self.assertEqual(df.iloc[6, 4], 100.0)
+        body = self.client.get(f'/api/data/{self.pk}/?Type=Pump').json()
+        self.assertEqual([row['Equipment Name'] for row in body['data']], ['Pump-1', 'Pump-2', 'Pump-3', 'Pump-4'])
+        self.assertEqual(dataset.summary_json['total_count'], 7)
+
+    def test_mismatched_columns_leave_dataset_alone(self):
+        r = self.append(b'Equipment Name,Type,Flowrate,Pressure\nPump-9,Pump,1,2\n')
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('do not match the dataset columns', r.json()['error'])
+        dataset = EquipmentDataset.objects.get(pk=self.pk)
+        self.assertEqual((dataset.total_count, dataset.revision), (5, 0))
+        with default_storage.open(dataset.file.name, 'rb') as f:
+            self.assertEqual(f.read(), MIXED_CSV)
+        self.assertEqual(load_table(dataset.file.path).num_rows, 5)
+
+    def test_chart_histograms_count_appended_rows(self):
+        before = self.client.get(f'/api/charts/{self.pk}/').json()['histograms']
+        with self.captureOnCommitCallbacks(execute=True):  # drops the cached charts response
+            self.assertEqual(self.append(self.DELTA_CSV).status_code, 200)
+        charts = self.client.get(f'/api/charts/{self.pk}/').json()
+        self.assertEqual(charts['total_count'], 7)
+        columns = {
+            'Flowrate': [120, 60, 150, 90, 100, 80, np.nan],
+            'Pressure': [5.2, np.nan, 6.8, 2.1, 4.0, 9.5, np.nan],
+            'Temperature': [110, 90, 115, 300, 105, 400, 100],
+        }
+        for col, values in columns.items():
+            with self.subTest(column=col):
+                histogram = charts['histograms'][col]
+                self.assertEqual(histogram['edges'], before[col]['edges'])  # bins stay those of the upload
+                edges = np.array(histogram['edges'])
+                values = np.array(values, dtype=float)
+                present = values[~np.isnan(values)]
+                inside = present[(present >= edges[0]) & (present <= edges[-1])]
+                self.assertEqual(histogram['counts'], np.histogram(inside, bins=edges)[0].tolist())
+                self.assertEqual(histogram['overflow'], int((present > edges[-1]).sum()))
+                self.assertEqual(histogram['underflow'], 0)
+                self.assertEqual(histogram['missing'], len(values) - len(present))
+        self.assertEqual(charts['histograms']['Pressure']['overflow'], 1)
+        self.assertEqual(charts['scatter']['total'], 5)
+
+
+class TokenCacheTests(TestCase):
+    """Cached token resolutions are dropped when the token's user changes or goes away."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user('owner', password='password123')
+        self.key = AuthToken.objects.create(user=self.user).key
+
+    def for_each_cache(self):
+        # The in-process LRU and a shared Django cache (the default locmem cache here).
+        for alias in ('', 'default'):
+            with self.subTest(alias=alias), mock.patch.object(token_cache, 'alias', alias):
+                yield
+
+    def test_cached_resolution_needs_no_query(self):
+        for _ in self.for_each_cache():
+            self.assertEqual(resolve_token(self.key), self.user)
+            with self.assertNumQueries(0):
+                self.assertEqual(resolve_token(self.key), self.user)
+
+    def test_deactivated_user(self):
+        for _ in self.for_each_cache():
+            self.assertEqual(resolve_token(self.key), self.user)
+            self.user.is_active = False
+            self.user.save()
+            self.assertIsNone(resolve_token(self.key))
+            self.user.is_active = True
+            self.user.save()
+
+    def test_deleted_user(self):
+        for _ in self.for_each_cache():
+            user = User.objects.create_user('gone', password='password123')
+            key = AuthToken.objects.create(user=user).key
+            self.assertEqual(resolve_token(key), user)
+            user.delete()
+            self.assertIsNone(resolve_token(key))
+
+    def test_login_keeps_entry(self):
+        for _ in self.for_each_cache():
+            resolve_token(self.key)
+            self.user.save(update_fields=['last_login'])
+            with self.assertNumQueries(0):
+                self.assertEqual(resolve_token(self.key), self.user)
+
+    def test_request_with_token_of_deactivated_user(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.key}'}
+        self.assertEqual(self.client.get('/api/jobs/0/', **auth).status_code, 404)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)  # .update() sends no signals
+        self.assertEqual(self.client.get('/api/jobs/0/', **auth).status_code, 404)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/jobs/0/', **auth).status_code, 403)
+
+
+class MetricsAccessTests(TestCase):
+    """/api/metrics/ is for staff and for scrapers holding EQUIPMENT_METRICS_TOKEN."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password123')
+        self.staff = User.objects.create_user('admin', password='password123', is_staff=True)
+
+    def get(self, auth=None, user=None):
+        if user is not None:
+            auth = f'Token {AuthToken.objects.create(user=user).key}'
+        return self.client.get('/api/metrics/', **({'HTTP_AUTHORIZATION': auth} if auth else {}))
+
+    def test_staff_only_by_default(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(user=self.user).status_code, 403)
+        self.assertEqual(self.get('Bearer anything').status_code, 403)
+        r = self.get(user=self.staff)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r['Content-Type'].startswith('text/plain'))
+
+    @override_settings(EQUIPMENT_METRICS_TOKEN='scrape-secret')
+    def test_scrape_token(self):
+        self.assertEqual(self.get('Bearer scrape-secret').status_code, 200)
+        self.assertEqual(self.get('Bearer wrong').status_code, 403)
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(user=self.staff).status_code, 200)
@@ -0,0 +1,161 @@
+"""
+Chunked, resumable uploads.
+
+A session preallocates one partial file under MEDIA_ROOT/uploads/partial/. Each chunk is
+streamed from the request into a buffer while its SHA-256 is computed, and is only copied
+to its offset in that file and recorded as received once length and checksum match, so
+chunks can arrive in any order, in parallel, and be retried. Completing the session renames the
+partial file into the uploads directory; nothing is ever held in memory whole.
+
+Also the upload handlers for ordinary multipart uploads, which hash files as they arrive.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.utils import timezone
+
+from .models import UploadChunk, UploadSession
+
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+DEFAULT_SESSION_TTL = 24 * 3600
+READ_BYTES = 1024 * 1024
+SPOOL_BYTES = 8 * 1024 * 1024  # chunks up to this size are verified in memory, larger ones in a temp file
+
+
+class _HashingHandlerMixin:
+    """Computes the SHA-256 of each uploaded file as it streams in and sets it as ``file.sha256``."""
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if getattr(self, 'activated', True):  # the memory handler passes big files on unread
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(_HashingHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(_HashingHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class UploadError(ValueError):
+    """Invalid chunk or session state; reported to the client as 400."""
+
+
+def partial_dir() -> Path:
+    return Path(settings.MEDIA_ROOT) / 'uploads' / 'partial'
+
+
+def partial_path(session: UploadSession) -> Path:
+    return partial_dir() / f'{session.key}.part'
+
+
+def create_session(user, filename: str, size: int, name: str | None = None, chunk_size: int | None = None) -> UploadSession:
+    chunk_size = chunk_size or getattr(settings, 'EQUIPMENT_UPLOAD_CHUNK_BYTES', DEFAULT_CHUNK_BYTES)
+    if size < 0:
+        raise UploadError('size must not be negative')
+    if not 0 < chunk_size <= MAX_CHUNK_BYTES:
+        raise UploadError(f'chunk_size must be between 1 and {MAX_CHUNK_BYTES}')
+    expire_sessions()
+    session = UploadSession.objects.create(
+        user=user, filename=os.path.basename(filename), name=name or os.path.basename(filename),
+        size=size, chunk_size=chunk_size,
+    )
+    path = partial_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)  # sparse on most filesystems; chunks fill it in at their offsets
+    return session
+
+
+def received_chunks(session: UploadSession) -> list[int]:
+    return list(session.chunks.values_list('index', flat=True))
+
+
+def write_chunk(session: UploadSession, index: int, stream, sha256: str | None) -> UploadChunk:
+    """Copy one chunk from ``stream`` to its offset once its length and ``sha256`` (hex) are verified."""
+    if session.status != UploadSession.STATUS_OPEN:
+        raise UploadError('Upload is already complete')
+    if not 0 <= index < session.chunk_count:
+        raise UploadError(f'Chunk index must be between 0 and {session.chunk_count - 1}')
+    if not sha256:
+        raise UploadError('X-Chunk-SHA256 header required')
+    expected = max(session.expected_chunk_size(index), 0)
+    digest = hashlib.sha256()
+    written = 0
+    # Verified before it reaches the partial file, so a bad retry of a received chunk
+    # cannot overwrite the good bytes already recorded for it.
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, dir=partial_dir()) as buffer:
+        while written <= expected:
+            piece = stream.read(min(READ_BYTES, expected - written + 1))
+            if not piece:
+                break
+            written += len(piece)
+            if written > expected:
+                break
+            digest.update(piece)
+            buffer.write(piece)
+        if written != expected:
+            raise UploadError(f'Chunk {index} must be {expected} bytes, got {"more" if written > expected else written}')
+        if digest.hexdigest() != sha256.strip().lower():
+            raise UploadError(f'Chunk {index} checksum mismatch')
+        buffer.seek(0)
+        with open(partial_path(session), 'r+b') as f:
+            f.seek(index * session.chunk_size)
+            shutil.copyfileobj(buffer, f, READ_BYTES)
+    chunk, _ = UploadChunk.objects.update_or_create(
+        session=session, index=index, defaults={'size': written, 'sha256': digest.hexdigest()},
+    )
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return chunk
+
+
+def finish_session(session: UploadSession) -> str:
+    """
+    Move the assembled file into storage once every chunk has arrived and return its
+    storage name (for ``FileField.name``).
+    """
+    if session.status != UploadSession.STATUS_OPEN:
+        raise UploadError('Upload is already complete')
+    missing = sorted(set(range(session.chunk_count)) - set(received_chunks(session))) if session.size else []
+    if missing:
+        preview = ', '.join(map(str, missing[:20])) + (' ...' if len(missing) > 20 else '')
+        raise UploadError(f'Missing chunks: {preview}')
+    name = default_storage.get_available_name(f'uploads/{session.filename}')
+    os.replace(partial_path(session), default_storage.path(name))
+    session.status = UploadSession.STATUS_COMPLETE
+    session.save(update_fields=['status', 'updated_at'])
+    return name
+
+
+def abort_session(session: UploadSession):
+    partial_path(session).unlink(missing_ok=True)
+    session.delete()
+
+
+def expire_sessions():
+    """Delete open sessions untouched for EQUIPMENT_UPLOAD_SESSION_TTL seconds, with their partial files."""
+    ttl = getattr(settings, 'EQUIPMENT_UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL)
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    for session in UploadSession.objects.filter(status=UploadSession.STATUS_OPEN, updated_at__lt=cutoff):
+        abort_session(session)
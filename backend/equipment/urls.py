@@ -1,12 +1,32 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if getattr(settings, 'EQUIPMENT_ASYNC_VIEWS', False):
+    from .async_views import (
+        AsyncDataTableView as DataTableView,
+        AsyncHistoryListView as HistoryListView,
+        AsyncReportPDFView as ReportPDFView,
+        AsyncSummaryView as SummaryView,
+    )
+else:
+    from .views import DataTableView, HistoryListView, ReportPDFView, SummaryView
+
 urlpatterns = [
     path('auth/login/', views.LoginView.as_view()),
     path('auth/register/', views.RegisterView.as_view()),
     path('upload/', views.UploadCSVView.as_view()),
-    path('history/', views.HistoryListView.as_view()),
-    path('summary/<int:pk>/', views.SummaryView.as_view()),
-    path('data/<int:pk>/', views.DataTableView.as_view()),
-    path('report/<int:pk>/pdf/', views.ReportPDFView.as_view()),
+    path('uploads/', views.UploadSessionCreateView.as_view()),
+    path('uploads/<str:key>/', views.UploadSessionView.as_view()),
+    path('uploads/<str:key>/chunks/<int:index>/', views.UploadChunkView.as_view()),
+    path('uploads/<str:key>/complete/', views.UploadCompleteView.as_view()),
+    path('datasets/<int:pk>/append/', views.AppendDatasetView.as_view()),
+    path('jobs/<int:pk>/', views.IngestJobView.as_view()),
+    path('history/', HistoryListView.as_view()),
+    path('summary/<int:pk>/', SummaryView.as_view()),
+    path('data/<int:pk>/', DataTableView.as_view()),
+    path('charts/<int:pk>/', views.ChartsView.as_view()),
+    path('analytics/', views.AnalyticsView.as_view()),
+    path('report/<int:pk>/pdf/', ReportPDFView.as_view()),
+    path('metrics/', views.MetricsView.as_view()),
 ]
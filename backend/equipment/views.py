@@ -1,22 +1,43 @@
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, BasePermission
 from rest_framework.parsers import MultiPartParser, FormParser
+from django.conf import settings
 from django.contrib.auth import authenticate
-from django.http import FileResponse, Http404
+from django.db import transaction
+from django.core.files import File
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-import os
-import tempfile
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
-from .models import EquipmentDataset, AuthToken
-from .serializers import EquipmentDatasetSerializer, EquipmentDatasetDetailSerializer
-from .services import parse_csv, dataframe_to_records
+from .models import EquipmentDataset, AuthToken, IngestJob, UploadSession
+from .serializers import EquipmentDatasetSerializer, EquipmentDatasetDetailSerializer, IngestJobSerializer
+from .analytics import DEFAULT_PERCENTILES, combined_statistics
+from .auth import resolve_token
+from .blobs import HashingReader, clone_duplicate, file_sha256, unshare
+from .charts import DEFAULT_SCATTER_POINTS, MAX_SCATTER_POINTS, build_charts, downsample, extend_charts
+from .httpcache import CachedGetMixin
+from .jobs import enqueue_ingest, enqueue_report, enqueue_retention, queue_report, recover_stale_jobs, stale_before
+from .metrics import registry, rows_processed, timed
+from .reports import RETRY_AFTER_SECONDS, cached_report, cached_report_path, remove_reports, report_etag
+from .retention import dataset_table, mark_accessed, restore
+from .services import UnsupportedUpload, append_csv, check_upload_name, ingest_csv, remove_columnar, stored_bytes
+from .uploads import UploadError, abort_session, create_session, finish_session, received_chunks, write_chunk
+from .query import QueryError, parse_query, select_rows
+from .renderers import TABLE_RENDERERS, check_format
+
+
+CACHED_PAGE_ROWS = 5000
 
 
 class AllowAnyMixin:
@@ -54,161 +75,627 @@ class RegisterView(AllowAnyMixin, APIView):
         return Response({'token': token.key, 'user_id': user.id, 'username': user.username}, status=status.HTTP_201_CREATED)
 
 
+def _is_gzip_body(request):
+    return request.META.get('HTTP_CONTENT_ENCODING', '').lower() == 'gzip'
+
+
+def _wants_async(request):
+    data = {} if _is_gzip_body(request) else request.data  # a raw body has no form fields
+    value = data.get('async', request.GET.get('async'))
+    if value is None:
+        return getattr(settings, 'EQUIPMENT_ASYNC_INGEST', False)
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _not_ready_response(dataset):
+    return Response({'error': f'Dataset is {dataset.status}', 'status': dataset.status}, status=status.HTTP_409_CONFLICT)
+
+
 class UploadCSVView(APIView):
-    """Upload CSV. Requires authentication. Keeps last 5 datasets."""
+    """
+    Upload CSV. Requires authentication. Older datasets are removed in the background by
+    the retention policies (EQUIPMENT_RETENTION_*; by default each user keeps 5).
+    Accepts .csv, .csv.gz, .csv.zst and .zip files (stored compressed, decompressed while
+    parsing), or a raw gzip body sent with Content-Encoding: gzip and ?filename=.
+    Bytes identical to a ready dataset's are not parsed or stored again (see blobs.py).
+    With async=1 (or EQUIPMENT_ASYNC_INGEST) returns 202 with a job id; poll /api/jobs/<id>/.
+    """
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request):
+        if _is_gzip_body(request):
+            return self._post_gzip_body(request)
         file = request.FILES.get('file')
-        if not file or not file.name.lower().endswith('.csv'):
+        if not file:
             return Response({'error': 'CSV file required'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as tmp:
-                for chunk in file.chunks():
-                    tmp.write(chunk)
-                tmp.flush()
-                df, summary = parse_csv(tmp.name)
-            os.unlink(tmp.name)
-        except Exception as e:
+            check_upload_name(file.name)
+        except UnsupportedUpload as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
         name = request.data.get('name') or file.name
-        dataset = EquipmentDataset.objects.create(
-            name=name,
-            file=file,
-            uploaded_by=request.user,
-            total_count=summary['total_count'],
-            summary_json=summary,
-        )
-        # Keep only last 5
-        for old in EquipmentDataset.objects.order_by('-uploaded_at')[5:]:
-            if old.file:
-                try:
-                    old.file.delete()
-                except Exception:
-                    pass
-            old.delete()
+        sha256 = getattr(file, 'sha256', '')  # set by the hashing upload handlers
+        duplicate = _duplicate_response(request, name, sha256, file.size)
+        if duplicate is not None:
+            return duplicate
+        dataset = EquipmentDataset(name=name, uploaded_by=request.user, content_sha256=sha256)
+        # Storing first moves Django's spooled upload into MEDIA_ROOT without copying it;
+        # the stored file is then read once, in chunks, to build the summary and columnar copy.
+        with timed('upload.store'):
+            dataset.file.save(file.name, file, save=False)
+        return ingest_stored_upload(request, dataset, file.size)
+
+    def _post_gzip_body(self, request):
+        """The body is the gzipped CSV itself; it is streamed to storage still compressed."""
+        filename = os.path.basename(request.GET.get('filename') or 'upload.csv')
+        if filename.lower().endswith('.gz'):
+            filename = filename[:-3]
+        if not filename.lower().endswith('.csv'):
+            return Response({'error': 'filename must end in .csv'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.stream is None:  # no body (Content-Length missing or 0)
+            return Response({'error': 'Request body required'}, status=status.HTTP_400_BAD_REQUEST)
+        dataset = EquipmentDataset(name=request.GET.get('name') or filename, uploaded_by=request.user)
+        body = HashingReader(request.stream)
+        with timed('upload.store'):
+            dataset.file.save(filename + '.gz', File(body, name=filename + '.gz'), save=False)
+        dataset.content_sha256 = body.hexdigest()
+        duplicate = _duplicate_response(request, dataset.name, dataset.content_sha256, dataset.file.size)
+        if duplicate is not None:
+            dataset.file.delete(save=False)
+            return duplicate
+        return ingest_stored_upload(request, dataset, dataset.file.size)
 
+
+def _duplicate_response(request, name, sha256, size):
+    """
+    201 for an upload whose bytes a ready dataset already holds: the new dataset shares its
+    stored file, columnar copy and summary, so nothing is parsed. None if there is no such dataset.
+    With async=1 it is still a 202 with a job id, the job already finished, as clients expect.
+    """
+    with timed('upload.dedup'):
+        dataset = clone_duplicate(sha256, name, request.user)
+    if dataset is None:
+        return None
+    enqueue_report(dataset)
+    enqueue_retention()
+    if _wants_async(request):
+        now = timezone.now()
+        job = IngestJob.objects.create(
+            dataset=dataset, status=EquipmentDataset.STATUS_READY, bytes_total=size, bytes_processed=size,
+            rows_parsed=dataset.total_count, started_at=now, finished_at=now,
+        )
         return Response({
             'id': dataset.id,
             'name': dataset.name,
             'uploaded_at': dataset.uploaded_at,
+            'status': dataset.status,
+            'job_id': job.id,
+            'deduplicated': True,
+        }, status=status.HTTP_202_ACCEPTED)
+    return Response({
+        'id': dataset.id,
+        'name': dataset.name,
+        'uploaded_at': dataset.uploaded_at,
+        'total_count': dataset.total_count,
+        'summary': dataset.summary_json,
+        'deduplicated': True,
+    }, status=status.HTTP_201_CREATED)
+
+
+def ingest_stored_upload(request, dataset, size):
+    """
+    Parse an upload already stored in ``dataset.file``: in a background job (202) when the
+    client asks for async, otherwise inline (201). Shared by plain and chunked uploads.
+    """
+    if _wants_async(request):
+        return _enqueue(dataset, size)
+    try:
+        summary, sketches = ingest_csv(dataset.file.path)
+        with timed('ingest.charts'):
+            charts = build_charts(dataset.file.path)
+    except Exception as e:
+        remove_columnar(dataset.file.path)
+        dataset.file.delete(save=False)
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    dataset.total_count = summary['total_count']
+    dataset.summary_json = summary
+    dataset.sketches = sketches
+    dataset.charts = charts
+    dataset.size_bytes = stored_bytes(dataset.file.path)
+    with timed('upload.db_write'):
+        dataset.save()
+    enqueue_report(dataset)
+    enqueue_retention()
+
+    return Response({
+        'id': dataset.id,
+        'name': dataset.name,
+        'uploaded_at': dataset.uploaded_at,
+        'total_count': dataset.total_count,
+        'summary': dataset.summary_json,
+    }, status=status.HTTP_201_CREATED)
+
+
+def _enqueue(dataset, size):
+    with transaction.atomic():
+        dataset.status = EquipmentDataset.STATUS_PENDING
+        dataset.save()
+        job = IngestJob.objects.create(dataset=dataset, bytes_total=size)
+        enqueue_ingest(job)
+    return Response({
+        'id': dataset.id,
+        'name': dataset.name,
+        'uploaded_at': dataset.uploaded_at,
+        'status': dataset.status,
+        'job_id': job.id,
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def _session_payload(session):
+    return {
+        'id': session.key,
+        'name': session.name,
+        'filename': session.filename,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'received': received_chunks(session),
+        'status': session.status,
+        'dataset': session.dataset_id,
+    }
+
+
+def _get_session(request, key):
+    try:
+        return UploadSession.objects.get(key=key, user=request.user)
+    except UploadSession.DoesNotExist:
+        raise Http404
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Start a chunked upload: POST { filename, size, name?, chunk_size? } -> session id and chunk layout.
+    Then PUT each chunk to /api/uploads/<id>/chunks/<n>/ and POST /api/uploads/<id>/complete/.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        filename = str(request.data.get('filename') or '')
+        try:
+            check_upload_name(filename)
+        except UnsupportedUpload as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = int(request.data.get('size'))
+            chunk_size = int(request.data['chunk_size']) if request.data.get('chunk_size') else None
+            session = create_session(request.user, filename, size, request.data.get('name'), chunk_size)
+        except (TypeError, ValueError) as e:
+            message = str(e) if isinstance(e, UploadError) else 'size and chunk_size must be integers'
+            return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(_session_payload(session), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    """GET: state of a chunked upload, including received chunk indices (to resume). DELETE: abort it."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, key):
+        return Response(_session_payload(_get_session(request, key)))
+
+    def delete(self, request, key):
+        abort_session(_get_session(request, key))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(APIView):
+    """PUT the raw bytes of chunk <index>, with its hex SHA-256 in X-Chunk-SHA256. Idempotent."""
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, key, index):
+        session = _get_session(request, key)
+        # No body (Content-Length missing or 0) leaves no stream; it is an empty chunk.
+        body = request.stream if request.stream is not None else io.BytesIO()
+        try:
+            with timed('upload.chunk'):
+                chunk = write_chunk(session, index, body, request.headers.get('X-Chunk-SHA256'))
+        except UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'index': chunk.index, 'size': chunk.size, 'sha256': chunk.sha256})
+
+
+class UploadCompleteView(APIView):
+    """Assemble a chunked upload into a dataset; accepts async=1 like /api/upload/."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, key):
+        session = _get_session(request, key)
+        try:
+            name = finish_session(session)
+        except UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        dataset = EquipmentDataset(name=session.name, uploaded_by=request.user)
+        dataset.file.name = name
+        # Chunks arrive in any order, so the whole-file hash is only known now (one read).
+        with timed('upload.dedup'):
+            dataset.content_sha256 = file_sha256(dataset.file.path)
+        response = _duplicate_response(request, dataset.name, dataset.content_sha256, session.size)
+        if response is not None:
+            dataset.file.delete(save=False)
+            UploadSession.objects.filter(pk=session.pk).update(dataset_id=response.data['id'])
+            return response
+        response = ingest_stored_upload(request, dataset, session.size)
+        if dataset.pk:
+            UploadSession.objects.filter(pk=session.pk).update(dataset=dataset)
+        return response
+
+
+@contextmanager
+def _uploaded_path(file):
+    """A filesystem path for an uploaded file, keeping its name's compression suffix."""
+    if hasattr(file, 'temporary_file_path'):
+        yield file.temporary_file_path()
+        return
+    with tempfile.NamedTemporaryFile(suffix='-' + os.path.basename(file.name)) as tmp:
+        for chunk in file.chunks():
+            tmp.write(chunk)
+        tmp.flush()
+        yield tmp.name
+
+
+class AppendDatasetView(APIView):
+    """
+    Append rows to one of your datasets: POST a CSV (``file``, compressed like an upload)
+    with the same columns. The stored file, table and summary are extended from the new
+    rows only; the dataset's revision is bumped, which changes its table and report ETags.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request, pk):
+        file = request.FILES.get('file')
+        if not file:
+            return Response({'error': 'CSV file required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            check_upload_name(file.name)
+        except UnsupportedUpload as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            try:
+                # The row lock serializes appends to one dataset (SQLite locks the whole database).
+                dataset = EquipmentDataset.objects.select_for_update().get(pk=pk)
+            except EquipmentDataset.DoesNotExist:
+                raise Http404
+            if dataset.uploaded_by_id != request.user.id and not request.user.is_staff:
+                raise Http404
+            if not dataset.is_ready:
+                return _not_ready_response(dataset)
+            if not dataset.file:
+                return Response({'error': 'Dataset has no stored rows'}, status=status.HTTP_409_CONFLICT)
+            try:
+                if dataset.archived_at is not None:
+                    restore(dataset)
+                unshare(dataset)  # copy-on-write: other datasets may share the stored file
+                with timed('append.total'), _uploaded_path(file) as delta_path:
+                    summary, sketches, appended = append_csv(dataset.file.path, delta_path)
+                    with timed('append.charts'):
+                        charts = extend_charts(dataset.file.path, summary['total_count'] - appended)
+            except Exception as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            dataset.total_count = summary['total_count']
+            dataset.summary_json = summary
+            dataset.sketches = sketches
+            dataset.charts = charts
+            dataset.size_bytes = stored_bytes(dataset.file.path)
+            dataset.revision += 1
+            dataset.content_sha256 = ''  # no longer the bytes uploaded
+            dataset.save(update_fields=[
+                'total_count', 'summary_json', 'sketches', 'charts', 'size_bytes', 'revision', 'content_sha256',
+            ])
+            transaction.on_commit(lambda: remove_reports(dataset.pk))
+            enqueue_report(dataset)
+        return Response({
+            'id': dataset.id,
+            'name': dataset.name,
+            'revision': dataset.revision,
+            'appended_count': appended,
             'total_count': dataset.total_count,
             'summary': dataset.summary_json,
-        }, status=status.HTTP_201_CREATED)
+        })
+
 
+class IngestJobView(APIView):
+    """Progress of a background upload: bytes processed, rows parsed, ETA."""
+    def get(self, request, pk):
+        try:
+            job = IngestJob.objects.select_related('dataset').get(pk=pk)
+        except IngestJob.DoesNotExist:
+            raise Http404
+        if job.dataset.uploaded_by_id != request.user.id and not request.user.is_staff:
+            raise Http404
+        if job.status in (EquipmentDataset.STATUS_PENDING, EquipmentDataset.STATUS_PROCESSING) \
+                and job.updated_at < stale_before():
+            recover_stale_jobs()  # its server process stopped; a poll should not wait forever
+            job.refresh_from_db()
+        return Response(IngestJobSerializer(job).data)
+
+
+class HistoryListView(CachedGetMixin, AllowAnyMixin, APIView):
+    """List last 5 uploaded datasets (summary only). Served from the response cache."""
+    cache_scope = 'history'
 
-class HistoryListView(AllowAnyMixin, APIView):
-    """List last 5 uploaded datasets (summary only)."""
     def get(self, request):
         qs = EquipmentDataset.objects.order_by('-uploaded_at')[:5]
         serializer = EquipmentDatasetSerializer(qs, many=True)
         return Response(serializer.data)
 
 
-class SummaryView(AllowAnyMixin, APIView):
-    """Get summary for a dataset by ID."""
+def _not_modified(request, etag):
+    """A 304 response if the request's If-None-Match matches ``etag``, else None."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _with_etag(response, etag, vary=None):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'  # cacheable, but revalidate with If-None-Match
+    if vary:
+        response['Vary'] = vary
+    return response
+
+
+def summary_payload(dataset):
+    """The summary endpoint's body for ``dataset`` and its ETag."""
+    payload = {
+        'id': dataset.id,
+        'name': dataset.name,
+        'status': dataset.status,
+        'total_count': dataset.total_count,
+        'summary': dataset.summary_json,
+    }
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return payload, f'"summary-{dataset.pk}-{digest[:20]}"'
+
+
+class SummaryView(CachedGetMixin, AllowAnyMixin, APIView):
+    """Get summary for a dataset by ID. Sends an ETag; If-None-Match gets 304. Served from the response cache."""
+    cache_scope = 'summary'
+
     def get(self, request, pk):
         try:
             dataset = EquipmentDataset.objects.get(pk=pk)
         except EquipmentDataset.DoesNotExist:
             raise Http404
-        return Response({
-            'id': dataset.id,
-            'name': dataset.name,
-            'total_count': dataset.total_count,
-            'summary': dataset.summary_json,
-        })
+        payload, etag = summary_payload(dataset)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        return _with_etag(Response(payload), etag)
+
+
+def charts_etag(dataset, points):
+    return f'"charts-{dataset.pk}-{int(dataset.uploaded_at.timestamp())}-{dataset.revision}-{points}"'
+
+
+class ChartsView(CachedGetMixin, AllowAnyMixin, APIView):
+    """
+    Chart data for a dataset, computed at ingest (see charts.py): fixed-bin histograms per
+    numeric column, per-type box plot stats and a grid-downsampled Pressure/Temperature
+    scatter of up to ?points= points (default 500, at most 2000). A few KB whatever the
+    dataset size. Datasets stored before chart data existed get it on first request.
+    """
+    cache_scope = 'charts'
+
+    def get(self, request, pk):
+        try:
+            points = int(request.query_params.get('points', DEFAULT_SCATTER_POINTS))
+        except ValueError:
+            return Response({'error': 'points must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= points <= MAX_SCATTER_POINTS:
+            return Response({'error': f'points must be between 1 and {MAX_SCATTER_POINTS}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dataset = EquipmentDataset.objects.get(pk=pk)
+        except EquipmentDataset.DoesNotExist:
+            raise Http404
+        if not dataset.is_ready:
+            return _not_ready_response(dataset)
+        etag = charts_etag(dataset, points)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        charts = dataset.charts
+        if not charts and dataset.file:
+            try:
+                charts = self._build(dataset)
+            except Exception as e:
+                return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        payload = {'id': dataset.id, 'name': dataset.name, **downsample(charts, points)} if charts else {
+            'id': dataset.id, 'name': dataset.name, 'total_count': 0, 'histograms': {}, 'box': {}, 'scatter': None,
+        }
+        return _with_etag(Response(payload), etag)
+
+    @staticmethod
+    def _build(dataset):
+        with transaction.atomic():
+            # The row lock keeps an append from running on the table meanwhile.
+            dataset = EquipmentDataset.objects.select_for_update().get(pk=dataset.pk)
+            if not dataset.charts:
+                if dataset.archived_at is not None:
+                    restore(dataset)
+                with timed('charts.build'):
+                    dataset.charts = build_charts(dataset.file.path)
+                dataset.save(update_fields=['charts'])
+        return dataset.charts
+
 
+def _parse_number_list(value, cast, name):
+    try:
+        return [cast(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise QueryError(f'{name} must be a comma-separated list of numbers')
+
+
+class AnalyticsView(AllowAnyMixin, APIView):
+    """
+    Combined statistics across datasets: ?ids=1,2,3 (default: all ready datasets),
+    ?percentiles=50,95,99. Merged from per-dataset sketches stored at ingest.
+    """
+    def get(self, request):
+        try:
+            ids = _parse_number_list(request.GET.get('ids', ''), int, 'ids')
+            percentiles = _parse_number_list(request.GET.get('percentiles', ''), float, 'percentiles') or DEFAULT_PERCENTILES
+        except QueryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if any(not 0 <= p <= 100 for p in percentiles):
+            return Response({'error': 'percentiles must be between 0 and 100'}, status=status.HTTP_400_BAD_REQUEST)
+        qs = EquipmentDataset.objects.filter(status=EquipmentDataset.STATUS_READY).order_by('-uploaded_at')
+        if ids:
+            qs = qs.filter(pk__in=ids)
+            missing = set(ids) - set(qs.values_list('pk', flat=True))
+            if missing:
+                return Response({'error': f'Unknown or unfinished datasets: {sorted(missing)}'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(combined_statistics(qs, percentiles))
+
+
+def data_etag(dataset, query_string, media_type):
+    digest = hashlib.sha1(f'{query_string}|{media_type}'.encode()).hexdigest()[:20]
+    return f'"data-{dataset.pk}-{int(dataset.uploaded_at.timestamp())}-{dataset.revision}-{digest}"'
+
+
+class DataTableView(CachedGetMixin, AllowAnyMixin, APIView):
+    """
+    Get table data for a dataset (from its columnar copy), streamed in row batches.
+    Optional: ?offset=&limit= paging, ?sort=<column> (or -<column>), filters like Type=Reactor or Pressure>2.0.
+    Formats (Accept or ?format=): json (default), ndjson, columns, arrow (if pyarrow is installed).
+    The ETag is derived from the dataset (and its revision, bumped by appends), query and format.
+    Selections of up to EQUIPMENT_RESPONSE_CACHE_MAX_ROWS rows (table pages) are rendered
+    in one piece and kept in the response cache; larger ones are streamed.
+    """
+    renderer_classes = TABLE_RENDERERS
+    cache_scope = 'data'
+    records_access = True
+
+    def perform_content_negotiation(self, request, force=False):
+        if not force:  # forced negotiation picks a renderer for the error response
+            check_format(request.query_params.get('format'))
+        return super().perform_content_negotiation(request, force)
 
-class DataTableView(AllowAnyMixin, APIView):
-    """Get full table data for a dataset (from stored CSV)."""
     def get(self, request, pk):
         try:
             dataset = EquipmentDataset.objects.get(pk=pk)
         except EquipmentDataset.DoesNotExist:
             raise Http404
+        if not dataset.is_ready:
+            return _not_ready_response(dataset)
         if not dataset.file:
-            return Response({'data': []})
+            return Response({'data': [], 'total_count': 0, 'filtered_count': 0})
+        etag = data_etag(dataset, request.META.get('QUERY_STRING', ''), request.accepted_renderer.media_type)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            mark_accessed(dataset)  # a revalidated read is still a read
+            return not_modified
+        try:
+            query = parse_query(request.META.get('QUERY_STRING', ''))
+        except QueryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        mark_accessed(dataset)
         try:
-            df, _ = parse_csv(dataset.file.path)
-            records = dataframe_to_records(df)
-            return Response({'data': records})
+            table = dataset_table(dataset)
+            with timed('data.select'):
+                rows, filtered_count = select_rows(table, query)
+        except QueryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'error': str(e), 'data': []}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        meta = {
+            'total_count': table.num_rows,
+            'filtered_count': filtered_count,
+            'offset': query.offset,
+            'limit': query.limit,
+        }
+        selected = len(range(table.num_rows)[rows]) if isinstance(rows, slice) else len(rows)
+        rows_processed.inc(selected, stage='data')
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type + (f'; charset={renderer.charset}' if renderer.charset else '')
+        if selected <= getattr(settings, 'EQUIPMENT_RESPONSE_CACHE_MAX_ROWS', CACHED_PAGE_ROWS):
+            response = HttpResponse(renderer.stream(table, rows, meta), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(renderer.stream(table, rows, meta), content_type=content_type)
+        return _with_etag(response, etag, vary='Accept')
 
 
 class ReportPDFView(APIView):
-    """Generate PDF report for a dataset. Requires authentication (Token or query param)."""
+    """
+    PDF report for a dataset: summary, charts and every row by Type (see reports.py).
+    Requires authentication (Token or query param). Served from the report cache only:
+    on a miss the report is rendered in the background and this answers 202 until it is ready.
+    """
     permission_classes = []  # auth checked manually to allow ?token= for download links
     authentication_classes = []  # we'll authenticate manually
 
     def get(self, request, pk):
         token_key = request.GET.get('token') or request.headers.get('Authorization', '').replace('Token ', '')
-        if token_key:
-            try:
-                token = AuthToken.objects.get(key=token_key)
-                request.user = token.user
-            except AuthToken.DoesNotExist:
-                pass
+        user = resolve_token(token_key.strip())
+        if user is not None:
+            request.user = user
         if not getattr(request, 'user', None) or not request.user.is_authenticated:
             return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
         try:
             dataset = EquipmentDataset.objects.get(pk=pk)
         except EquipmentDataset.DoesNotExist:
             raise Http404
-        try:
-            df, _ = parse_csv(dataset.file.path) if dataset.file else (None, dataset.summary_json)
-        except Exception:
-            df = None
-        summary = dataset.summary_json or {}
-
-        fd, path = tempfile.mkstemp(suffix='.pdf')
-        os.close(fd)
-        doc = SimpleDocTemplate(path, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(name='Title', parent=styles['Heading1'], fontSize=16)
-        story = []
-        story.append(Paragraph('Chemical Equipment Parameter Report', title_style))
-        story.append(Spacer(1, 0.2*inch))
-        story.append(Paragraph(f'Dataset: {dataset.name}', styles['Normal']))
-        story.append(Paragraph(f'Generated: {timezone.now().strftime("%Y-%m-%d %H:%M")}', styles['Normal']))
-        story.append(Spacer(1, 0.3*inch))
-        story.append(Paragraph('Summary', styles['Heading2']))
-        story.append(Paragraph(f"Total equipment count: {summary.get('total_count', 0)}", styles['Normal']))
-        av = summary.get('averages', {})
-        for k, v in (av or {}).items():
-            if v is not None:
-                story.append(Paragraph(f"Average {k}: {v}", styles['Normal']))
-        type_dist = summary.get('type_distribution', {})
-        if type_dist:
-            story.append(Spacer(1, 0.2*inch))
-            story.append(Paragraph('Equipment type distribution:', styles['Normal']))
-            type_data = [['Type', 'Count']] + [[k, str(v)] for k, v in type_dist.items()]
-            t = Table(type_data)
-            t.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey), ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'), ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12), ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.black)]))
-            story.append(t)
-        if df is not None and len(df) > 0:
-            story.append(Spacer(1, 0.3*inch))
-            story.append(Paragraph('Data sample (first 20 rows)', styles['Heading2']))
-            sample = df.head(20)
-            cols = list(sample.columns)
-            table_data = [cols] + sample.fillna('').astype(str).values.tolist()
-            t2 = Table(table_data, repeatRows=1)
-            t2.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey), ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'), ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 8), ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),                 ('GRID', (0, 0), (-1, -1), 0.25, colors.black)]))
-            story.append(t2)
-        doc.build(story)
-        try:
-            return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'report_{dataset.id}.pdf')
-        finally:
-            try:
-                os.unlink(path)
-            except Exception:
-                pass
+        if not dataset.is_ready:
+            return _not_ready_response(dataset)
+        mark_accessed(dataset)
+        etag = report_etag(dataset)
+        path = cached_report_path(dataset)
+        if path.exists():
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=int(path.stat().st_mtime),
+            )
+            if not_modified is not None:
+                return not_modified
+        path = cached_report(dataset)
+        if path is None:
+            queue_report(dataset.pk)
+            return Response(report_pending_payload(dataset), status=status.HTTP_202_ACCEPTED,
+                            headers=report_pending_headers())
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=f'report_{dataset.id}.pdf')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(path.stat().st_mtime)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def report_pending_payload(dataset):
+    return {'id': dataset.id, 'status': 'rendering', 'retry_after': RETRY_AFTER_SECONDS}
+
+
+def report_pending_headers():
+    # Refresh makes a browser that opened the download link retry by itself.
+    return {'Retry-After': str(RETRY_AFTER_SECONDS), 'Refresh': str(RETRY_AFTER_SECONDS)}
+
+
+class IsStaffOrScraper(BasePermission):
+    """Staff users, or a scraper sending ``Authorization: Bearer <EQUIPMENT_METRICS_TOKEN>``."""
+
+    def has_permission(self, request, view):
+        expected = getattr(settings, 'EQUIPMENT_METRICS_TOKEN', '')
+        auth = request.META.get('HTTP_AUTHORIZATION') or ''
+        if expected and auth.startswith('Bearer '):
+            return hmac.compare_digest(auth[len('Bearer '):].strip().encode(), expected.encode())
+        return bool(request.user and request.user.is_staff)
+
+
+class MetricsView(APIView):
+    """
+    Request and stage metrics for this process, in Prometheus text format. Staff only,
+    or a scraper with the EQUIPMENT_METRICS_TOKEN bearer token: the stage timings and
+    query counts describe the deployment.
+    """
+    permission_classes = [IsStaffOrScraper]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
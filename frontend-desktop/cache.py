@@ -0,0 +1,150 @@
+"""
+Local cache of API responses: an in-memory LRU in front of an on-disk store under the
+user's cache directory. Entries carry the server's ETag and are revalidated with
+If-None-Match, so a dataset that was viewed before opens from disk even after a restart
+and only a 304 crosses the network.
+
+On-disk entry layout (one file per key):
+    b'EQC1' | uint32 header length | header (JSON) | zlib-compressed body
+The header holds the ETag, the small JSON part of the response and, for each array,
+its name, kind and byte range in the body. Numeric columns are raw float64; text
+columns are a JSON list (None for missing).
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'EQC1'
+DEFAULT_MEMORY_ENTRIES = 64
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def user_cache_dir(app='equipment-visualizer'):
+    override = os.environ.get('EQUIPMENT_CACHE_DIR')
+    if override:
+        return Path(override)
+    if sys.platform == 'win32':
+        base = Path(os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local')
+    elif sys.platform == 'darwin':
+        base = Path.home() / 'Library' / 'Caches'
+    else:
+        base = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache')
+    return base / app
+
+
+def encode_entry(etag, meta, arrays):
+    """Serialize ``meta`` (JSON-able) and ``arrays`` ({name: np.ndarray}) into the entry format."""
+    parts, columns, offset = [], [], 0
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        if values.dtype == np.float64:
+            data, kind = values.tobytes(), 'f8'
+        else:
+            data, kind = json.dumps([None if v is None else str(v) for v in values.tolist()]).encode(), 'json'
+        columns.append({'name': name, 'kind': kind, 'offset': offset, 'length': len(data)})
+        parts.append(data)
+        offset += len(data)
+    header = json.dumps({'etag': etag, 'meta': meta, 'arrays': columns}).encode()
+    return MAGIC + struct.pack('<I', len(header)) + header + zlib.compress(b''.join(parts), 1)
+
+
+def decode_entry(blob):
+    """Inverse of ``encode_entry``: ``(etag, meta, arrays)``; raises ValueError on a bad blob."""
+    if blob[:4] != MAGIC:
+        raise ValueError('not a cache entry')
+    (n,) = struct.unpack('<I', blob[4:8])
+    header = json.loads(blob[8:8 + n])
+    try:
+        body = zlib.decompress(blob[8 + n:])
+    except zlib.error as e:
+        raise ValueError(str(e))
+    arrays = {}
+    for col in header['arrays']:
+        data = body[col['offset']:col['offset'] + col['length']]
+        if col['kind'] == 'f8':
+            arrays[col['name']] = np.frombuffer(data, dtype=np.float64)
+        else:
+            arrays[col['name']] = np.array(json.loads(data), dtype=object)
+    return header['etag'], header['meta'], arrays
+
+
+class ResponseCache:
+    """Thread-safe ``key -> (etag, meta, arrays)`` store; see module docstring."""
+
+    def __init__(self, namespace, root=None, memory_entries=DEFAULT_MEMORY_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        # Namespaced by server so two backends never share entries.
+        self.root = Path(root or user_cache_dir()) / hashlib.sha1(namespace.encode()).hexdigest()[:16]
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.root / (hashlib.sha1(key.encode()).hexdigest() + '.eqc')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        path = self._path(key)
+        try:
+            entry = decode_entry(path.read_bytes())
+            os.utime(path)  # recency for disk eviction
+        except (OSError, ValueError, KeyError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, etag, meta, arrays=None):
+        arrays = arrays or {}
+        entry = (etag, meta, arrays)
+        self._remember(key, entry)
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            tmp = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
+            tmp.write_bytes(encode_entry(etag, meta, arrays))
+            os.replace(tmp, path)
+            self._evict(keep=path)
+        except OSError:
+            pass  # the disk cache is best effort; the memory copy still serves this session
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict(self, keep=None):
+        entries = []
+        for p in self.root.glob('*.eqc'):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if p != keep:
+                p.unlink(missing_ok=True)
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for p in self.root.glob('*.eqc'):
+            p.unlink(missing_ok=True)
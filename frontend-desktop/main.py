@@ -4,97 +4,201 @@ Connects to the same Django backend API.
 """
 import sys
 import os
+import math
+import time
 import webbrowser
+from pathlib import Path
+from urllib.parse import quote
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QLineEdit, QTableWidget, QTableWidgetItem,
+    QPushButton, QLabel, QLineEdit, QTableView,
     QFileDialog, QMessageBox, QGroupBox, QScrollArea, QFrame, QTabWidget,
     QHeaderView, QComboBox, QProgressBar, QSplitter,
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import matplotlib
 matplotlib.use('Qt5Agg')
 
+from cache import ResponseCache
+from table_model import DatasetTableModel, ServerSortFilterProxyModel, column_array, parse_filters
+from tasks import TaskRunner
+from uploader import ChunkedUpload
+
 # Default backend URL (change if needed)
 API_BASE = os.environ.get('API_BASE', 'http://127.0.0.1:8000/api')
+POOL_SIZE = 8
+RETRIES = 3
+TIMEOUT = 30  # seconds to connect / between bytes
+REPORT_POLL = 5  # seconds between report polls when the backend sends no Retry-After
+REPORT_WAIT = 300  # seconds to wait for a report to render before giving up
+DOWNLOAD_CHUNK = 64 * 1024
 
 
 class ApiClient:
-    def __init__(self, base=API_BASE):
+    """
+    Backend API over one pooled ``requests.Session`` (keep-alive, shared by all worker
+    threads). Idempotent requests are retried on connection errors and 502/503/504.
+    Calls block; run them through TaskRunner, never on the GUI thread.
+    Summaries and data pages go through a ResponseCache revalidated by ETag, and are
+    served from it when the backend cannot be reached.
+    """
+
+    def __init__(self, base=API_BASE, pool_size=POOL_SIZE, cache=None):
         self.base = base.rstrip('/')
         self.token = None
+        self.cache = cache if cache is not None else ResponseCache(self.base)
+        self.session = requests.Session()
+        retry = Retry(
+            total=RETRIES, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     def set_token(self, token):
         self.token = token
 
     def _headers(self, auth=False):
-        h = {'Content-Type': 'application/json'}
+        h = {}
         if auth and self.token:
             h['Authorization'] = f'Token {self.token}'
         return h
 
-    def login(self, username, password):
-        r = requests.post(f'{self.base}/auth/login/', json={'username': username, 'password': password})
-        r.raise_for_status()
-        return r.json()
-
-    def register(self, username, password):
-        r = requests.post(f'{self.base}/auth/register/', json={'username': username, 'password': password})
-        r.raise_for_status()
-        return r.json()
-
-    def upload(self, path, name=None):
-        with open(path, 'rb') as f:
-            files = {'file': (os.path.basename(path), f, 'text/csv')}
-            data = {}
-            if name:
-                data['name'] = name
-            r = requests.post(f'{self.base}/upload/', headers=self._headers(auth=True), files=files, data=data)
+    def _get(self, path):
+        r = self.session.get(f'{self.base}{path}', timeout=TIMEOUT)
         r.raise_for_status()
         return r.json()
 
-    def history(self):
-        r = requests.get(f'{self.base}/history/')
+    def _cached_get(self, path, split=lambda payload: (payload, {}), join=lambda meta, arrays: meta):
+        """
+        GET ``path`` with If-None-Match from the cache. ``split(payload)`` turns a fresh
+        response into ``(meta, arrays)`` for storage and ``join(meta, arrays)`` rebuilds
+        what callers get back, for fresh and cached responses alike.
+        """
+        entry = self.cache.get(path)
+        headers = {'If-None-Match': entry[0]} if entry else {}
+        try:
+            r = self.session.get(f'{self.base}{path}', headers=headers, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if entry:
+                return join(entry[1], entry[2])
+            raise
+        if r.status_code == 304 and entry:
+            return join(entry[1], entry[2])
         r.raise_for_status()
-        return r.json()
+        meta, arrays = split(r.json())
+        if r.headers.get('ETag'):
+            self.cache.put(path, r.headers['ETag'], meta, arrays)
+        return join(meta, arrays)
 
-    def summary(self, pk):
-        r = requests.get(f'{self.base}/summary/{pk}/')
+    def login(self, username, password):
+        r = self.session.post(f'{self.base}/auth/login/', json={'username': username, 'password': password}, timeout=TIMEOUT)
         r.raise_for_status()
         return r.json()
 
-    def data(self, pk):
-        r = requests.get(f'{self.base}/data/{pk}/')
+    def register(self, username, password):
+        r = self.session.post(f'{self.base}/auth/register/', json={'username': username, 'password': password}, timeout=TIMEOUT)
         r.raise_for_status()
         return r.json()
 
+    def upload(self, path, name=None, progress=None):
+        """Chunked, resumable upload (see uploader.ChunkedUpload); returns the created dataset."""
+        return ChunkedUpload(self, path, name, progress).run()
 
-class Worker(QThread):
-    finished = pyqtSignal(object)
-    error = pyqtSignal(str)
-
-    def __init__(self, fn, *args, **kwargs):
-        super().__init__()
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
+    def history(self):
+        return self._get('/history/')
 
-    def run(self):
+    def summary(self, pk):
+        return self._cached_get(f'/summary/{pk}/')
+
+    def charts(self, pk, points=None):
+        """Histograms, box plot stats and a downsampled scatter, computed by the backend."""
+        return self._cached_get(f'/charts/{pk}/' + (f'?points={points}' if points else ''))
+
+    def report_pdf(self, pk, dest, pending=None):
+        """
+        Save the PDF report of dataset ``pk`` to ``dest`` and return ``dest``. The backend
+        renders reports in the background and answers 202 until the PDF is ready, so this
+        polls every Retry-After seconds, calling ``pending()`` (from this thread) on each 202.
+        """
+        deadline = time.monotonic() + REPORT_WAIT
+        while True:
+            r = self.session.get(f'{self.base}/report/{pk}/pdf/', headers=self._headers(auth=True),
+                                 stream=True, timeout=TIMEOUT)
+            if r.status_code != 202:
+                break
+            r.close()
+            if pending:
+                pending()
+            try:
+                delay = int(r.headers.get('Retry-After', REPORT_POLL))
+            except ValueError:
+                delay = REPORT_POLL
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError('The report is still rendering. Try again later.')
+            time.sleep(delay)
+        with r:
+            r.raise_for_status()
+            part = f'{dest}.part'
+            with open(part, 'wb') as f:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+            os.replace(part, dest)
+        return dest
+
+    def data(self, pk, offset=None, limit=None, sort=None, filters=None):
+        """One page of rows in the column-oriented format; filters are (column, op, value) triples."""
+        parts = ['format=columns']
+        if offset is not None:
+            parts.append(f'offset={offset}')
+        if limit is not None:
+            parts.append(f'limit={limit}')
+        if sort:
+            parts.append(f"sort={quote(sort, safe='')}")
+        for col, op, value in filters or []:
+            parts.append(quote(f'{col}{op}{value}', safe=''))
+        return self._cached_get(f'/data/{pk}/?' + '&'.join(parts), split=_split_columns, join=_join_columns)
+
+
+def _split_columns(payload):
+    """Column-format page -> (counts/paging meta, one compact array per column)."""
+    meta = {k: v for k, v in payload.items() if k != 'batches'}
+    arrays = {}
+    for c in payload.get('columns') or []:
+        values = []
+        for batch in payload.get('batches', []):
+            values.extend(batch.get(c, []))
+        arrays[c] = column_array(values)
+    return meta, arrays
+
+
+def _join_columns(meta, arrays):
+    return {**meta, 'batches': [arrays] if arrays else []}
+
+
+def error_message(exc):
+    """The backend's ``error`` field if the response has one, else the exception text."""
+    response = getattr(exc, 'response', None)
+    if response is not None:
         try:
-            result = self.fn(*self.args, **self.kwargs)
-            self.finished.emit(result)
-        except Exception as e:
-            self.error.emit(str(e))
+            return response.json().get('error', str(exc))
+        except Exception:
+            pass
+    return str(exc)
 
 
 class LoginWidget(QWidget):
-    def __init__(self, api, on_login):
+    def __init__(self, api, runner, on_login):
         super().__init__()
         self.api = api
+        self.runner = runner
         self.on_login = on_login
         self.setup_ui()
 
@@ -109,17 +213,17 @@ class LoginWidget(QWidget):
         self.error_label = QLabel()
         self.error_label.setStyleSheet('color: #ef4444;')
         self.error_label.setVisible(False)
-        login_btn = QPushButton('Log in')
-        login_btn.clicked.connect(self.do_login)
-        reg_btn = QPushButton('Create account')
-        reg_btn.setFlat(True)
-        reg_btn.clicked.connect(self.do_register)
+        self.login_btn = QPushButton('Log in')
+        self.login_btn.clicked.connect(self.do_login)
+        self.reg_btn = QPushButton('Create account')
+        self.reg_btn.setFlat(True)
+        self.reg_btn.clicked.connect(self.do_register)
         layout.addWidget(QLabel('Chemical Equipment Visualizer'))
         layout.addWidget(self.username)
         layout.addWidget(self.password)
         layout.addWidget(self.error_label)
-        layout.addWidget(login_btn)
-        layout.addWidget(reg_btn)
+        layout.addWidget(self.login_btn)
+        layout.addWidget(self.reg_btn)
 
     def do_login(self):
         self._submit('login')
@@ -134,19 +238,22 @@ class LoginWidget(QWidget):
             self.error_label.setVisible(True)
             return
         self.error_label.setVisible(False)
-        try:
-            if mode == 'login':
-                data = self.api.login(u, p)
-            else:
-                data = self.api.register(u, p)
-            self.on_login(data['token'], data['username'])
-        except requests.RequestException as e:
-            try:
-                err = e.response.json().get('error', str(e))
-            except Exception:
-                err = str(e)
-            self.error_label.setText(err)
-            self.error_label.setVisible(True)
+        self._set_busy(True)
+        call = self.api.login if mode == 'login' else self.api.register
+        self.runner.submit(lambda: call(u, p), self._done, self._failed)
+
+    def _set_busy(self, busy):
+        self.login_btn.setEnabled(not busy)
+        self.reg_btn.setEnabled(not busy)
+
+    def _done(self, data):
+        self._set_busy(False)
+        self.on_login(data['token'], data['username'])
+
+    def _failed(self, exc):
+        self._set_busy(False)
+        self.error_label.setText(error_message(exc))
+        self.error_label.setVisible(True)
 
 
 class ChartsWidget(QWidget):
@@ -159,6 +266,9 @@ class ChartsWidget(QWidget):
         layout.addWidget(self.bar_canvas)
         layout.addWidget(QLabel('Equipment type distribution'))
         layout.addWidget(self.doughnut_canvas)
+        self.detail_canvas = FigureCanvas(Figure(figsize=(8, 3)))
+        layout.addWidget(QLabel('Distributions'))
+        layout.addWidget(self.detail_canvas)
 
     def update_charts(self, summary):
         if not summary:
@@ -183,13 +293,44 @@ class ChartsWidget(QWidget):
                     startangle=90)
         self.doughnut_canvas.draw()
 
+    def update_detail(self, charts):
+        """Histograms and the Pressure/Temperature scatter from the /charts/ payload."""
+        fig = self.detail_canvas.figure
+        fig.clear()
+        histograms = (charts or {}).get('histograms') or {}
+        scatter = (charts or {}).get('scatter')
+        panels = len(histograms) + (1 if scatter and scatter['points'] else 0)
+        colors = ['#3b82f6', '#10b981', '#f59e0b']
+        for i, (col, hist) in enumerate(histograms.items()):
+            ax = fig.add_subplot(1, panels, i + 1)
+            edges = hist['edges']
+            ax.stairs(hist['counts'], edges, fill=True, color=colors[i % len(colors)])
+            ax.set_title(col, fontsize=9)
+        if panels > len(histograms):
+            ax = fig.add_subplot(1, panels, panels)
+            xs, ys, counts = zip(*scatter['points'])
+            # One point per occupied grid cell, larger where more rows fall.
+            ax.scatter(xs, ys, s=[4 + 4 * math.log10(c) for c in counts], alpha=0.6, color='#3b82f6')
+            ax.set_xlabel(scatter['x'], fontsize=8)
+            ax.set_ylabel(scatter['y'], fontsize=8)
+        if panels:
+            fig.tight_layout()
+        self.detail_canvas.draw()
+
 
 class MainWidget(QWidget):
-    def __init__(self, api):
+    # Task group for everything that belongs to the dataset on screen; cancelled on switch.
+    DATASET_TASKS = 'dataset'
+    uploadProgress = pyqtSignal(object, object)  # bytes sent, bytes total (emitted from upload threads)
+    reportPending = pyqtSignal()  # the report is still rendering (emitted from the download thread)
+
+    def __init__(self, api, runner):
         super().__init__()
         self.api = api
+        self.runner = runner
         self.history = []
         self.current_id = None
+        self.report_busy = False
         self.setup_ui()
 
     def setup_ui(self):
@@ -200,9 +341,15 @@ class MainWidget(QWidget):
         self.pdf_btn = QPushButton('Download PDF Report')
         self.pdf_btn.clicked.connect(self.download_pdf)
         self.pdf_btn.setEnabled(False)
+        self.reportPending.connect(lambda: self.pdf_btn.setText('Rendering report...'))
         self.history_combo = QComboBox()
         self.history_combo.currentIndexChanged.connect(self.on_select_history)
+        self.upload_progress = QProgressBar()
+        self.upload_progress.setMaximumWidth(160)
+        self.upload_progress.setVisible(False)
+        self.uploadProgress.connect(self._show_upload_progress)
         top.addWidget(self.upload_btn)
+        top.addWidget(self.upload_progress)
         top.addWidget(self.pdf_btn)
         top.addWidget(QLabel('Dataset:'))
         top.addWidget(self.history_combo, 1)
@@ -215,48 +362,95 @@ class MainWidget(QWidget):
         self.charts = ChartsWidget()
         layout.addWidget(self.charts)
 
-        self.table = QTableWidget()
+        filter_row = QHBoxLayout()
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText('Filter, e.g. Type=Reactor, Pressure>2.5 (Enter to apply)')
+        self.filter_edit.returnPressed.connect(self.apply_filters)
+        self.rows_label = QLabel()
+        filter_row.addWidget(self.filter_edit, 1)
+        filter_row.addWidget(self.rows_label)
+        layout.addLayout(filter_row)
+
+        self.table_model = DatasetTableModel(self.api, self.run_async)
+        self.table_model.countsChanged.connect(self._show_counts)
+        self.table_model.fetchFailed.connect(lambda exc: QMessageBox.warning(self, 'Error', error_message(exc)))
+        self.table_proxy = ServerSortFilterProxyModel()
+        self.table_proxy.setSourceModel(self.table_model)
+        self.table = QTableView()
+        self.table.setModel(self.table_proxy)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setDefaultSectionSize(22)
         layout.addWidget(self.table)
 
         self.load_history()
 
-    def load_history(self):
+    def run_async(self, fn, on_done, on_error):
+        self.runner.submit(fn, on_done, on_error, group=self.DATASET_TASKS)
+
+    def _show_counts(self, filtered, total):
+        self.rows_label.setText(f'{filtered:,} of {total:,} rows' if filtered != total else f'{total:,} rows')
+
+    def apply_filters(self):
         try:
-            self.history = self.api.history()
-        except Exception:
-            self.history = []
+            filters = parse_filters(self.filter_edit.text())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Filter', str(e))
+            return
+        self.table_proxy.set_filters(filters)
+
+    def load_history(self, select_id=None):
+        """Refresh the dataset list in the background, then select ``select_id`` (or keep the current one)."""
+        self.runner.submit(self.api.history, lambda history: self._history_loaded(history, select_id),
+                           lambda exc: self._history_loaded([], select_id))
+
+    def _history_loaded(self, history, select_id):
+        self.history = history
+        wanted = select_id or self.current_id or (history[0]['id'] if history else None)
+        self.history_combo.blockSignals(True)
         self.history_combo.clear()
         self.history_combo.addItem('-- Select --', None)
         for h in self.history:
             self.history_combo.addItem(f"{h.get('name', h['id'])} ({h['total_count']} items)", h['id'])
-        if self.history and not self.current_id:
-            self.history_combo.setCurrentIndex(1)
-            self.current_id = self.history[0]['id']
-            self.refresh_data()
+        idx = self.history_combo.findData(wanted) if wanted else -1
+        self.history_combo.setCurrentIndex(max(idx, 0))
+        self.history_combo.blockSignals(False)
+        if self.history_combo.itemData(self.history_combo.currentIndex()) != self.current_id or select_id:
+            self.on_select_history(self.history_combo.currentIndex())
 
     def on_select_history(self, idx):
         pk = self.history_combo.itemData(idx)
         self.current_id = pk
+        self.runner.cancel_group(self.DATASET_TASKS)
+        self.pdf_btn.setEnabled(bool(pk) and not self.report_busy)
         if pk:
-            self.pdf_btn.setEnabled(True)
             self.refresh_data()
         else:
-            self.pdf_btn.setEnabled(False)
             self.summary_label.setText('Select or upload a dataset.')
             self.charts.update_charts(None)
-            self.table.setRowCount(0)
-            self.table.setColumnCount(0)
+            self.charts.update_detail(None)
+            self.table_model.set_dataset(None)
+            self.rows_label.clear()
 
     def refresh_data(self):
+        """Load the summary and the first page of rows concurrently."""
         if not self.current_id:
             return
-        try:
-            summary_res = self.api.summary(self.current_id)
-            data_res = self.api.data(self.current_id)
-        except Exception as e:
-            QMessageBox.warning(self, 'Error', str(e))
-            return
+        self.runner.cancel_group(self.DATASET_TASKS)
+        self.summary_label.setText('Loading...')
+        self.run_async(lambda pk=self.current_id: self.api.summary(pk), self._show_summary,
+                       lambda exc: QMessageBox.warning(self, 'Error', error_message(exc)))
+        self.charts.update_detail(None)
+        self.run_async(lambda pk=self.current_id: self.api.charts(pk), self.charts.update_detail,
+                       lambda exc: None)  # the summary charts still show
+        # Rows are paged in by the model as the table scrolls; the first page is requested now.
+        self.filter_edit.clear()
+        self.table_proxy.filters = []
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table_model.set_dataset(self.current_id)
+
+    def _show_summary(self, summary_res):
         summary = summary_res.get('summary') or summary_res
         total = summary_res.get('total_count', 0)
         av = summary.get('averages', {})
@@ -266,68 +460,81 @@ class MainWidget(QWidget):
                 parts.append(f"Avg {k}: {v}")
         self.summary_label.setText(' | '.join(parts))
         self.charts.update_charts(summary)
-        data = data_res.get('data', [])
-        if not data:
-            self.table.setRowCount(0)
-            self.table.setColumnCount(0)
-            return
-        cols = list(data[0].keys())
-        self.table.setColumnCount(len(cols))
-        self.table.setRowCount(len(data))
-        self.table.setHorizontalHeaderLabels(cols)
-        for i, row in enumerate(data):
-            for j, c in enumerate(cols):
-                self.table.setItem(i, j, QTableWidgetItem(str(row.get(c, ''))))
 
     def upload_csv(self):
         path, _ = QFileDialog.getOpenFileName(self, 'Select CSV', '', 'CSV (*.csv)')
         if not path:
             return
         self.upload_btn.setEnabled(False)
-        worker = Worker(self.api.upload, path, os.path.basename(path))
-        worker.finished.connect(self._upload_done)
-        worker.error.connect(self._upload_error)
-        worker.start()
-        self._worker = worker
+        self.upload_progress.setValue(0)
+        self.upload_progress.setVisible(True)
+        self.runner.submit(lambda: self.api.upload(path, os.path.basename(path), progress=self.uploadProgress.emit),
+                           self._upload_done, self._upload_error)
+
+    def _show_upload_progress(self, sent, total):
+        self.upload_progress.setValue(int(sent * 100 / total) if total else 100)
 
     def _upload_done(self, result):
         self.upload_btn.setEnabled(True)
-        self.load_history()
-        self.current_id = result['id']
-        idx = self.history_combo.findData(result['id'])
-        if idx >= 0:
-            self.history_combo.setCurrentIndex(idx)
-        self.refresh_data()
+        self.upload_progress.setVisible(False)
+        self.load_history(select_id=result['id'])
         QMessageBox.information(self, 'Upload', 'File uploaded successfully.')
 
-    def _upload_error(self, err):
+    def _upload_error(self, exc):
         self.upload_btn.setEnabled(True)
-        QMessageBox.warning(self, 'Upload failed', err)
+        self.upload_progress.setVisible(False)
+        QMessageBox.warning(self, 'Upload failed', error_message(exc) + '\n\nUploading the same file again resumes where it stopped.')
 
     def download_pdf(self):
-        if not self.current_id or not self.api.token:
+        if not self.current_id or not self.api.token or self.report_busy:
+            return
+        pk = self.current_id
+        path, _ = QFileDialog.getSaveFileName(self, 'Save PDF Report', f'report_{pk}.pdf', 'PDF (*.pdf)')
+        if not path:
             return
-        url = f'{API_BASE}/report/{self.current_id}/pdf/?token={self.api.token}'
-        webbrowser.open(url)
+        self.report_busy = True
+        self.pdf_btn.setEnabled(False)
+        self.pdf_btn.setText('Downloading...')
+        # Not in the dataset task group: switching datasets does not cancel the download.
+        self.runner.submit(lambda: self.api.report_pdf(pk, path, pending=self.reportPending.emit),
+                           self._report_done, self._report_error)
+
+    def _report_finished(self):
+        self.report_busy = False
+        self.pdf_btn.setText('Download PDF Report')
+        self.pdf_btn.setEnabled(bool(self.current_id))
+
+    def _report_done(self, path):
+        self._report_finished()
+        webbrowser.open(Path(path).as_uri())
+
+    def _report_error(self, exc):
+        self._report_finished()
+        QMessageBox.warning(self, 'PDF report', error_message(exc))
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.api = ApiClient()
+        self.runner = TaskRunner(parent=self)
         self.setWindowTitle('Chemical Equipment Parameter Visualizer')
         self.setMinimumSize(900, 700)
         self.resize(1000, 750)
         self.show_login()
 
     def show_login(self):
-        self.setCentralWidget(LoginWidget(self.api, self.on_login))
+        self.setCentralWidget(LoginWidget(self.api, self.runner, self.on_login))
 
     def on_login(self, token, username):
         self.api.set_token(token)
-        self.setCentralWidget(MainWidget(self.api))
+        self.setCentralWidget(MainWidget(self.api, self.runner))
         self.statusBar().showMessage(f'Logged in as {username}')
 
+    def closeEvent(self, event):
+        self.runner.shutdown()
+        super().closeEvent(event)
+
 
 def main():
     app = QApplication(sys.argv)
@@ -0,0 +1,214 @@
+"""
+Lazily paged table model for the dataset view.
+
+Rows are fetched from /api/data/<id>/ in pages (column-oriented format) as the view
+scrolls, via canFetchMore/fetchMore. Each page keeps one numpy array per column, so
+memory grows with the rows actually scrolled through, not with the dataset, and the
+first rows appear after a single small request. Sorting and filtering go through
+ServerSortFilterProxyModel, which sends them to the backend instead of sorting locally.
+"""
+import re
+
+import numpy as np
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Qt, pyqtSignal
+
+PAGE_ROWS = 500
+FILTER_RE = re.compile(r'^\s*(?P<column>[^<>=!]+?)\s*(?P<op>>=|<=|!=|>|<|=)\s*(?P<value>.*?)\s*$')
+
+
+def parse_filters(text):
+    """'Type=Reactor, Pressure>2.5' -> [('Type', '=', 'Reactor'), ('Pressure', '>', '2.5')]."""
+    filters = []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        m = FILTER_RE.match(part)
+        if not m:
+            raise ValueError(f'Invalid filter: {part.strip()}')
+        filters.append((m.group('column'), m.group('op'), m.group('value')))
+    return filters
+
+
+def column_array(values):
+    """Numeric columns as float64 (None -> NaN), anything else as an object array."""
+    if isinstance(values, np.ndarray):
+        return values
+    if all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
+def _display(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '' if np.isnan(value) else str(value)
+    return str(value)
+
+
+class DatasetTableModel(QAbstractTableModel):
+    """Rows of one dataset, fetched a page at a time in background workers."""
+
+    loadingChanged = pyqtSignal(bool)
+    countsChanged = pyqtSignal(int, int)  # filtered_count, total_count
+    fetchFailed = pyqtSignal(object)  # the exception raised by the request
+
+    def __init__(self, api, run_async, page_rows=PAGE_ROWS, parent=None):
+        """``run_async(fn, on_done, on_error)`` runs ``fn`` off the GUI thread and calls back on it."""
+        super().__init__(parent)
+        self.api = api
+        self.run_async = run_async
+        self.page_rows = page_rows
+        self.dataset_id = None
+        self.sort = None
+        self.filters = []
+        self._reset_state()
+
+    def _reset_state(self):
+        self.columns = []
+        self.pages = []  # one {column: np.ndarray} per fetched page, in row order
+        self.loaded_rows = 0
+        self.filtered_count = None
+        self.total_count = 0
+        self._generation = getattr(self, '_generation', 0) + 1
+        self._loading = False
+
+    # -- query ------------------------------------------------------------
+
+    def set_dataset(self, dataset_id):
+        self.dataset_id = dataset_id
+        self.sort = None
+        self.filters = []
+        self.reload()
+
+    def set_query(self, sort=None, filters=None):
+        self.sort = sort
+        self.filters = list(filters or [])
+        self.reload()
+
+    def reload(self):
+        self.beginResetModel()
+        self._reset_state()
+        self.endResetModel()
+        if self.dataset_id is not None:
+            self.fetchMore(QModelIndex())
+
+    # -- lazy loading ------------------------------------------------------
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.dataset_id is None or self._loading:
+            return False
+        return self.filtered_count is None or self.loaded_rows < self.filtered_count
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._loading = True
+        self.loadingChanged.emit(True)
+        generation = self._generation
+        dataset_id, offset = self.dataset_id, self.loaded_rows
+        sort, filters = self.sort, self.filters
+        self.run_async(
+            lambda: self.api.data(dataset_id, offset=offset, limit=self.page_rows, sort=sort, filters=filters),
+            lambda result: self._page_loaded(generation, result),
+            lambda err: self._page_failed(generation, err),
+        )
+
+    def _page_loaded(self, generation, result):
+        if generation != self._generation:
+            return  # the query changed while this page was in flight
+        self._loading = False
+        self.loadingChanged.emit(False)
+        first = self.filtered_count is None
+        self.filtered_count = result.get('filtered_count', 0)
+        self.total_count = result.get('total_count', 0)
+        if first:
+            self.beginResetModel()
+            self.columns = list(result.get('columns') or [])
+            self.endResetModel()
+        batches = result.get('batches', [])
+        if len(batches) == 1:
+            page = {c: column_array(batches[0].get(c, [])) for c in self.columns}
+        else:
+            page = {c: column_array([v for batch in batches for v in batch.get(c, [])]) for c in self.columns}
+        n = len(page[self.columns[0]]) if self.columns else 0
+        if n:
+            self.beginInsertRows(QModelIndex(), self.loaded_rows, self.loaded_rows + n - 1)
+            self.pages.append(page)
+            self.loaded_rows += n
+            self.endInsertRows()
+        else:
+            self.filtered_count = self.loaded_rows  # nothing more to fetch
+        self.countsChanged.emit(self.filtered_count, self.total_count)
+
+    def _page_failed(self, generation, err):
+        if generation != self._generation:
+            return
+        self._loading = False
+        self.loadingChanged.emit(False)
+        self.filtered_count = self.loaded_rows  # stop fetchMore from retrying in a loop
+        self.fetchFailed.emit(err)
+
+    # -- model -------------------------------------------------------------
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def value(self, row, column):
+        page = self.pages[row // self.page_rows]
+        return page[self.columns[column]][row % self.page_rows]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return _display(self.value(index.row(), index.column()))
+        if role == Qt.TextAlignmentRole:
+            column = self.pages[0][self.columns[index.column()]] if self.pages else None
+            if column is not None and column.dtype == np.float64:
+                return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section] if section < len(self.columns) else None
+        return str(section + 1)
+
+
+class ServerSortFilterProxyModel(QSortFilterProxyModel):
+    """
+    Passes rows through unchanged; header-click sorting and filters are forwarded to the
+    source model as a new server query, so no rows are ever sorted or scanned locally.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.filters = []
+        self.setDynamicSortFilter(False)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        source = self.sourceModel()
+        if source is None:
+            return
+        sort = None
+        if 0 <= column < len(source.columns):
+            sort = ('-' if order == Qt.DescendingOrder else '') + source.columns[column]
+        if sort != source.sort:
+            source.set_query(sort=sort, filters=self.filters)
+
+    def set_filters(self, filters):
+        self.filters = list(filters)
+        source = self.sourceModel()
+        if source is not None:
+            source.set_query(sort=source.sort, filters=self.filters)
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return True
+
+    def lessThan(self, left, right):
+        return left.row() < right.row()
@@ -0,0 +1,89 @@
+"""
+Background execution for API calls: a bounded thread pool whose results are delivered
+back on the Qt GUI thread, with per-group cancellation (e.g. everything belonging to the
+dataset being viewed when the user switches to another one).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+DEFAULT_WORKERS = 4
+
+
+class Task:
+    """Handle for a submitted call. Cancelled tasks never invoke their callbacks."""
+
+    def __init__(self, group, on_done, on_error):
+        self.group = group
+        self.on_done = on_done
+        self.on_error = on_error
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        # A request already on the wire cannot be interrupted; its result is dropped instead.
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class TaskRunner(QObject):
+    """Runs callables on a thread pool and calls ``on_done(result)`` / ``on_error(exc)`` on the GUI thread."""
+
+    _finished = pyqtSignal(object, object, object)  # task, result, exception
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, parent=None):
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='api')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._finished.connect(self._deliver)
+
+    def submit(self, fn, on_done=None, on_error=None, group=None):
+        task = Task(group, on_done, on_error)
+        with self._lock:
+            self._pending.add(task)
+        task.future = self._executor.submit(self._run, task, fn)
+        return task
+
+    def _run(self, task, fn):
+        if task.cancelled:
+            self._finished.emit(task, None, None)
+            return
+        try:
+            result = fn()
+        except Exception as e:
+            self._finished.emit(task, None, e)
+        else:
+            self._finished.emit(task, result, None)
+
+    def _deliver(self, task, result, error):
+        with self._lock:
+            self._pending.discard(task)
+        if task.cancelled:
+            return
+        if error is not None:
+            if task.on_error is not None:
+                task.on_error(error)
+        elif task.on_done is not None:
+            task.on_done(result)
+
+    def cancel_group(self, group):
+        self._cancel(lambda t: t.group == group)
+
+    def shutdown(self):
+        self._cancel(lambda t: True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cancel(self, predicate):
+        with self._lock:
+            tasks = [t for t in self._pending if predicate(t)]
+            for t in tasks:
+                t.cancel()
+                if t.future is not None and t.future.cancelled():
+                    self._pending.discard(t)  # never started, so it will never be delivered
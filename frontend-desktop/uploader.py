@@ -0,0 +1,150 @@
+"""
+Chunked, resumable CSV upload (/api/uploads/): several chunks are sent in parallel, each
+with its SHA-256, and failed chunks are retried. The session id is remembered per file,
+so an upload that is interrupted resumes from the chunks the server already has.
+
+Plain CSVs are gzip-compressed first (streamed, into the cache directory) and sent as
+.csv.gz; the server keeps them compressed and decompresses while parsing.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from cache import user_cache_dir
+
+PARALLEL_CHUNKS = 4
+COMPRESSED_SUFFIXES = ('.gz', '.zst', '.zip')
+COPY_BYTES = 1024 * 1024
+CHUNK_RETRIES = 4
+CHUNK_TIMEOUT = 120
+
+
+class UploadCancelled(Exception):
+    pass
+
+
+def _state_base(path):
+    st = os.stat(path)
+    ident = f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}'
+    return user_cache_dir() / 'uploads' / hashlib.sha1(ident.encode()).hexdigest()
+
+
+def gzip_for_upload(path, dest):
+    """Compress ``path`` to ``dest`` in blocks (reproducibly: no timestamp in the header)."""
+    if dest.exists():
+        return dest  # left from an interrupted upload of the same file; resume with it
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + '.tmp')
+    with open(path, 'rb') as src, open(tmp, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+        shutil.copyfileobj(src, gz, COPY_BYTES)
+    os.replace(tmp, dest)
+    return dest
+
+
+class ChunkedUpload:
+    def __init__(self, api, path, name=None, progress=None, parallel=PARALLEL_CHUNKS):
+        """``progress(bytes_sent, bytes_total)`` is called from worker threads."""
+        self.api = api
+        self.source = path
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.name = name
+        self.progress = progress
+        self.parallel = parallel
+        base = _state_base(path)
+        self.state_path = base.with_suffix('.json')
+        self.compressed_path = None
+        if not path.lower().endswith(COMPRESSED_SUFFIXES):
+            self.compressed_path = base.with_suffix('.csv.gz')
+            self.filename += '.gz'
+        self.size = None
+        self._cancel = threading.Event()
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _url(self, suffix=''):
+        return f'{self.api.base}/uploads/{suffix}'
+
+    def _session(self):
+        """Resume the remembered session for this file if the server still has it, else start one."""
+        headers = self.api._headers(auth=True)
+        try:
+            key = json.loads(self.state_path.read_text())['id']
+            r = self.api.session.get(self._url(f'{key}/'), headers=headers, timeout=CHUNK_TIMEOUT)
+            if r.status_code == 200 and r.json().get('status') == 'open':
+                return r.json()
+        except (OSError, ValueError, KeyError):
+            pass
+        r = self.api.session.post(self._url(), headers=headers, timeout=CHUNK_TIMEOUT, json={
+            'filename': self.filename, 'size': self.size, 'name': self.name,
+        })
+        r.raise_for_status()
+        session = r.json()
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.state_path.write_text(json.dumps({'id': session['id']}))
+        return session
+
+    def _send_chunk(self, session, index):
+        offset = index * session['chunk_size']
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(session['chunk_size'])
+        headers = {**self.api._headers(auth=True), 'Content-Type': 'application/octet-stream',
+                   'X-Chunk-SHA256': hashlib.sha256(data).hexdigest()}
+        url = self._url(f"{session['id']}/chunks/{index}/")
+        for attempt in range(CHUNK_RETRIES):
+            if self._cancel.is_set():
+                raise UploadCancelled()
+            try:
+                r = self.api.session.put(url, data=data, headers=headers, timeout=CHUNK_TIMEOUT)
+                if r.status_code < 500:
+                    r.raise_for_status()
+                    break
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == CHUNK_RETRIES - 1:
+                    raise
+            if attempt == CHUNK_RETRIES - 1:
+                r.raise_for_status()
+            time.sleep(0.5 * 2 ** attempt)
+        self._advance(len(data))
+
+    def _advance(self, n):
+        with self._lock:
+            self._sent += n
+            sent = self._sent
+        if self.progress:
+            self.progress(sent, self.size)
+
+    def run(self):
+        if self.compressed_path is not None:
+            self.path = str(gzip_for_upload(self.source, self.compressed_path))
+        self.size = os.path.getsize(self.path)
+        session = self._session()
+        received = set(session.get('received', []))
+        todo = [i for i in range(session['chunk_count']) if i not in received]
+        self._advance(sum(min(session['chunk_size'], self.size - i * session['chunk_size']) for i in received))
+        with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix='upload') as pool:
+            futures = [pool.submit(self._send_chunk, session, i) for i in todo]
+            try:
+                for fut in futures:
+                    fut.result()
+            except BaseException:
+                self._cancel.set()  # stop the remaining chunks; the session is kept for resuming
+                raise
+        r = self.api.session.post(self._url(f"{session['id']}/complete/"), headers=self.api._headers(auth=True),
+                                  timeout=(CHUNK_TIMEOUT, None))
+        r.raise_for_status()
+        self.state_path.unlink(missing_ok=True)
+        if self.compressed_path is not None:
+            self.compressed_path.unlink(missing_ok=True)
+        return r.json()
@@ -3,19 +3,66 @@ import {
   CategoryScale,
   LinearScale,
   BarElement,
+  PointElement,
   Title,
   Tooltip,
   Legend,
   ArcElement,
 } from 'chart.js'
-import { Bar, Doughnut } from 'react-chartjs-2'
+import { Bar, Doughnut, Scatter } from 'react-chartjs-2'
 import './Charts.css'
 
-ChartJS.register(CategoryScale, LinearScale, BarElement, Title, Tooltip, Legend, ArcElement)
+ChartJS.register(CategoryScale, LinearScale, BarElement, PointElement, Title, Tooltip, Legend, ArcElement)
 
 const CHART_COLORS = ['#3b82f6', '#10b981', '#f59e0b', '#ef4444', '#8b5cf6', '#ec4899']
 
-export function Charts({ summary, data }) {
+const AXIS = { grid: { color: 'rgba(148,163,184,0.15)' }, ticks: { color: '#94a3b8' } }
+
+function histogramData(hist, color) {
+  return {
+    labels: hist.counts.map((_, i) => `${hist.edges[i]}–${hist.edges[i + 1]}`),
+    datasets: [{ label: 'Rows', data: hist.counts, backgroundColor: color, barPercentage: 1, categoryPercentage: 1 }],
+  }
+}
+
+function histogramOptions(column) {
+  return {
+    responsive: true,
+    maintainAspectRatio: false,
+    plugins: { legend: { display: false }, title: { display: true, text: `${column} distribution` } },
+    scales: { y: { beginAtZero: true, ...AXIS }, x: { grid: { display: false }, ticks: { color: '#94a3b8', maxTicksLimit: 6 } } },
+  }
+}
+
+// Downsampled scatter: one point per occupied grid cell, sized by how many rows fall in it.
+function scatterData(scatter) {
+  return {
+    datasets: [{
+      label: `${scatter.y} vs ${scatter.x}`,
+      data: scatter.points.map(([x, y, count]) => ({ x, y, count })),
+      backgroundColor: 'rgba(59,130,246,0.6)',
+      pointRadius: (ctx) => 2 + Math.log10(ctx.raw?.count || 1),
+    }],
+  }
+}
+
+function scatterOptions(scatter) {
+  return {
+    responsive: true,
+    maintainAspectRatio: false,
+    plugins: {
+      legend: { display: false },
+      title: { display: true, text: `${scatter.y} vs ${scatter.x} (${scatter.total} rows)` },
+      tooltip: { callbacks: { label: (ctx) => `(${ctx.raw.x}, ${ctx.raw.y}): ${ctx.raw.count} rows` } },
+    },
+    scales: {
+      x: { title: { display: true, text: scatter.x, color: '#94a3b8' }, ...AXIS },
+      y: { title: { display: true, text: scatter.y, color: '#94a3b8' }, ...AXIS },
+    },
+  }
+}
+
+export function Charts({ summary, charts }) {
   const typeDist = summary?.type_distribution || {}
   const averages = summary?.averages || {}
   const avgLabels = Object.keys(averages).filter((k) => averages[k] != null)
@@ -81,6 +128,20 @@ export function Charts({ summary, data }) {
           </div>
         )}
       </div>
+      {Object.entries(charts?.histograms || {}).map(([column, hist], i) => (
+        <div key={column} className="chart-box">
+          <div className="chart-container">
+            <Bar data={histogramData(hist, CHART_COLORS[i % CHART_COLORS.length])} options={histogramOptions(column)} />
+          </div>
+        </div>
+      ))}
+      {charts?.scatter?.points.length > 0 && (
+        <div className="chart-box">
+          <div className="chart-container">
+            <Scatter data={scatterData(charts.scatter)} options={scatterOptions(charts.scatter)} />
+          </div>
+        </div>
+      )}
     </section>
   )
 }
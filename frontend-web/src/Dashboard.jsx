@@ -8,9 +8,12 @@ export function Dashboard({ user, onLogout }) {
   const [history, setHistory] = useState([])
   const [selectedId, setSelectedId] = useState(null)
   const [summary, setSummary] = useState(null)
-  const [data, setData] = useState([])
+  const [charts, setCharts] = useState(null)
   const [uploading, setUploading] = useState(false)
+  const [uploadPct, setUploadPct] = useState(null)
   const [uploadError, setUploadError] = useState('')
+  const [report, setReport] = useState(null) // null, 'downloading' or 'rendering'
+  const [reportError, setReportError] = useState('')
   const [loading, setLoading] = useState(false)
 
   const loadHistory = useCallback(async () => {
@@ -30,17 +33,18 @@ export function Dashboard({ user, onLogout }) {
   useEffect(() => {
     if (!selectedId) {
       setSummary(null)
-      setData([])
+      setCharts(null)
       return
     }
     setLoading(true)
-    Promise.all([api.summary(selectedId), api.data(selectedId)])
-      .then(([s, d]) => {
-        setSummary(s)
-        setData(d.data || [])
-      })
+    api.summary(selectedId)
+      .then(setSummary)
       .catch(console.error)
       .finally(() => setLoading(false))
+    setCharts(null)
+    api.charts(selectedId)
+      .then(setCharts)
+      .catch(console.error)
   }, [selectedId])
 
   const handleUpload = async (e) => {
@@ -49,20 +53,38 @@ export function Dashboard({ user, onLogout }) {
     setUploadError('')
     setUploading(true)
     try {
-      const result = await api.upload(file, file.name)
+      const result = await api.upload(file, file.name, {
+        onProgress: (sent, total) => setUploadPct(total ? Math.floor((sent * 100) / total) : 100),
+      })
       await loadHistory()
       setSelectedId(result.id)
     } catch (err) {
       setUploadError(err.message || 'Upload failed')
     } finally {
       setUploading(false)
+      setUploadPct(null)
       e.target.value = ''
     }
   }
 
-  const downloadPdf = () => {
-    if (!selectedId) return
-    window.open(api.reportPdfUrl(selectedId), '_blank')
+  const downloadPdf = async () => {
+    if (!selectedId || report) return
+    const id = selectedId
+    setReportError('')
+    setReport('downloading')
+    try {
+      const blob = await api.reportPdf(id, { onPending: () => setReport('rendering') })
+      const url = URL.createObjectURL(blob)
+      const link = document.createElement('a')
+      link.href = url
+      link.download = `report_${id}.pdf`
+      link.click()
+      setTimeout(() => URL.revokeObjectURL(url), 1000)
+    } catch (err) {
+      setReportError(err.message || 'Failed to download report')
+    } finally {
+      setReport(null)
+    }
   }
 
   return (
@@ -71,19 +93,20 @@ export function Dashboard({ user, onLogout }) {
         <h1>Chemical Equipment Parameter Visualizer</h1>
         <div className="header-actions">
           <label className="btn btn-primary">
-            {uploading ? 'Uploading...' : 'Upload CSV'}
+            {uploading ? (uploadPct != null ? `Uploading ${uploadPct}%...` : 'Uploading...') : 'Upload CSV'}
             <input type="file" accept=".csv" onChange={handleUpload} disabled={uploading} hidden />
           </label>
           {selectedId && (
-            <a href={api.reportPdfUrl(selectedId)} target="_blank" rel="noreferrer" className="btn btn-secondary">
-              Download PDF Report
-            </a>
+            <button type="button" className="btn btn-secondary" onClick={downloadPdf} disabled={report != null}>
+              {report === 'rendering' ? 'Rendering report...' : report ? 'Downloading...' : 'Download PDF Report'}
+            </button>
           )}
           <span className="user">{user}</span>
           <button type="button" className="btn btn-outline" onClick={onLogout}>Log out</button>
         </div>
       </header>
       {uploadError && <p className="upload-error">{uploadError}</p>}
+      {reportError && <p className="upload-error">{reportError}</p>}
       <div className="dashboard-content">
         <aside className="history-panel">
           <h2>History (last 5)</h2>
@@ -120,8 +143,8 @@ export function Dashboard({ user, onLogout }) {
                   )
                 ))}
               </section>
-              <Charts summary={summary.summary} data={data} />
-              <DataTable data={data} />
+              <Charts summary={summary.summary} charts={charts} />
+              <DataTable datasetId={selectedId} />
             </>
           )}
           {!loading && !summary && selectedId && <p>No data for this dataset.</p>}
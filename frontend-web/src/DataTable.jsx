@@ -1,23 +1,94 @@
+import { useState, useEffect } from 'react'
+import { api } from './api'
 import './DataTable.css'
 
-export function DataTable({ data }) {
-  if (!data || data.length === 0) return null
-  const cols = Object.keys(data[0]).filter((k) => k && k !== 'undefined')
+const PAGE_SIZE = 100
+const FILTER_OPS = ['>=', '<=', '!=', '>', '<', '=']
+
+function parseFilter(col, text) {
+  const value = text.trim()
+  if (!value) return null
+  const op = FILTER_OPS.find((o) => value.startsWith(o))
+  return op ? [col, op, value.slice(op.length).trim()] : [col, '=', value]
+}
+
+export function DataTable({ datasetId }) {
+  const [page, setPage] = useState(null)
+  const [offset, setOffset] = useState(0)
+  const [sort, setSort] = useState('')
+  const [filterText, setFilterText] = useState({})
+  const [filters, setFilters] = useState([])
+  const [cols, setCols] = useState([])
+  const [error, setError] = useState('')
+
+  useEffect(() => {
+    setOffset(0)
+    setSort('')
+    setFilterText({})
+    setFilters([])
+    setCols([])
+  }, [datasetId])
+
+  useEffect(() => {
+    if (!datasetId) return
+    let cancelled = false
+    api.data(datasetId, { offset, limit: PAGE_SIZE, sort, filters })
+      .then((res) => {
+        if (cancelled) return
+        setPage(res)
+        setError('')
+        if (res.data?.length) setCols(Object.keys(res.data[0]).filter((k) => k && k !== 'undefined'))
+      })
+      .catch((e) => !cancelled && setError(e.message))
+    return () => { cancelled = true }
+  }, [datasetId, offset, sort, filters])
+
+  const rows = page?.data || []
+  if (!page || cols.length === 0) return null
+
+  const toggleSort = (c) => {
+    setOffset(0)
+    setSort(sort === c ? `-${c}` : c)
+  }
+
+  const applyFilters = (e) => {
+    e.preventDefault()
+    setOffset(0)
+    setFilters(Object.entries(filterText).map(([c, t]) => parseFilter(c, t)).filter(Boolean))
+  }
+
+  const filtered = page.filtered_count ?? rows.length
+  const last = Math.min(offset + PAGE_SIZE, filtered)
+
   return (
     <section className="data-table-section">
       <h2>Data Table</h2>
-      <div className="table-wrap">
+      {error && <p className="table-error">{error}</p>}
+      <form className="table-wrap" onSubmit={applyFilters}>
         <table className="data-table">
           <thead>
             <tr>
               {cols.map((c) => (
-                <th key={c}>{c}</th>
+                <th key={c} className="sortable" onClick={() => toggleSort(c)}>
+                  {c}{sort === c ? ' ▲' : sort === `-${c}` ? ' ▼' : ''}
+                </th>
+              ))}
+            </tr>
+            <tr className="filter-row">
+              {cols.map((c) => (
+                <th key={c}>
+                  <input
+                    placeholder="filter, e.g. >2.0"
+                    value={filterText[c] || ''}
+                    onChange={(e) => setFilterText({ ...filterText, [c]: e.target.value })}
+                  />
+                </th>
               ))}
             </tr>
           </thead>
           <tbody>
-            {data.map((row, i) => (
-              <tr key={i}>
+            {rows.map((row, i) => (
+              <tr key={offset + i}>
                 {cols.map((c) => (
                   <td key={c}>{row[c] ?? ''}</td>
                 ))}
@@ -25,6 +96,17 @@ export function DataTable({ data }) {
             ))}
           </tbody>
         </table>
+        <button type="submit" hidden />
+      </form>
+      <div className="table-pager">
+        <span>
+          {filtered ? `${offset + 1}–${last}` : 0} of {filtered}
+          {filtered !== page.total_count && ` (filtered from ${page.total_count})`}
+        </span>
+        <button type="button" className="btn btn-outline" disabled={offset === 0}
+          onClick={() => setOffset(Math.max(0, offset - PAGE_SIZE))}>Previous</button>
+        <button type="button" className="btn btn-outline" disabled={last >= filtered}
+          onClick={() => setOffset(offset + PAGE_SIZE)}>Next</button>
       </div>
     </section>
   )
@@ -13,6 +13,87 @@ function headers(includeAuth = false) {
   return h
 }
 
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+const UPLOAD_PARALLEL = 3
+const UPLOAD_RETRIES = 4
+const REPORT_POLL_MS = 5000
+const REPORT_WAIT_MS = 5 * 60 * 1000
+
+async function jsonOrThrow(res, fallback) {
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({}))
+    throw new Error(err.error || fallback)
+  }
+  return res.json()
+}
+
+async function sha256Hex(blob) {
+  const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer())
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('')
+}
+
+async function uploadChunked(file, name, onProgress) {
+  const auth = { Authorization: `Token ${getToken()}` }
+  // Remember the session per file so a retried upload resumes from the chunks already sent.
+  const stateKey = `upload:${file.name}:${file.size}:${file.lastModified}`
+  let session = null
+  const savedId = localStorage.getItem(stateKey)
+  if (savedId) {
+    const res = await fetch(`${BASE}/uploads/${savedId}/`, { headers: auth })
+    if (res.ok) session = await res.json()
+    if (session && session.status !== 'open') session = null
+  }
+  if (!session) {
+    const res = await fetch(`${BASE}/uploads/`, {
+      method: 'POST',
+      headers: { ...auth, 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size, name, chunk_size: UPLOAD_CHUNK_BYTES }),
+    })
+    session = await jsonOrThrow(res, 'Upload failed')
+    localStorage.setItem(stateKey, session.id)
+  }
+  const chunkBytes = (i) => Math.min(session.chunk_size, file.size - i * session.chunk_size)
+  const received = new Set(session.received)
+  const todo = []
+  for (let i = 0; i < session.chunk_count; i++) if (!received.has(i)) todo.push(i)
+  let sent = [...received].reduce((n, i) => n + chunkBytes(i), 0)
+  onProgress?.(sent, file.size)
+
+  const sendChunk = async (i) => {
+    const blob = file.slice(i * session.chunk_size, i * session.chunk_size + chunkBytes(i))
+    const sha = await sha256Hex(blob)
+    for (let attempt = 0; ; attempt++) {
+      let res = null
+      try {
+        res = await fetch(`${BASE}/uploads/${session.id}/chunks/${i}/`, {
+          method: 'PUT',
+          headers: { ...auth, 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': sha },
+          body: blob,
+        })
+      } catch (err) {
+        if (attempt + 1 >= UPLOAD_RETRIES) throw err
+      }
+      if (res && res.status < 500) {
+        await jsonOrThrow(res, `Chunk ${i} failed`)
+        break
+      }
+      if (attempt + 1 >= UPLOAD_RETRIES) throw new Error(`Chunk ${i} failed`)
+      await new Promise((r) => setTimeout(r, 500 * 2 ** attempt))
+    }
+    sent += chunkBytes(i)
+    onProgress?.(sent, file.size)
+  }
+  const workers = Array.from({ length: UPLOAD_PARALLEL }, async () => {
+    while (todo.length) await sendChunk(todo.shift())
+  })
+  await Promise.all(workers)
+
+  const res = await fetch(`${BASE}/uploads/${session.id}/complete/`, { method: 'POST', headers: auth })
+  const result = await jsonOrThrow(res, 'Upload failed')
+  localStorage.removeItem(stateKey)
+  return result
+}
+
 export const api = {
   async login(username, password) {
     const res = await fetch(`${BASE}/auth/login/`, {
@@ -40,7 +121,12 @@ export const api = {
     return res.json()
   },
 
-  async upload(file, name) {
+  // Files larger than one chunk go through the chunked, resumable protocol when the
+  // browser can hash them (crypto.subtle needs a secure context or localhost).
+  async upload(file, name, { onProgress } = {}) {
+    if (file.size > UPLOAD_CHUNK_BYTES && window.crypto?.subtle) {
+      return uploadChunked(file, name, onProgress)
+    }
     const form = new FormData()
     form.append('file', file)
     if (name) form.append('name', name)
@@ -68,13 +154,44 @@ export const api = {
     return res.json()
   },
 
-  async data(id) {
-    const res = await fetch(`${BASE}/data/${id}/`)
+  async charts(id, points) {
+    const qs = points ? `?points=${points}` : ''
+    const res = await fetch(`${BASE}/charts/${id}/${qs}`)
+    if (!res.ok) throw new Error('Failed to load charts')
+    return res.json()
+  },
+
+  async data(id, { offset, limit, sort, filters } = {}) {
+    const parts = []
+    if (offset != null) parts.push(`offset=${offset}`)
+    if (limit != null) parts.push(`limit=${limit}`)
+    if (sort) parts.push(`sort=${encodeURIComponent(sort)}`)
+    for (const [col, op, value] of filters || []) {
+      parts.push(`${encodeURIComponent(col)}${encodeURIComponent(op)}${encodeURIComponent(value)}`)
+    }
+    const qs = parts.length ? `?${parts.join('&')}` : ''
+    const res = await fetch(`${BASE}/data/${id}/${qs}`)
     if (!res.ok) throw new Error('Failed to load data')
     return res.json()
   },
 
-  reportPdfUrl(id) {
-    return `${BASE}/report/${id}/pdf/?token=${getToken()}`
+  // Reports are rendered in the background: the backend answers 202 with Retry-After
+  // until the PDF is ready, so this polls and resolves with the PDF as a Blob.
+  async reportPdf(id, { onPending } = {}) {
+    const deadline = Date.now() + REPORT_WAIT_MS
+    for (;;) {
+      const res = await fetch(`${BASE}/report/${id}/pdf/`, { headers: { Authorization: `Token ${getToken()}` } })
+      if (res.status !== 202) {
+        if (!res.ok) {
+          const err = await res.json().catch(() => ({}))
+          throw new Error(err.error || 'Failed to download report')
+        }
+        return res.blob()
+      }
+      onPending?.()
+      const delay = (Number(res.headers.get('Retry-After')) || REPORT_POLL_MS / 1000) * 1000
+      if (Date.now() + delay > deadline) throw new Error('The report is still rendering. Try again later.')
+      await new Promise((r) => setTimeout(r, delay))
+    }
   },
 }